@@ -7,15 +7,20 @@
 
 # [ Imports ]
 # [ -Python ]
+import functools
+import json
+import pathlib
 import sys
 # [ -Third Party ]
-import runaway
 from runaway import signals
 from runaway.extras import looping
 import wrapt
 # [ -Project ]
-from .shell import VCS, Config, ToolRunner, ContextManager, Cancellation
+from .shell import VCS, Config, ToolRunner, ContextManager, Cancellation, ResultCache, Watcher
 from .plugger import Plugger
+from . import daemon, reactor, worker
+from .plugins import events
+from .plugins.state_store import StateStore
 
 
 # [ Internal ]
@@ -52,6 +57,9 @@ class Core:
         config: Config,
         tool_runner: ToolRunner,
         context_manager: ContextManager,
+        result_cache: ResultCache,
+        watcher: Watcher,
+        state: StateStore,
     ):
         """Init the state."""
         self._vcs = vcs
@@ -59,41 +67,49 @@ class Core:
         self._config = config
         self._tool_runner = tool_runner
         self._context_manager = context_manager
+        self._result_cache = result_cache
+        self._watcher = watcher
+        self._server = None
+        self._reruns = set()
+        self.tool_state = {}
+        self._state = state
+        # the published state is only rebuilt once the store's changed, or the poll interval has
+        self._state_changed = True
+        self._poll_seconds = None
+        state.subscribe(self._on_state_change)
 
     # [ API ]
     async def main(self):
-        """Run a single loop."""
-        tools = await looping.do_while(
-            self._ensure_updated_tools_running,
-            self._should_loop,
-            [],
-        )
-        await self._vcs.cleanup()
-        await self._tool_runner.cleanup()
-        return max(await self._tool_runner.return_codes(tools), default=0)
-
-    # [ Internal ]
-    async def _should_loop(self, tools):
-        """Return whether the app should loop."""
-        return (
-            not await signals.call(self._cancellation.cancelled) and (
-                await signals.call(self._config.loop_forever) or
-                await signals.call(self._vcs.vcs_running) or (
-                    await signals.call(self._config.loop_till_pass) and
-                    not await signals.call(self._tool_runner.all_tools_passed, tools)
-                ) or
-                await signals.call(self._tool_runner.any_tools_not_done)
-            )
-        )
+        """Run the command given on the CLI."""
+        command, arguments = await self._config.get_command()
+        if command == 'show':
+            return await self._tool_runner.show_output(*arguments)
+        if command == 'stats':
+            return await self._tool_runner.show_stats(arguments)
+        if command == 'status':
+            return await self._show_status()
+        if command == 'daemon':
+            return await self._serve()
+        # only a watch which runs forever is the daemon's to serve - a batch run reports its own tools' results
+        if await signals.call(self._config.loop_forever):
+            client = daemon.connect()
+            if client is not None:
+                return await self._attach(client)
+        return await self._watch()
 
     @retry
-    async def _ensure_updated_tools_running(self, _state):
-        """Ensure updated tools are running, if any, else wait."""
-        # detail - needed to not peg CPU/disk with requests/tasks more frequently than necessary
-        await signals.sleep(1)
+    async def tick(self):
+        """
+        Ensure updated tools are running, if any, and commit, if they all passed, returning the tools.
 
+        This is one step of the watch loop - the loop waits for something to react to,
+        ticks, and goes on while it should loop, then finishes.
+        """
         # details - needed for sync'd data for starting/stopping/checking tools
         config = await self._config.get_config()
+        # detail - watched before hashing, so changes made while hashing aren't missed
+        await self._watcher.watch(config)
+        await self._tool_runner.configure_output(config)
         context_data = await self._context_manager.get_tool_context_data(config)
 
         # tool state ID
@@ -105,10 +121,15 @@ class Core:
             context_data,
             tools_to_run=tools_with_changed_contexts,
         )
-        tools_to_run = self._context_manager.contexts_in_a_and_not_b(
+        tools_to_check = self._context_manager.contexts_in_a_and_not_b(
             a_context=tools_with_changed_contexts,
             b_context=tools_with_failing_preconditions,
         )
+        cached_results = await self._result_cache.get_cached_results(tools_to_check, config=config)
+        tools_to_run = self._context_manager.contexts_in_a_and_not_b(
+            a_context=tools_to_check,
+            b_context=cached_results,
+        )
 
         # replay valid results
         await self._tool_runner.replay_previous_results_for(unreported_unchanged_tools)
@@ -116,32 +137,346 @@ class Core:
         # starting/stopping tools
         await self._tool_runner.ensure_tools_stopped(tools_with_failing_preconditions, reason="failing preconditions")
         await self._tool_runner.ensure_stale_tools_stopped(tools_with_changed_contexts)
-        await self._tool_runner.ensure_tools_stopped(tools_with_unchanged_contexts, reason="reverted files")
+        # detail - tools rerun on request are unchanged, but mustn't be stopped as reverted
+        requested_tools = self._take_reruns(context_data)
+        await self._tool_runner.ensure_tools_stopped(requested_tools, reason="rerun requested")
+        tools_to_run = {**tools_to_run, **requested_tools}
+        await self._tool_runner.ensure_tools_stopped(
+            self._context_manager.contexts_in_a_and_not_b(a_context=tools_with_unchanged_contexts, b_context=self._reruns),
+            reason="reverted files",
+        )
         await self._tool_runner.ensure_removed_tools_stopped(config)
-        await self._tool_runner.ensure_tools_running(tools_to_run, on_completion=self._context_manager.save_context)
+        await self._tool_runner.ensure_tools_stopped(cached_results, reason="cached results")
+        await self._tool_runner.replay_cached_results(cached_results, on_completion=self._context_manager.save_context)
+        await self._tool_runner.ensure_tools_running(
+            tools_to_run,
+            on_completion=functools.partial(self._save_tool_result, config=config),
+        )
 
-        # detail - needed for vcs to determine whether to run/stop
-        tool_state = await self._tool_runner.get_tool_state()
+        poll_seconds = await self._watcher.get_poll_seconds()
+        if self._state_changed or poll_seconds != self._poll_seconds:
+            self._state_changed = False
+            self._poll_seconds = poll_seconds
+            tool_state = await self._tool_runner.get_tool_state()
+            if poll_seconds is not None:
+                # how stale a polled tool's result may be, for prompts and status bars
+                tool_state = {t: {**s, 'poll seconds': poll_seconds} for t, s in tool_state.items()}
+            self.tool_state = tool_state
+            if self._server is not None:
+                self._server.publish_state(tool_state)
 
-        # VCS - commit to source control
-        await self._vcs.update_vcs(config, tool_state=tool_state)
+        # VCS - commit to source control, as the tool states in the store call for
+        await self._vcs.update_vcs(config)
         # XXX what about when the VCS fails?  What about when any shell command raises?  There need to be guards in place.
         # need general debug output saved to a file, and return 1
 
         # detail - need a return state for the outer loop
         return await self._config.get_tools(config)
 
+    async def should_loop(self, _tools):
+        """Return whether the app should loop - each check is O(1), answered from the state store, or the cached config."""
+        return (
+            not await signals.call(self._cancellation.cancelled) and (
+                self._server is not None or
+                await signals.call(self._config.loop_forever) or
+                await signals.call(self._vcs.vcs_running) or (
+                    await signals.call(self._config.loop_till_pass) and
+                    not await signals.call(self._tool_runner.all_tools_passed)
+                ) or
+                await signals.call(self._tool_runner.any_tools_not_done)
+            )
+        )
+
+    async def finish(self, tools):
+        """Clean up the vcs and tools, write the reports, and return the max return code of the tools."""
+        await self._vcs.cleanup()
+        await self._tool_runner.cleanup()
+        await self._tool_runner.write_reports(await self._config.get_config())
+        return max(await self._tool_runner.return_codes(tools), default=0)
+
+    # [ Internal ]
+    async def _watch(self):
+        """Watch, run, and commit, until done looping."""
+        if self._server is None and not await signals.call(self._config.loop_forever):
+            tools = await self._run_batch()
+            if not await self._should_watch_after_batch():
+                return await self.finish(tools)
+        tools = await looping.do_while(
+            self._ensure_updated_tools_running,
+            self.should_loop,
+            None,
+        )
+        return await self.finish(tools)
+
+    async def _run_batch(self):
+        """
+        Run every changed tool once, as a batch, returning the tools.
+
+        Contexts are computed once, up front, and nothing is watched.  Each tool is
+        started the moment its preconditions have passed, and skipped the moment any of
+        them fails, and the batch is done the moment the last tool is.
+        """
+        config = await self._config.get_config()
+        await self._tool_runner.configure_output(config)
+        context_data = await self._context_manager.get_tool_context_data(config)
+        await self._tool_runner.replay_previous_results_for(
+            self._context_manager.get_tools_unchanged_since_last_results(context_data),
+        )
+        pending = dict(self._context_manager.get_tools_changed_since_last_save(context_data))
+        on_completion = functools.partial(self._save_tool_result, config=config)
+        while not await signals.call(self._cancellation.cancelled):
+            ready, blocked = split_batch(pending, tool_state=await self._tool_runner.get_tool_state())
+            for this_tool in {**ready, **blocked}:
+                del pending[this_tool]
+            if blocked:
+                print(f"Skipping tools with failing preconditions: {list(blocked)}")
+                for this_tool in blocked:
+                    events.emit(config['root'], {'event': 'tool skipped', 'tool': this_tool, 'reason': "failing preconditions"})
+            cached_results = await self._result_cache.get_cached_results(ready, config=config)
+            await self._tool_runner.replay_cached_results(cached_results, on_completion=self._context_manager.save_context)
+            await self._tool_runner.ensure_tools_running(
+                self._context_manager.contexts_in_a_and_not_b(a_context=ready, b_context=cached_results),
+                on_completion=on_completion,
+            )
+            if not pending and not self._state.any_running():
+                break
+            if not ready and not blocked:
+                # detail - tools notify the reactor as they finish, as does a CTRL-C
+                await reactor.wait_readable([reactor.get_notify_fd()])
+                reactor.clear_notifications()
+        await self._vcs.update_vcs(config)
+        return await self._config.get_tools(config)
+
+    async def _should_watch_after_batch(self):
+        """Return whether to go on to watch, after the batch - to wait for a commit, or for the tools to pass."""
+        return not await signals.call(self._cancellation.cancelled) and (
+            await signals.call(self._vcs.vcs_running) or (
+                await signals.call(self._config.loop_till_pass) and
+                not await signals.call(self._tool_runner.all_tools_passed)
+            )
+        )
+
+    async def _serve(self):
+        """Watch, run, and commit, forever, serving the state and output to clients."""
+        server = daemon.Server()
+        try:
+            server.start()
+        except RuntimeError as error:
+            print(f"Can't serve: {error}.")
+            return 1
+        self._server = server
+        try:
+            return await self._watch()
+        finally:
+            self._server.close()
+
+    async def _attach(self, client):
+        """
+        Attach to the repository's daemon, instead of watching the repository again.
+
+        The daemon's output is written as it arrives, and lines from stdin are sent as
+        answers to its commit prompt.  CTRL-C detaches, leaving the daemon running.
+        """
+        print("Attaching to the pocketwalk daemon for this repository - CTRL-C to detach.")
+        client.sendall(daemon.encode_event({'op': 'subscribe'}))
+        stdin = [sys.stdin] if sys.stdin.isatty() else []
+        buffered = b''
+        while not await signals.call(self._cancellation.cancelled):
+            ready = await reactor.wait_readable([client, reactor.get_notify_fd()] + stdin)
+            if reactor.get_notify_fd() in ready:
+                reactor.clear_notifications()
+            if sys.stdin in ready:
+                client.sendall(daemon.encode_event({'op': 'answer', 'text': sys.stdin.readline().rstrip()}))
+            if client in ready:
+                data = client.recv(65536)
+                if not data:
+                    print("The daemon stopped.")
+                    break
+                *lines, buffered = (buffered + data).split(b'\n')
+                for event in (daemon.decode_event(this_line) for this_line in lines if this_line.strip()):
+                    if event['event'] == 'output':
+                        sys.stdout.buffer.write(event['data'])
+                sys.stdout.flush()
+        client.close()
+        return 0
+
+    @staticmethod
+    async def _show_status():
+        """Print the tool state from the repository's daemon, returning 1 if none is running."""
+        client = daemon.connect()
+        if client is None:
+            print("No pocketwalk daemon is running for this repository.")
+            return 1
+        client.sendall(daemon.encode_event({'op': 'state'}))
+        with client, client.makefile('rb') as replies:
+            print(json.dumps(daemon.decode_event(replies.readline())['tools'], sort_keys=True))
+        return 0
+
+    def _on_state_change(self, key, _old, _new):
+        """Note that the tool states changed, so they're published again."""
+        if key[0] == 'tool':
+            self._state_changed = True
+
+    async def _ensure_updated_tools_running(self, tools):
+        """Ensure updated tools are running, if any, after waiting for something to react to."""
+        # detail - there's nothing new to react to until a file changes, a tool or commit finishes,
+        # or the run is cancelled.  There's no previous iteration to react to on the first one.
+        if tools is not None:
+            await self._watcher.wait_for_events()
+        return await self.tick()
+
+    def _take_reruns(self, context_data):
+        """Take the tools clients of the daemon requested reruns of, with their current contexts."""
+        if self._server is None:
+            return {}
+        requested = self._server.take_reruns()
+        self._reruns |= requested
+        return {t: c for t, c in context_data['current_state'].items() if t in requested}
+
+    async def _save_tool_result(self, tool, *, context, result, config, stale=False):
+        """
+        Save the tool's context, and cache its result for that context.
+
+        A stale run's context is no longer the tool's current one, so only its result is cached.
+        """
+        if not stale:
+            self._reruns.discard(tool)
+            await self._context_manager.save_context(tool, context=context)
+        await self._result_cache.save_result(tool, context=context, result=result, config=config)
+
+
+def split_batch(pending, *, tool_state):
+    """
+    Split the batch's pending tools into those ready to run, and those blocked by their preconditions.
+
+    Pending maps the tools to their contexts.  A tool is ready once all of its preconditions
+    have passed, and blocked once any has failed or been blocked itself.  The rest wait -
+    unless nothing is running, in which case their preconditions can never pass.
+    """
+    ready, blocked = {}, {}
+    for tool, context in pending.items():
+        states = {p: tool_state.get(p, None) for p in context['preconditions']}
+        if all(s is not None and s['return code'] == 0 for s in states.values()):
+            ready[tool] = context
+        elif any(
+            (s is None and p not in pending) or (s is not None and s['return code'] not in (0, None))
+            for p, s in states.items()
+        ):
+            blocked[tool] = context
+    if not ready and not blocked and not any(s['running'] for s in tool_state.values()):
+        blocked = dict(pending)
+    return ready, blocked
+
+
+def get_project_labels(roots):
+    """
+    Label each project by as many of its root's trailing path components as it takes to tell it from the others.
+
+    The roots are resolved paths - `a/app` and `b/app` are labelled as such, rather than both as `app`.
+    """
+    paths = [pathlib.PurePath(r) for r in roots]
+    labels = {}
+    for path in paths:
+        for depth in range(1, len(path.parts) + 1):
+            label = str(pathlib.PurePath(*path.parts[-depth:]))
+            if sum(str(pathlib.PurePath(*p.parts[-depth:])) == label for p in paths) == 1:
+                break
+        labels[str(path)] = label
+    return labels
+
+
+def get_project_status(tool_state):
+    """Get a one-word summary of a project's tool state - running, failing, passing, or idle."""
+    if any(t['running'] for t in tool_state.values()):
+        return 'running'
+    if any(t['return code'] not in (0, None) for t in tool_state.values()):
+        return 'failing'
+    if tool_state:
+        return 'passing'
+    return 'idle'
+
+
+class Workspace:
+    """
+    Pocketwalk workspace - several projects, watched and run from one process.
+
+    Each project has a core of its own, with its own config, contexts, results, and
+    commits, but they all share one watcher and one cancellation, and their tool runners
+    share a fair-share pool of tool slots and one renderer.  One loop ticks every
+    project's core, then waits for the next change in any of them.
+    """
+
+    def __init__(self, *, cores, labels, watcher: Watcher):
+        """Init the state."""
+        self._cores = cores
+        self._labels = labels
+        self._watcher = watcher
+        self._status = None
+
+    # [ API ]
+    async def main(self):
+        """Watch, run, and commit, in every project, until none of them are done looping."""
+        tools = dict.fromkeys(self._cores.values())
+        looping_cores = list(self._cores.values())
+        while looping_cores:
+            if any(t is not None for t in tools.values()):
+                await self._watcher.wait_for_events()
+            for this_core in looping_cores:
+                tools[this_core] = await this_core.tick()
+            self._show_status()
+            looping_cores = [c for c in looping_cores if await c.should_loop(tools[c])]
+        return max([await c.finish(t) for c, t in tools.items()], default=0)
+
+    # [ Internal ]
+    def _show_status(self):
+        """Show each project's status, if any changed."""
+        status = ' | '.join(
+            f"{self._labels[root]}: {get_project_status(this_core.tool_state)}"
+            for root, this_core in self._cores.items()
+        )
+        if status != self._status:
+            print(f"[workspace] {status}")
+            self._status = status
+
 
 # [ Main ]
 def main():
     """Main."""
     plugger = Plugger('pocketwalk')
+    config = plugger.resolve(Config)
+    cancellation = plugger.resolve(Cancellation)
+    watcher = plugger.resolve(Watcher)
+    command, arguments = reactor.run(config.get_command())
+    if command == 'worker':
+        sys.exit(worker.main(arguments))
+    if command == 'workspace':
+        shared = {}
+        cores = {}
+        labels = get_project_labels(arguments)
+        for root in arguments:
+            state = StateStore()
+            cores[root] = Core(
+                vcs=plugger.resolve(VCS, root=root, state=state),
+                config=plugger.resolve(Config, root=root),
+                tool_runner=plugger.resolve(ToolRunner, root=root, shared=shared, state=state, label=labels[root]),
+                context_manager=plugger.resolve(ContextManager, root=root),
+                cancellation=cancellation,
+                result_cache=plugger.resolve(ResultCache, root=root),
+                watcher=watcher,
+                state=state,
+            )
+        sys.exit(reactor.run(Workspace(cores=cores, labels=labels, watcher=watcher).main()))
+
+    state = StateStore()
     core = Core(
-        vcs=plugger.resolve(VCS),
-        config=plugger.resolve(Config),
-        tool_runner=plugger.resolve(ToolRunner),
+        vcs=plugger.resolve(VCS, state=state),
+        config=config,
+        tool_runner=plugger.resolve(ToolRunner, state=state),
         context_manager=plugger.resolve(ContextManager),
-        cancellation=plugger.resolve(Cancellation),
+        cancellation=cancellation,
+        result_cache=plugger.resolve(ResultCache),
+        watcher=watcher,
+        state=state,
     )
 
-    sys.exit(runaway.run(core.main()))
+    sys.exit(reactor.run(core.main()))
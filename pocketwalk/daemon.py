@@ -0,0 +1,325 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk daemon.
+
+A daemon owns the watch loop for a repository, and serves it to thin clients -
+editors, shell prompts, and other `pocketwalk` invocations in the same repo -
+over a unix socket in the repository's cache.
+
+The protocol is newline-delimited JSON.  Clients send requests:
+
+* `{"op": "subscribe"}` - stream the daemon's output and tool state events
+* `{"op": "state"}` - get the current tool state, once
+* `{"op": "rerun", "tools": [...]}` - rerun the tools, even if unchanged
+* `{"op": "answer", "text": "..."}` - answer the commit prompt
+
+And receive events:
+
+* `{"event": "output", "data": "..."}` - output, as latin-1, so any bytes round-trip
+* `{"event": "state", "tools": {...}}` - each tool's running state, return code, and failure reason
+
+The daemon takes over its own stdin and stdout: everything it writes to stdout is
+still written to its terminal, and is also streamed to subscribers, and the
+answers clients send are what its commit prompt reads.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import json
+import os
+import pathlib
+import select
+import selectors
+import socket
+import sys
+import threading
+# [ -Project ]
+from pocketwalk import reactor
+
+
+# [ Static ]
+# relative, because unix socket paths are limited to ~100 bytes
+_SOCKET_PATH = pathlib.Path('.pocketwalk.cache') / 'daemon.sock'
+# a client sending a request longer than this, without a newline, is dropped
+_MAX_REQUEST_BYTES = 64 * 1024
+# a client which falls further behind than this is dropped
+_MAX_OUTGOING_BYTES = 4 * 1024 * 1024
+# how long the last of the output may take to send to each client, once the server's stopping
+_CLOSE_TIMEOUT_SECONDS = 1
+_STOP = b's'
+_WAKE = b'w'
+
+
+# [ API ]
+def encode_event(event):
+    """Encode the event, or request, as a line of JSON."""
+    if isinstance(event.get('data', None), bytes):
+        event = dict(event, data=event['data'].decode('latin-1'))
+    return json.dumps(event).encode('utf-8') + b'\n'
+
+
+def decode_event(line):
+    """Decode the line of JSON as an event, or request."""
+    event = json.loads(line.decode('utf-8'))
+    if event.get('event', None) == 'output':
+        event['data'] = event['data'].encode('latin-1')
+    return event
+
+
+def connect():
+    """Connect to the repository's daemon, returning the socket, or None, if no daemon is running."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(str(_SOCKET_PATH))
+    except (FileNotFoundError, ConnectionRefusedError):
+        client.close()
+        return None
+    return client
+
+
+class Server:
+    """
+    Daemon server.
+
+    Requests are served, and output and state are streamed, from a dedicated thread,
+    which owns every client socket, so clients never hold up the watch loop.  Requested
+    reruns are handed to the loop via `take_reruns`, after waking it through the reactor.
+
+    Clients are never sent to blocking - what's sent to each is buffered, and written as
+    the client's socket takes it, so a slow client can't hold up the others, and a
+    client which falls too far behind is dropped.
+    """
+
+    def __init__(self):
+        """Init the state."""
+        self._listener = None
+        self._selector = selectors.DefaultSelector()
+        self._subscribers = set()
+        # each client's partial request, and what's waiting to be sent to it
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._reruns = set()
+        self._state = {}
+        self._state_changed = False
+        self._terminal_fd = None
+        self._output_fd = None
+        self._answer_fd = None
+        self._wake_read, self._wake_write = os.pipe()
+        self._thread = None
+
+    # [ API ]
+    def start(self):
+        """
+        Start serving, taking over stdin and stdout.
+
+        Raises RuntimeError if a daemon's already serving the repository.
+        """
+        running = connect()
+        if running is not None:
+            running.close()
+            raise RuntimeError(f"a pocketwalk daemon is already serving this repository, on {_SOCKET_PATH}")
+        _SOCKET_PATH.parent.mkdir(parents=True, exist_ok=True)
+        # a socket file nothing's listening on is left over from a daemon which didn't exit cleanly
+        _SOCKET_PATH.unlink(missing_ok=True)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(str(_SOCKET_PATH))
+        self._listener.listen()
+        self._take_over_stdio()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        self._selector.register(self._output_fd, selectors.EVENT_READ)
+        self._selector.register(self._wake_read, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._serve, name='pocketwalk-daemon', daemon=True)
+        self._thread.start()
+        print(f"Serving on {_SOCKET_PATH}.")
+
+    def close(self):
+        """Stop serving, and give stdout back."""
+        if self._thread is None:
+            return
+        sys.stdout.flush()
+        # everything written so far is streamed before the server stops
+        os.dup2(self._terminal_fd, sys.stdout.fileno())
+        os.write(self._wake_write, _STOP)
+        self._thread.join()
+        self._thread = None
+        self._listener.close()
+        _SOCKET_PATH.unlink(missing_ok=True)
+
+    def publish_state(self, tool_state):
+        """Publish the tool state to subscribers, if it changed."""
+        with self._lock:
+            if tool_state == self._state:
+                return
+            self._state = tool_state
+            self._state_changed = True
+        os.write(self._wake_write, _WAKE)
+
+    def take_reruns(self):
+        """Take the tools clients requested reruns of since the last call."""
+        with self._lock:
+            reruns, self._reruns = self._reruns, set()
+        return reruns
+
+    # [ Internal ]
+    def _take_over_stdio(self):
+        """
+        Take over stdin and stdout.
+
+        Stdout is replaced with a pipe the server reads, and writes on to the terminal
+        and subscribers.  Stdin is replaced with a pipe the server writes clients' answers to.
+        """
+        sys.stdout.flush()
+        self._terminal_fd = os.dup(sys.stdout.fileno())
+        self._output_fd, output_write = os.pipe()
+        os.dup2(output_write, sys.stdout.fileno())
+        os.close(output_write)
+        answer_read, self._answer_fd = os.pipe()
+        sys.stdin = os.fdopen(answer_read, 'r')
+
+    def _serve(self):
+        """Serve until stopped."""
+        while True:
+            for key, mask in self._selector.select():
+                if key.fileobj is self._wake_read:
+                    if _STOP in os.read(self._wake_read, 4096):
+                        self._stream_output()
+                        self._flush_all()
+                        return
+                    self._stream_state()
+                elif key.fileobj is self._listener:
+                    self._accept()
+                elif key.fileobj is self._output_fd:
+                    self._stream_output()
+                else:
+                    # the client may have been dropped while handling an earlier key
+                    if mask & selectors.EVENT_WRITE and key.fileobj in self._clients:
+                        self._flush(key.fileobj)
+                    if mask & selectors.EVENT_READ and key.fileobj in self._clients:
+                        self._read_requests(key.fileobj)
+
+    def _accept(self):
+        """Accept a client."""
+        client, _address = self._listener.accept()
+        client.setblocking(False)
+        self._clients[client] = {'incoming': b'', 'outgoing': b''}
+        self._selector.register(client, selectors.EVENT_READ)
+
+    def _stream_output(self):
+        """Write the output waiting on the stdout pipe to the terminal, and stream it to subscribers."""
+        while select.select([self._output_fd], [], [], 0)[0]:
+            data = os.read(self._output_fd, 65536)
+            if not data:
+                return
+            try:
+                os.write(self._terminal_fd, data)
+            except OSError:
+                # the daemon's terminal may be gone - the clients still get the output
+                pass
+            self._broadcast({'event': 'output', 'data': data})
+
+    def _stream_state(self):
+        """Stream the tool state to subscribers, if it changed."""
+        with self._lock:
+            changed, self._state_changed = self._state_changed, False
+            state = self._state
+        if changed:
+            self._broadcast({'event': 'state', 'tools': state})
+
+    def _read_requests(self, client):
+        """Read and handle the requests waiting from the client."""
+        try:
+            data = client.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(client)
+            return
+        lines = (self._clients[client]['incoming'] + data).split(b'\n')
+        if len(lines[-1]) > _MAX_REQUEST_BYTES:
+            self._drop(client)
+            return
+        self._clients[client]['incoming'] = lines[-1]
+        for line in lines[:-1]:
+            if not line.strip():
+                continue
+            try:
+                self._handle(client, decode_event(line))
+            # a malformed request mustn't take the server down with it - only the client which sent it
+            except (ValueError, KeyError, TypeError, AttributeError):
+                self._drop(client)
+                return
+
+    def _handle(self, client, request):
+        """Handle the client's request."""
+        if request['op'] == 'subscribe':
+            self._subscribers.add(client)
+            with self._lock:
+                state = self._state
+            self._send(client, {'event': 'state', 'tools': state})
+        elif request['op'] == 'state':
+            with self._lock:
+                state = self._state
+            self._send(client, {'event': 'state', 'tools': state})
+        elif request['op'] == 'rerun':
+            # a string would be taken as a set of one-letter tools
+            if not isinstance(request['tools'], list) or not all(isinstance(t, str) for t in request['tools']):
+                raise TypeError(f"the tools to rerun must be a list of names, not {request['tools']!r}")
+            with self._lock:
+                self._reruns.update(request['tools'])
+            reactor.notify()
+        elif request['op'] == 'answer':
+            os.write(self._answer_fd, request['text'].encode('utf-8') + b'\n')
+
+    def _broadcast(self, event):
+        """Send the event to every subscriber."""
+        for client in list(self._subscribers):
+            self._send(client, event)
+
+    def _send(self, client, event):
+        """Queue the event to send to the client, dropping clients which can't keep up."""
+        if client not in self._clients:
+            return
+        outgoing = self._clients[client]['outgoing'] + encode_event(event)
+        if len(outgoing) > _MAX_OUTGOING_BYTES:
+            self._drop(client)
+            return
+        self._clients[client]['outgoing'] = outgoing
+        self._flush(client)
+
+    def _flush(self, client):
+        """Send as much of what's waiting for the client as its socket takes, and wait to send the rest, if any."""
+        outgoing = self._clients[client]['outgoing']
+        try:
+            sent = client.send(outgoing) if outgoing else 0
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._drop(client)
+            return
+        self._clients[client]['outgoing'] = outgoing[sent:]
+        waiting = selectors.EVENT_READ | (selectors.EVENT_WRITE if outgoing[sent:] else 0)
+        if self._selector.get_key(client).events != waiting:
+            self._selector.modify(client, waiting)
+
+    def _flush_all(self):
+        """Send what's waiting for every client, giving each a little time to take it, as the server stops."""
+        for client, buffers in self._clients.items():
+            if buffers['outgoing']:
+                client.settimeout(_CLOSE_TIMEOUT_SECONDS)
+                try:
+                    client.sendall(buffers['outgoing'])
+                except OSError:
+                    pass
+
+    def _drop(self, client):
+        """Drop the client."""
+        self._subscribers.discard(client)
+        if self._clients.pop(client, None) is not None:
+            self._selector.unregister(client)
+            client.close()
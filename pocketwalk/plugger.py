@@ -12,7 +12,6 @@ import pkg_resources
 # [ API ]
 # XXX validate function signatures & raise an exception if the chosen plugin doesn't match.
 # XXX validate function typing & raise if the chosen plugin doesn't match.
-# XXX allow multiple plugins for things that can just be called in parallel
 # XXX supply a default conflict resolver, and allow overrides
 class Plugger:
     """Plugin management tool."""
@@ -22,7 +21,7 @@ class Plugger:
         self._namespace = namespace
 
     # [ API ]
-    def resolve(self, target):
+    def resolve(self, target, **kwargs):
         """
         Resolve the plugin for the given target.
 
@@ -30,14 +29,15 @@ class Plugger:
         The namespace for the entry points will be {init-namespace}_{target-name},
         all lower-cased.
 
-        The function/class the plugin resolves to will be called with no arguments.
+        The function/class the plugin resolves to will be called with the given keyword
+        arguments, if any.
         """
         plugins = {}
         namespace = f'{self._namespace.lower()}_{target.__name__.lower()}'
         print(f"Loading plugins for {namespace}...")
         for entry_point in pkg_resources.iter_entry_points(namespace):
             print(f"  {entry_point.name}")
-            plugins[entry_point.name] = entry_point.load()()
+            plugins[entry_point.name] = entry_point.load()(**kwargs)
 
         num_plugins = len(plugins)
         if 1 < num_plugins:
@@ -46,3 +46,18 @@ class Plugger:
             raise RuntimeError(f"No plugins found for {namespace}")
 
         return list(plugins.values())[0]
+
+    def resolve_all(self, target, **kwargs):
+        """
+        Resolve all the plugins for the given target.
+
+        Plugins are discovered/loaded as for `resolve`, but any number of plugins,
+        including none at all, may be found.
+        """
+        plugins = []
+        namespace = f'{self._namespace.lower()}_{target.__name__.lower()}'
+        print(f"Loading plugins for {namespace}...")
+        for entry_point in pkg_resources.iter_entry_points(namespace):
+            print(f"  {entry_point.name}")
+            plugins.append(entry_point.load()(**kwargs))
+        return plugins
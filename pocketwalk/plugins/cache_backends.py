@@ -0,0 +1,116 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""Pocketwalk shared cache backends."""
+
+
+# [ Imports ]
+# [ -Python ]
+import os
+import pathlib
+import tempfile
+import urllib.error
+import urllib.request
+
+
+# [ Static ]
+_HTTP_TIMEOUT = 10
+
+
+# [ API ]
+def get_directory_backend():
+    """Get the directory cache backend plugin."""
+    return DirectoryBackend()
+
+
+def get_http_backend():
+    """Get the HTTP cache backend plugin."""
+    return HTTPBackend()
+
+
+# [ Internal ]
+class DirectoryBackend:
+    """
+    Directory cache backend.
+
+    Shares results via a directory, such as one on a network mount, set by `cache_dir`.
+    """
+
+    # [ API ]
+    @staticmethod
+    def enabled(config):
+        """Return whether or not the backend is enabled by the config."""
+        return bool(config['cache_dir'])
+
+    def fetch(self, digest, *, config):
+        """Fetch the payload for the digest, or None, if there isn't one."""
+        try:
+            return self._get_path(digest, config=config).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def publish(self, digest, payload, *, config):
+        """Publish the payload for the digest."""
+        path = self._get_path(digest, config=config)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write to the side and rename into place, so readers never see a partial payload
+        file_descriptor, temp_path = tempfile.mkstemp(dir=path.parent, prefix='.publishing-')
+        with os.fdopen(file_descriptor, 'wb') as temp_file:
+            temp_file.write(payload)
+        os.replace(temp_path, path)
+
+    # [ Internal ]
+    @staticmethod
+    def _get_path(digest, *, config):
+        """Get the path for the digest's payload."""
+        return pathlib.Path(config['cache_dir']).expanduser() / digest[:2] / digest
+
+
+class HTTPBackend:
+    """
+    HTTP cache backend.
+
+    Shares results via a server at `cache_url`, which serves payloads via GET and
+    accepts them via PUT, at `<cache_url>/<digest>`.
+    """
+
+    # [ API ]
+    @staticmethod
+    def enabled(config):
+        """Return whether or not the backend is enabled by the config."""
+        return bool(config['cache_url'])
+
+    def fetch(self, digest, *, config):
+        """Fetch the payload for the digest, or None, if there isn't one."""
+        try:
+            with urllib.request.urlopen(self._get_url(digest, config=config), timeout=_HTTP_TIMEOUT) as response:
+                return response.read()
+        except urllib.error.HTTPError as error:
+            if error.code == 404:
+                return None
+            raise
+
+    def publish(self, digest, payload, *, config):
+        """Publish the payload for the digest."""
+        request = urllib.request.Request(
+            self._get_url(digest, config=config),
+            data=payload,
+            method='PUT',
+            headers={'Content-Type': 'application/octet-stream'},
+        )
+        with urllib.request.urlopen(request, timeout=_HTTP_TIMEOUT):
+            pass
+
+    # [ Internal ]
+    @staticmethod
+    def _get_url(digest, *, config):
+        """Get the URL for the digest's payload."""
+        return f"{config['cache_url'].rstrip('/')}/{digest}"
+
+
+# [ Vulture ]
+assert all((
+    get_directory_backend,
+    get_http_backend,
+))
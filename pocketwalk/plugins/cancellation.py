@@ -9,6 +9,8 @@
 # [ -Python ]
 import signal
 import sys
+# [ -Project ]
+from pocketwalk import reactor
 
 
 # [ API ]
@@ -43,6 +45,8 @@ class Cancellation:
             sys.exit("EXITING DUE TO MULTIPLE SIGINTS RECEIVED.")
         self._cancelled = True
         print("\n\nCTRL-C detected.")
+        # wake the core, so it can react to the cancellation
+        reactor.notify()
 
     def cancelled(self):
         """Return whether or not the application has been cancelled."""
@@ -8,27 +8,43 @@
 # [ Imports ]
 # [ -Python ]
 import argparse
+import itertools
 import pathlib
+import re
+import sys
 # [ -Third Party ]
 import pytoml as toml
+# [ -Project ]
+from pocketwalk.plugins import globbing
+
+
+# [ Static ]
+_COMMANDS = ('show', 'stats', 'daemon', 'status', 'workspace', 'worker')
 
 
 # [ API ]
 # XXX [ config ] need to show config on change
 # XXX [ config ] need a save config option (not saved)
 # XXX [ config ] need a config-path option (not saved)
-# XXX need an option to error on certain output patterns
-# XXX need an option to strip output patterns, and ignore error if no output left
 # XXX need an option to warn if there are unused ignores
-def get_config():
-    """Get the config plugin."""
-    return Config()
+def get_config(*, root=None):
+    """Get the config plugin, for the project at the root, which defaults to the current directory."""
+    return Config(root=root)
 
 
 # [ API ]
 class Config:
     """Config plugin for pocketwalk."""
 
+    def __init__(self, *, root=None):
+        """Init the state."""
+        self._root = pathlib.Path(root or pathlib.Path.cwd()).absolute()
+        # rebuilt only when the settings change, so parsed .gitignore files are kept between ticks
+        self._ignore_settings = ((), True)
+        self._ignore_rules = globbing.IgnoreRules(self._root)
+        # kept from the last config got, so the loop's checks don't re-read and re-parse it
+        self._run = None
+
     # [ API ]
     @staticmethod
     async def get_tools(config):
@@ -37,50 +53,152 @@ class Config:
 
     async def loop_forever(self):
         """Return whether to loop forever."""
-        return (await self._get_config()).run == 'forever'
+        return await self._get_run() == 'forever'
 
     async def loop_till_pass(self):
         """Return whether to loop till pass."""
-        return (await self._get_config()).run == 'till-pass'
+        return await self._get_run() == 'till-pass'
+
+    async def get_command(self):
+        """
+        Get the command to run, and its arguments.
+
+        With no command given on the CLI, the command is 'watch'.
+        """
+        command, arguments, options = self._split_cli_args(sys.argv[1:])
+        if command == 'worker':
+            # a worker serves any project, so it parses its own arguments, without a project's config
+            arguments = arguments + options
+        elif command == 'show':
+            parser = argparse.ArgumentParser(prog='pocketwalk show', description="Show the full output from a tool's last run.")
+            parser.add_argument('tool', help="The tool to show the output of.")
+            arguments = [parser.parse_args(arguments).tool]
+        elif command == 'stats':
+            parser = argparse.ArgumentParser(
+                prog='pocketwalk stats',
+                description="Show stats of the tools' recorded runs - percentiles, trends, and the slowest targets.",
+            )
+            parser.add_argument('tools', nargs='*', help="The tools to show the stats of.  [default: all]")
+            arguments = parser.parse_args(arguments).tools
+        elif command == 'workspace':
+            parser = argparse.ArgumentParser(
+                prog='pocketwalk workspace',
+                description="Watch, run, and commit, in several projects, from one process.",
+            )
+            parser.add_argument('roots', nargs='+', help="The root directories of the projects.")
+            roots = [pathlib.Path(r).resolve() for r in parser.parse_args(arguments).roots]
+            if len(set(roots)) < len(roots):
+                parser.error("each project must only be given once")
+            arguments = [str(r) for r in roots]
+        return command, arguments
 
     async def get_config(self):
         """Get the config."""
         config = await self._get_config()
+        self._run = config.run
         config_dict = vars(config)
         for tool in config.tools:
-            config_dict[f'{tool}_targets'] = self._glob_paths(config_dict[f'{tool}_targets'])
-            config_dict[f'{tool}_triggers'] = self._glob_paths(config_dict[f'{tool}_triggers'])
+            config_dict[f'{tool}_targets'] = self._get_paths(config_dict[f'{tool}_targets'])
+            config_dict[f'{tool}_triggers'] = self._get_paths(config_dict[f'{tool}_triggers'])
             config_dict[f'{tool}_args'] = self._glob_paths(config_dict[f'{tool}_args'])
+            config_dict[f'{tool}_limits'] = self._get_limits(config_dict, tool)
+            config_dict[f'{tool}_coverage'] = self._get_coverage(config_dict, tool)
+            config_dict[f'{tool}_output_rules'] = self._get_output_rules(config_dict, tool)
+            config_dict[f'{tool}_pty'] = not (config.no_pty or config_dict.pop(f'{tool}_no_pty'))
+            config_dict[f'{tool}_snapshot'] = config.snapshot or config_dict[f'{tool}_snapshot']
+        for this_report in ('report_junit', 'report_json', 'report_log'):
+            if config_dict[this_report]:
+                config_dict[this_report] = str(self._root / config_dict[this_report])
         config_dict['config_path'] = self._get_path()
+        config_dict['root'] = str(self._root)
         return config_dict
 
     # [ Internals ]
-    @staticmethod
-    def _get_path():
+    def _get_path(self):
         """Get the config path."""
-        return ".pocketwalk.toml"
+        return str(self._root / '.pocketwalk.toml')
+
+    @staticmethod
+    def _split_cli_args(argv):
+        """Split the CLI args into the command, the command's arguments, and the options."""
+        if not argv or argv[0] not in _COMMANDS:
+            return 'watch', [], argv
+        arguments = list(itertools.takewhile(lambda a: not a.startswith('-'), argv[1:]))
+        return argv[0], arguments, argv[1 + len(arguments):]
+
+    @staticmethod
+    def _get_limits(config_dict, tool):
+        """Get the resource limits set for the tool."""
+        limits = {
+            'timeout': config_dict.pop(f'{tool}_timeout'),
+            'max memory': config_dict.pop(f'{tool}_max_memory'),
+            'max cpu time': config_dict.pop(f'{tool}_max_cpu_time'),
+            'nice': config_dict.pop(f'{tool}_nice'),
+            'ionice': config_dict.pop(f'{tool}_ionice'),
+            'cpu affinity': config_dict.pop(f'{tool}_cpu_affinity'),
+        }
+        # unset limits are dropped - they can't be serialized into the saved context.
+        return {name: value for name, value in limits.items() if value not in (None, [])}
+
+    @staticmethod
+    def _get_coverage(config_dict, tool):
+        """Get the coverage settings for the tool, which only apply if it's affected by coverage."""
+        coverage = {
+            'data': config_dict.pop(f'{tool}_coverage_data'),
+            'full run every': config_dict.pop(f'{tool}_full_run_every'),
+        }
+        return coverage if config_dict[f'{tool}_affected_by'] == 'coverage' else {}
 
     @staticmethod
-    def _glob_paths(args):
+    def _get_output_rules(config_dict, tool):
+        """Get the rules for the tool's output, which must be valid regexes."""
+        rules = {
+            'fail on': config_dict.pop(f'{tool}_fail_on'),
+            'filter out': config_dict.pop(f'{tool}_filter_out'),
+            'pass when filtered': config_dict.pop(f'{tool}_pass_when_filtered'),
+        }
+        for this_pattern in rules['fail on'] + rules['filter out']:
+            try:
+                re.compile(this_pattern)
+            except re.error as error:
+                raise ValueError(f"{tool} has an invalid output pattern {this_pattern!r}: {error}") from error
+        # unset rules are dropped, like unset limits, so tools without rules keep their contexts
+        return {name: value for name, value in rules.items() if value not in (False, [])}
+
+    def _get_paths(self, args):
+        """Expand globbed paths in the args, and make the rest relative to the project root."""
+        return [str(self._root / p) for p in self._glob_paths(args)]
+
+    def _glob_paths(self, args):
         """Expand globbed paths in the args."""
         if not isinstance(args, list):
             args = args.split()
         unglobbed = []
         for this_arg in args:
             if '*' in this_arg:
-                if this_arg.startswith('/'):
-                    unglobbed += [str(p) for p in pathlib.Path('/').glob(this_arg[1:])]
-                else:
-                    unglobbed += [str(p) for p in pathlib.Path.cwd().glob(this_arg)]
+                unglobbed += globbing.glob(this_arg, root=self._root, ignore_rules=self._ignore_rules)
             else:
                 unglobbed.append(this_arg)
         return unglobbed
 
+    def _set_ignore_rules(self, *, exclude, gitignore):
+        """Set the rules for the paths which globbing leaves out."""
+        if (exclude, gitignore) != self._ignore_settings:
+            self._ignore_settings = (exclude, gitignore)
+            self._ignore_rules = globbing.IgnoreRules(self._root, exclude=exclude, gitignore=gitignore)
+
+    async def _get_run(self):
+        """Get how long to run, as of the last config got, or the config, if none's been got yet."""
+        if self._run is None:
+            self._run = (await self._get_config()).run
+        return self._run
+
     async def _get_config(self):
         """Get the actual config."""
-        config_file = pathlib.Path.cwd() / '.pocketwalk.toml'
+        config_file = self._root / '.pocketwalk.toml'
         config_string = config_file.read_text()  # pylint: disable=no-member
         defaults = toml.loads(config_string)
+        _command, _arguments, options = self._split_cli_args(sys.argv[1:])
 
         tool_parser = argparse.ArgumentParser(add_help=False)
         tool_parser.add_argument(
@@ -101,10 +219,120 @@ class Config:
             help="Disable VCS.",
             action='store_true',
         )
-        args, _unknown = tool_parser.parse_known_args()
+        tool_parser.add_argument(
+            '--cache-size',
+            help="Max size of the result cache, in MB. [default: %(default)s]",
+            metavar='MB',
+            type=int,
+            default=defaults.get('cache_size', 256),
+        )
+        tool_parser.add_argument(
+            '--cache-dir',
+            help="Directory to share cached results through. [default: %(default)s]",
+            metavar='PATH',
+            default=defaults.get('cache_dir', None),
+        )
+        tool_parser.add_argument(
+            '--cache-url',
+            help="URL of a server to share cached results through. [default: %(default)s]",
+            metavar='URL',
+            default=defaults.get('cache_url', None),
+        )
+        tool_parser.add_argument(
+            '--output',
+            help=(
+                "How to render tool output: live, as it arrives, or grouped, each tool's output in one piece" +
+                " when it finishes. [default: %(default)s]"
+            ),
+            choices=['live', 'grouped'],
+            default=defaults.get('output', 'live'),
+        )
+        tool_parser.add_argument(
+            '--jobs',
+            help=(
+                "Max tools to run at once, shared fair-share between projects in a workspace." +
+                "  [default: unlimited, or one per CPU in a workspace]"
+            ),
+            metavar='N',
+            type=int,
+            default=defaults.get('jobs', None),
+        )
+        tool_parser.add_argument(
+            '--poll-max',
+            help=(
+                "Max seconds between polls of an idle path, where no file watcher is available.  Paths are polled" +
+                " less and less often while idle, up to this, and often again right after they change." +
+                "  [default: %(default)s]"
+            ),
+            metavar='SECONDS',
+            type=float,
+            default=defaults.get('poll_max', 8.0),
+        )
+        tool_parser.add_argument(
+            '--report-junit',
+            help="Write each tool's result to the path, as JUnit XML, when pocketwalk exits.",
+            metavar='PATH',
+            default=defaults.get('report_junit', None),
+        )
+        tool_parser.add_argument(
+            '--report-json',
+            help="Write each tool's result to the path, as JSON, when pocketwalk exits.",
+            metavar='PATH',
+            default=defaults.get('report_json', None),
+        )
+        tool_parser.add_argument(
+            '--report-log',
+            help="Append each event - tools starting, finishing, and so on - to the path, as a line of JSON, as it happens.",
+            metavar='PATH',
+            default=defaults.get('report_log', None),
+        )
+        tool_parser.add_argument(
+            '--no-pty',
+            help=(
+                "Run the tools with their output to a pipe, rather than a terminal.  The output is copied to the" +
+                " output cache and the terminal by the OS, without passing through pocketwalk, which suits CI."
+            ),
+            action='store_true',
+            default=not defaults.get('pty', True),
+        )
+        tool_parser.add_argument(
+            '--snapshot',
+            help=(
+                "Run the tools against snapshots of their files, rather than the working tree, so runs made stale" +
+                " by edits finish into the result cache, rather than being stopped."
+            ),
+            action='store_true',
+            default=defaults.get('snapshot', False),
+        )
+        tool_parser.add_argument(
+            '--workers',
+            help=(
+                "Workers to run remote tools on - host:port, unix:path, or local:N, to start N workers on this" +
+                " machine. [default: %(default)s]"
+            ),
+            metavar='ADDRESS',
+            default=defaults.get('workers', []),
+            nargs='*',
+        )
+        tool_parser.add_argument(
+            '--exclude',
+            help="Paths, as .gitignore patterns, which globbed paths never include, or look inside. [default: %(default)s]",
+            metavar='PATTERN',
+            default=defaults.get('exclude', []),
+            nargs='*',
+        )
+        tool_parser.add_argument(
+            '--no-gitignore',
+            help="Include paths ignored by the project's .gitignore files in globbed paths.",
+            action='store_true',
+            default=not defaults.get('gitignore', True),
+        )
+        args, _unknown = tool_parser.parse_known_args(options)
+        self._set_ignore_rules(exclude=tuple(args.exclude), gitignore=not args.no_gitignore)
 
         parser = argparse.ArgumentParser(parents=[tool_parser])
         for tool in args.tools:
+            tool_defaults = defaults.get('tools', {}).get(tool, {})
             parser.add_argument(
                 f'--{tool}-targets',
                 help=f"Target files for {tool} to run against. [default: %(default)s]",
@@ -137,5 +365,126 @@ class Config:
                 metavar='STRING',
                 default=self._glob_paths(defaults.get('tools', {}).get(tool, {}).get('config', "")),
             )
+            parser.add_argument(
+                f'--{tool}-affected-by',
+                help=(
+                    f"What makes a target affected, for {tool}'s '{{affected_targets}}': changes to its own content," +
+                    f" changes to its content or to anything it transitively imports," +
+                    f" or changes to the lines its tests executed, per coverage recorded with `--cov-context=test`." +
+                    f"  [default: %(default)s]"
+                ),
+                choices=['content', 'imports', 'coverage'],
+                default=tool_defaults.get('affected_by', 'content'),
+            )
+            parser.add_argument(
+                f'--{tool}-coverage-data',
+                help=f"The coverage data file {tool} writes, when affected by coverage. [default: %(default)s]",
+                metavar='PATH',
+                default=tool_defaults.get('coverage_data', '.coverage'),
+            )
+            parser.add_argument(
+                f'--{tool}-full-run-every',
+                help=f"Runs of {tool} between full runs, which refresh its coverage, when affected by coverage. [default: %(default)s]",
+                metavar='RUNS',
+                type=int,
+                default=tool_defaults.get('full_run_every', 20),
+            )
+            parser.add_argument(
+                f'--{tool}-no-pty',
+                help=f"Run {tool} with its output to a pipe, rather than a terminal.",
+                action='store_true',
+                default=not tool_defaults.get('pty', True),
+            )
+            parser.add_argument(
+                f'--{tool}-snapshot',
+                help=f"Run {tool} against snapshots of its files, rather than the working tree.",
+                action='store_true',
+                default=tool_defaults.get('snapshot', False),
+            )
+            parser.add_argument(
+                f'--{tool}-remote',
+                help=f"Run {tool} on the workers, rather than locally.",
+                action='store_true',
+                default=tool_defaults.get('remote', False),
+            )
+            parser.add_argument(
+                f'--{tool}-shards',
+                help=f"Shards to split {tool}'s affected targets into, each run on a worker of its own, when run remotely. [default: %(default)s]",
+                metavar='N',
+                type=int,
+                default=tool_defaults.get('shards', 1),
+            )
+            self._add_limit_arguments(parser, tool, tool_defaults)
+            self._add_output_rule_arguments(parser, tool, tool_defaults)
+
+        return parser.parse_args(options)
 
-        return parser.parse_args()
+    @staticmethod
+    def _add_output_rule_arguments(parser, tool, tool_defaults):
+        """Add the arguments for the rules applied to the tool's output as it streams."""
+        parser.add_argument(
+            f'--{tool}-fail-on',
+            help=f"Regexes which fail {tool}, killing it on the spot, when a line of its output matches. [default: %(default)s]",
+            metavar='PATTERN',
+            default=tool_defaults.get('fail_on', []),
+            nargs='*',
+        )
+        parser.add_argument(
+            f'--{tool}-filter-out',
+            help=f"Regexes for lines of {tool}'s output to drop as noise. [default: %(default)s]",
+            metavar='PATTERN',
+            default=tool_defaults.get('filter_out', []),
+            nargs='*',
+        )
+        parser.add_argument(
+            f'--{tool}-pass-when-filtered',
+            help=f"Pass {tool} despite a failing RC, when all of its output was filtered out.",
+            action='store_true',
+            default=tool_defaults.get('pass_when_filtered', False),
+        )
+
+    @staticmethod
+    def _add_limit_arguments(parser, tool, tool_defaults):
+        """Add the resource limit arguments for the tool."""
+        parser.add_argument(
+            f'--{tool}-timeout',
+            help=f"Wall-clock seconds {tool} may run before it is killed. [default: %(default)s]",
+            metavar='SECONDS',
+            type=float,
+            default=tool_defaults.get('timeout', None),
+        )
+        parser.add_argument(
+            f'--{tool}-max-memory',
+            help=f"Address space cap for {tool}, in MB (RLIMIT_AS). [default: %(default)s]",
+            metavar='MB',
+            type=int,
+            default=tool_defaults.get('max_memory', None),
+        )
+        parser.add_argument(
+            f'--{tool}-max-cpu-time',
+            help=f"CPU seconds {tool} may use before it is killed (RLIMIT_CPU). [default: %(default)s]",
+            metavar='SECONDS',
+            type=int,
+            default=tool_defaults.get('max_cpu_time', None),
+        )
+        parser.add_argument(
+            f'--{tool}-nice',
+            help=f"Nice level to run {tool} at. [default: %(default)s]",
+            metavar='LEVEL',
+            type=int,
+            default=tool_defaults.get('nice', None),
+        )
+        parser.add_argument(
+            f'--{tool}-ionice',
+            help=f"I/O scheduling class to run {tool} with. [default: %(default)s]",
+            choices=['realtime', 'best-effort', 'idle'],
+            default=tool_defaults.get('ionice', None),
+        )
+        parser.add_argument(
+            f'--{tool}-cpu-affinity',
+            help=f"CPUs {tool} may run on. [default: %(default)s]",
+            metavar='CPU',
+            type=int,
+            default=tool_defaults.get('cpu_affinity', []),
+            nargs='*',
+        )
@@ -7,23 +7,119 @@
 
 # [ Imports ]
 # [ -Python ]
+import collections.abc
 import hashlib
+import os
 import pathlib
+import sys
 import time
 # [ -Third Party ]
 from runaway import signals
 import pytoml as toml
+# [ -Project ]
+from pocketwalk.plugins import import_graph, merkle, persistence
+
+
+# [ Static ]
+# mtimes within this long of now may not change on the file's next write
+_RACY_SECONDS = 2
+_FILE_FIELDS = ('target files', 'trigger files')
+_CONTEXT_FIELDS = {
+    'target files': 'target_files',
+    'trigger files': 'trigger_files',
+    'config': 'config',
+    'preconditions': 'preconditions',
+    'limits': 'limits',
+    'affected by': 'affected_by',
+    'coverage': 'coverage',
+    'output rules': 'output_rules',
+}
 
 
 # [ API ]
-def get_context_manager():
-    """Get the context_manager plugin."""
-    return ContextManager()
+def get_context_manager(*, root=None):
+    """Get the context_manager plugin, for the project at the root, which defaults to the current directory."""
+    return ContextManager(root=root)
+
+
+class Context(collections.abc.Mapping):
+    """
+    A tool's context - the hashes of its target and trigger files, and its settings.
+
+    Contexts are never modified once made, so they're shared rather than copied.  Which
+    target files were affected by the latest change is kept outside of the mapping, so
+    it's never saved, compared, or digested.  The target and trigger files each have a
+    Merkle tree of their hashes, so contexts compare by root hash.
+    """
+
+    __slots__ = tuple(_CONTEXT_FIELDS.values()) + ('affected_files', 'trees')
+
+    def __init__(self, fields, *, trees, affected_files=()):
+        """Init the state."""
+        for key, attribute in _CONTEXT_FIELDS.items():
+            setattr(self, attribute, fields[key])
+        self.trees = trees
+        self.affected_files = affected_files
+
+    def __getitem__(self, key):
+        """Get the field for the key."""
+        try:
+            return getattr(self, _CONTEXT_FIELDS[key])
+        except KeyError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        """Iterate over the field keys."""
+        return iter(_CONTEXT_FIELDS)
+
+    def __len__(self):
+        """Get the number of fields."""
+        return len(_CONTEXT_FIELDS)
+
+    def __eq__(self, other):
+        """Compare the fields - file hashes compare by their trees' root hashes, without walking them."""
+        if not isinstance(other, Context):
+            return super().__eq__(other)
+        return all(self.field_equals(other, k) for k in _CONTEXT_FIELDS)
+
+    __hash__ = None
+
+    def __repr__(self):
+        """Represent the context as its fields."""
+        return f"Context({dict(self)!r})"
+
+    def with_affected_files(self, affected_files):
+        """Get a copy of the context, with the affected files - its fields and trees are shared, rather than copied."""
+        return Context(dict(self), trees=self.trees, affected_files=affected_files)
+
+    def field_equals(self, other, key):
+        """Return whether the field for the key equals the other context's."""
+        if key in _FILE_FIELDS and self.trees[key].root == other.trees[key].root:
+            return self.trees[key].hash == other.trees[key].hash
+        return self[key] == other[key]
 
 
 # [ Internal ]
 class ContextManager:
-    """Context manager plugin for pocketwalk."""
+    """
+    Context manager plugin for pocketwalk.
+
+    The maps of file hashes in the contexts are shared, between tools with the same files,
+    and between ticks for as long as the files are unchanged, so an unchanged tool's context
+    compares by identity.  The last saved contexts are kept in memory, and only read from the
+    cache on startup.
+    """
+
+    def __init__(self, *, root=None):
+        """Init the state."""
+        self._root = pathlib.Path(root or pathlib.Path.cwd()).absolute()
+        self._import_index = import_graph.ImportIndex(self._root / '.pocketwalk.cache' / 'imports.toml')
+        self._hashes = {}
+        # each tool's file maps, and their trees, by (kind, tool, field) slot
+        self._file_maps = {}
+        self._hashed_paths = set()
+        self._saved_contexts = {}
+        self._tagged = (None, None)
 
     # [ API ]
     def get_tools_unchanged_since_last_results(self, contexts):
@@ -52,81 +148,180 @@ class ContextManager:
                 to_return[tool] = context
         return to_return
 
-    @staticmethod
-    async def save_context(tool, *, context):
+    async def save_context(self, tool, *, context):
         """Save the current context for the given tool."""
-        context = context.copy()
-        if 'affected files' in context:
-            del context['affected files']
-        pathlib.Path(pathlib.Path.cwd() / '.pocketwalk.cache').mkdir(parents=True, exist_ok=True)
-        (pathlib.Path.cwd() / '.pocketwalk.cache' / tool).with_suffix('.context').write_text(toml.dumps(context))
+        self._saved_contexts[tool] = context
+        # contexts are immutable, so they're safe to serialize on the writer's thread
+        persistence.get_writer().replace(
+            (self._root / '.pocketwalk.cache' / tool).with_suffix('.context'),
+            lambda: toml.dumps(dict(context)),
+        )
 
     # [ Internal ]
-    @staticmethod
-    def _tagged_contexts(contexts):
-        """Reduce the contexts to the latest, and tag them as changed/unchanged since the last save."""
+    def _tagged_contexts(self, contexts):
+        """
+        Reduce the contexts to the latest, and tag them as changed/unchanged since the last save.
+
+        The tagging is done once per set of contexts, however many times it's asked for.
+        """
+        if self._tagged[0] is contexts:
+            return self._tagged[1]
         tagged_contexts = {}
         for tool, current_context in contexts['current_state'].items():
             last_context = contexts['last_saved'].get(tool, None)
-            this_tagged_context = current_context.copy()
             changed = last_context != current_context
-            this_tagged_context['affected files'] = []
             if (
                     last_context and
                     changed and
-                    last_context['trigger files'] == this_tagged_context['trigger files'] and
-                    last_context['config'] == this_tagged_context['config'] and
-                    last_context['preconditions'] == this_tagged_context['preconditions']
+                    all(last_context.field_equals(current_context, k) for k in _CONTEXT_FIELDS if k != 'target files')
             ):
-                for file_name, file_hash in list(this_tagged_context['target files'].items()):
-                    if last_context['target files'].get(file_name, None) != file_hash:
-                        this_tagged_context['affected files'].append(file_name)
+                # only the directories whose hashes changed are descended into
+                current_context = current_context.with_affected_files(
+                    current_context.trees['target files'].changed_paths(last_context.trees['target files']),
+                )
             else:
-                this_tagged_context['affected files'] = this_tagged_context['target files']
-
-            tagged = {'context': this_tagged_context, 'changed': changed}
-            tagged_contexts[tool] = tagged
+                current_context = current_context.with_affected_files(list(current_context['target files']))
+            tagged_contexts[tool] = {'context': current_context, 'changed': changed}
+        self._tagged = (contexts, tagged_contexts)
         return tagged_contexts
 
     def _get_contexts_for(self, config):
         """Get the current contexts for the given tools."""
         contexts = {}
+        # only the slots still in use are kept, so the maps of tools and paths which are gone are freed
+        previous, self._file_maps = self._file_maps, {}
+        # the file maps hashed this call, by their paths, so tools with the same paths share them
+        by_paths = {}
         for this_tool in config['tools']:
             target_files = config[f'{this_tool}_targets']
             trigger_files = config[f'{this_tool}_triggers']
             args = config[f'{this_tool}_args']
-            hashed_target_files = self._get_hashes_for(target_files)
-            hashed_trigger_files = self._get_hashes_for(trigger_files)
-            contexts[this_tool] = {
+            hashed_target_files, target_tree = self._get_file_map(
+                ('files', this_tool, 'target files'), target_files, previous=previous, by_paths=by_paths,
+            )
+            hashed_trigger_files, trigger_tree = self._get_file_map(
+                ('files', this_tool, 'trigger files'), trigger_files, previous=previous, by_paths=by_paths,
+            )
+            if config[f'{this_tool}_affected_by'] == 'imports':
+                hashed_target_files, hashed_trigger_files = self._fold_in_imports(
+                    target_files=hashed_target_files,
+                    trigger_files=hashed_trigger_files,
+                )
+                hashed_target_files, target_tree = self._share(
+                    ('imports', this_tool, 'target files'), hashed_target_files, previous=previous,
+                )
+                hashed_trigger_files, trigger_tree = self._share(
+                    ('imports', this_tool, 'trigger files'), hashed_trigger_files, previous=previous,
+                )
+            contexts[this_tool] = Context({
                 'target files': hashed_target_files,
                 'trigger files': hashed_trigger_files,
                 'config': args,
                 'preconditions': config[f'{this_tool}_preconditions'],
-            }
+                'limits': config[f'{this_tool}_limits'],
+                'affected by': config[f'{this_tool}_affected_by'],
+                'coverage': config[f'{this_tool}_coverage'],
+                'output rules': config[f'{this_tool}_output_rules'],
+            }, trees={'target files': target_tree, 'trigger files': trigger_tree})
+        if by_paths.keys() != self._hashed_paths:
+            # the hashes of paths no tool has any more are dropped
+            self._hashed_paths = set(by_paths)
+            live = set().union(*by_paths)
+            self._hashes = {p: h for p, h in self._hashes.items() if p in live}
         return contexts
 
-    @staticmethod
-    def _get_last_contexts_for(config):
+    def _get_file_map(self, slot, path_strings, *, previous, by_paths):
+        """Get the map of the paths to their hashes, and its tree, shared with any tool with the same paths."""
+        key = tuple(path_strings)
+        if key in by_paths:
+            # already hashed, for another tool
+            self._file_maps[slot] = by_paths[key]
+            return by_paths[key]
+        by_paths[key] = self._share(slot, self._get_hashes_for(path_strings), previous=previous)
+        return by_paths[key]
+
+    def _share(self, slot, file_map, *, previous):
+        """
+        Share the file map in the slot, and return it with its tree.
+
+        A map equal to the one the slot had before is swapped for it, so contexts built from it
+        compare by identity.  Otherwise, the tree is updated by the changed files alone, even
+        when files were added or removed.
+        """
+        shared = previous.get(slot, None)
+        if shared is None:
+            tree = merkle.MerkleTree.from_hashes(file_map, root=self._root)
+        elif shared[0] == file_map:
+            file_map, tree = shared
+        else:
+            changes = dict(file_map.items() - shared[0].items())
+            changes.update(dict.fromkeys(shared[0].keys() - file_map.keys()))
+            tree = shared[1].updated(changes)
+        self._file_maps[slot] = (file_map, tree)
+        return file_map, tree
+
+    def _fold_in_imports(self, *, target_files, trigger_files):
+        """
+        Fold the hashes of the modules each target transitively imports into the target's hash.
+
+        A change to a module then only affects the targets which import it.  The python modules
+        some target imports are dropped from the trigger files, because their changes are tracked
+        via the targets.  Anything no target's found to import - config files, pytest's conftest.py
+        files, and modules the graph can't resolve, like those of a src/ layout, or found through
+        sys.path - is left as a trigger, affecting every target.
+        """
+        def is_module(path):
+            """Return whether or not the path is to a module which can be imported."""
+            return path.endswith('.py') and pathlib.Path(path).name != 'conftest.py'
+
+        modules = {p: h for p, h in {**trigger_files, **target_files}.items() if is_module(p)}
+        graph = self._import_index.get_graph(modules, root=self._root)
+        folded_target_files = {}
+        imported = set()
+        for path, file_hash in target_files.items():
+            if path in graph:
+                imported |= import_graph.get_closure(graph, path)
+                folded_target_files[path] = import_graph.get_closure_hash(path, graph=graph, hashes=modules)
+            else:
+                folded_target_files[path] = file_hash
+        unimported_trigger_files = {p: h for p, h in trigger_files.items() if p not in imported}
+        return folded_target_files, unimported_trigger_files
+
+    def _get_last_contexts_for(self, config):
         """Get the last contexts for the given tools."""
-        tools = [t for t in config['tools'] if (pathlib.Path.cwd() / '.pocketwalk.cache' / t).with_suffix('.context').exists()]
+        unloaded = [t for t in config['tools'] if t not in self._saved_contexts]
+        for tool, context in self._load_contexts_for(unloaded).items():
+            self._saved_contexts[tool] = context
+        return {t: self._saved_contexts[t] for t in config['tools'] if t in self._saved_contexts}
+
+    def _load_contexts_for(self, tools):
+        """Load the saved contexts for the given tools from the cache."""
+        writer = persistence.get_writer()
+        tools = [t for t in tools if writer.exists((self._root / '.pocketwalk.cache' / t).with_suffix('.context'))]
         loaded_contexts = {t: toml.loads(
-            (pathlib.Path.cwd() / '.pocketwalk.cache' / t).with_suffix('.context').read_text(),
+            writer.read_text((self._root / '.pocketwalk.cache' / t).with_suffix('.context')),
         ) for t in tools}
         for context in loaded_contexts.values():
             context['config'] = context.get('config', [])
             context['preconditions'] = context.get('preconditions', [])
             context['trigger files'] = context.get('trigger files', {})
             context['target files'] = context.get('target files', {})
-        return loaded_contexts
+            context['limits'] = context.get('limits', {})
+            context['affected by'] = context.get('affected by', 'content')
+            context['coverage'] = context.get('coverage', {})
+            context['output rules'] = context.get('output rules', {})
+        return {t: Context(c, trees={
+            k: merkle.MerkleTree.from_hashes(c[k], root=self._root) for k in _FILE_FIELDS
+        }) for t, c in loaded_contexts.items()}
 
-    @staticmethod
-    def _get_hashes_for(path_strings):
+    def _get_hashes_for(self, path_strings):
         """Return sha hashes for the path strings."""
         tries = 0
         max_tries = 3
         while True:
             try:
-                return {s: hashlib.sha1(pathlib.Path(s).read_bytes()).hexdigest() for s in path_strings}
+                # interned, so the same path is the same string across every tool's context
+                return {sys.intern(s): self._get_hash_for(s) for s in path_strings}
             except FileNotFoundError:
                 # Can happen if file is being written while we try to read
                 if tries < max_tries:
@@ -135,6 +330,24 @@ class ContextManager:
                     continue
                 raise
 
+    def _get_hash_for(self, path_string):
+        """
+        Return the sha hash for the path string.
+
+        Hashes are reused for as long as the file's stat is unchanged.  Files modified
+        too recently to trust their mtime to have changed on their next write are always
+        re-hashed.
+        """
+        stat = os.stat(path_string)
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        cached = self._hashes.get(path_string, None)
+        if cached and cached[0] == key:
+            return cached[1]
+        file_hash = hashlib.sha1(pathlib.Path(path_string).read_bytes()).hexdigest()
+        if _RACY_SECONDS < time.time() - stat.st_mtime:
+            self._hashes[path_string] = (key, file_hash)
+        return file_hash
+
 
 # [ Vulture ]
 assert all((
@@ -0,0 +1,253 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk coverage map.
+
+A map from the lines of each source file to the IDs of the tests which executed
+them, recorded from coverage.py's per-test contexts (`pytest --cov-context=test`).
+When sources change, only the tests which executed the changed lines need to be
+rerun.
+
+The map is stored as zlib-compressed JSON rather than TOML - it has an entry per
+covered line, and TOML parsing is far too slow at that size.  The sources the map
+was recorded against are kept, content-addressed, so they can be diffed against
+the current sources later.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import difflib
+import json
+import pathlib
+import sqlite3
+import zlib
+
+
+# [ Static ]
+# lines executed outside of any test, like module-level code run during collection
+_NO_TEST = ''
+
+
+# [ API ]
+def decode_numbits(numbits):
+    """Decode coverage.py's numbits - a bitmap of line numbers - to the line numbers."""
+    return [i * 8 + bit for i, byte in enumerate(numbits) for bit in range(8) if byte & (1 << bit)]
+
+
+def get_test_id(coverage_context):
+    """Get the test ID from a coverage context, which pytest-cov suffixes with the test phase."""
+    return coverage_context.rpartition('|')[0] if '|' in coverage_context else coverage_context
+
+
+def get_changed_lines(old_lines, new_lines):
+    """
+    Get the line numbers in the old lines which were changed to get the new lines.
+
+    Pure insertions mark the old lines on either side of them as changed, since
+    inserted code runs as part of whatever surrounds it.
+    """
+    changed = set()
+    matcher = difflib.SequenceMatcher(a=old_lines, b=new_lines, autojunk=False)
+    for tag, old_start, old_end, _new_start, _new_end in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        if old_start == old_end:
+            changed.update((old_start, old_start + 1))
+        else:
+            changed.update(range(old_start + 1, old_end + 1))
+    return changed
+
+
+def get_line_moves(old_lines, new_lines):
+    """Get the new line number of each unchanged line of the old lines."""
+    moves = {}
+    matcher = difflib.SequenceMatcher(a=old_lines, b=new_lines, autojunk=False)
+    for old_start, new_start, size in matcher.get_matching_blocks():
+        moves.update({old_start + i + 1: new_start + i + 1 for i in range(size)})
+    return moves
+
+
+def read_coverage_data(data_path, *, root):
+    """
+    Read the lines executed per test ID from coverage.py's data file.
+
+    Returns {relative path: {line: set of test IDs}}, for the files under the root.
+    """
+    executed = {}
+    connection = sqlite3.connect(f'file:{data_path}?mode=ro', uri=True)
+    try:
+        tables = {r[0] for r in connection.execute("select name from sqlite_master where type = 'table'")}
+        if 'line_bits' in tables:
+            rows = (
+                (path, context, line)
+                for path, context, numbits in connection.execute(
+                    "select file.path, context.context, line_bits.numbits from line_bits"
+                    " join file on file.id = line_bits.file_id join context on context.id = line_bits.context_id",
+                )
+                for line in decode_numbits(numbits)
+            )
+        else:
+            # branch coverage records arcs between lines, rather than lines
+            rows = (
+                (path, context, line)
+                for path, context, from_line, to_line in connection.execute(
+                    "select file.path, context.context, arc.fromno, arc.tono from arc"
+                    " join file on file.id = arc.file_id join context on context.id = arc.context_id",
+                )
+                for line in (from_line, to_line) if 0 < line
+            )
+        for path, context, line in rows:
+            try:
+                relative_path = str(pathlib.Path(path).relative_to(root))
+            except ValueError:
+                continue
+            executed.setdefault(relative_path, {}).setdefault(line, set()).add(get_test_id(context))
+    finally:
+        connection.close()
+    return executed
+
+
+def prune_test_ids(test_ids, *, root):
+    """
+    Prune the test IDs down to the ones which can be passed to pytest.
+
+    IDs in files which no longer exist are dropped, as are IDs in files which are
+    being run whole - their tests may have been renamed or removed.
+    """
+    whole_files = {t for t in test_ids if '::' not in t}
+    return sorted(
+        t for t in test_ids
+        if (pathlib.Path(root) / t.partition('::')[0]).exists() and (t in whole_files or t.partition('::')[0] not in whole_files)
+    )
+
+
+class CoverageMap:
+    """Persistent map of source lines to the tests which executed them, for a single tool."""
+
+    def __init__(self, path, *, sources_path):
+        """Init the state."""
+        self._path = pathlib.Path(path)
+        self._sources_path = pathlib.Path(sources_path)
+
+    def select_tests(self, *, source_hashes, target_files, root, full_run_every):
+        """
+        Select the tests affected by changes since the map was recorded.
+
+        The source hashes are the current {path: hash} for every source the tool depends on.
+        Returns a list of test IDs and changed target paths to run, or None if the full
+        suite needs to be run - because there's no map yet, because a full run is due,
+        because the last full run failed, or because a source the map knows nothing about changed.
+        """
+        state = self._load()
+        if state is None or full_run_every <= state['runs since full']:
+            return None
+        if state.get('full run failed', False):
+            # which of the full run's tests failed isn't known, so only another full run can tell they pass
+            return None
+        selected = set(state['failing'])
+        current_paths = set()
+        for path, file_hash in source_hashes.items():
+            relative_path = str(pathlib.Path(path).absolute().relative_to(root))
+            current_paths.add(relative_path)
+            recorded_hash = state['sources'].get(relative_path, None)
+            if recorded_hash == file_hash:
+                continue
+            if path in target_files:
+                # changed test files are rerun whole
+                selected.add(relative_path)
+                continue
+            if recorded_hash is None or not relative_path.endswith('.py'):
+                # new modules and non-python triggers, like config files, have no coverage to go by
+                return None
+            lines = state['lines'].get(relative_path, {})
+            old_lines = self._load_source(recorded_hash).splitlines()
+            new_lines = pathlib.Path(path).read_bytes().splitlines()
+            for line in get_changed_lines(old_lines, new_lines):
+                tests = lines.get(str(line), [])
+                if _NO_TEST in tests:
+                    # a line run outside any test changed - anything could be affected
+                    return None
+                selected.update(tests)
+        for relative_path in state['sources'].keys() - current_paths:
+            # everything which ran a removed module is affected by its removal
+            for tests in state['lines'].get(relative_path, {}).values():
+                if _NO_TEST in tests:
+                    return None
+                selected.update(tests)
+        return prune_test_ids(selected, root=root)
+
+    def record(self, data_path, *, source_hashes, root, full_run, selected, return_code):
+        """
+        Record the coverage from the tool's latest run.
+
+        A full run replaces the map.  A partial run replaces the coverage of just the
+        tests it ran.  Returns whether there was any coverage data to record.
+        """
+        data_path = pathlib.Path(data_path)
+        if not data_path.exists():
+            return False
+        executed = read_coverage_data(data_path, root=root)
+        state = None if full_run else self._load()
+        if state is None:
+            state = {'lines': {}, 'sources': {}, 'runs since full': 0, 'failing': []}
+        else:
+            state['runs since full'] += 1
+            rerun = set(selected)
+            for relative_path, lines in state['lines'].items():
+                for line, tests in lines.items():
+                    lines[line] = [t for t in tests if t not in rerun and t.partition('::')[0] not in rerun]
+                state['lines'][relative_path] = self._move_lines(relative_path, lines, state=state, root=root)
+        for relative_path, lines in executed.items():
+            recorded = state['lines'].setdefault(relative_path, {})
+            for line, tests in lines.items():
+                recorded[str(line)] = sorted(set(recorded.get(str(line), [])) | tests)
+        state['sources'] = {}
+        for path, file_hash in source_hashes.items():
+            relative_path = str(pathlib.Path(path).absolute().relative_to(root))
+            state['sources'][relative_path] = file_hash
+            if relative_path.endswith('.py'):
+                self._save_source(file_hash, pathlib.Path(path).read_bytes())
+        # failing tests get rerun on the next change, whatever it is, until they pass
+        state['failing'] = [] if return_code == 0 else sorted(set(state['failing']) | set(selected))
+        state['full run failed'] = full_run and return_code != 0
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._path.write_bytes(zlib.compress(json.dumps(state).encode('utf-8')))
+        return True
+
+    def _load(self):
+        """Load the saved map."""
+        try:
+            return json.loads(zlib.decompress(self._path.read_bytes()).decode('utf-8'))
+        except FileNotFoundError:
+            return None
+
+    def _move_lines(self, relative_path, lines, *, state, root):
+        """
+        Move the recorded lines of a changed source to where they are in its current content.
+
+        The tests which weren't rerun still executed the same code, but it may have moved.
+        """
+        source_path = pathlib.Path(root) / relative_path
+        recorded_hash = state['sources'].get(relative_path, None)
+        if recorded_hash is None or not relative_path.endswith('.py') or not source_path.exists():
+            return lines
+        old_lines = self._load_source(recorded_hash).splitlines()
+        new_lines = source_path.read_bytes().splitlines()
+        if old_lines == new_lines:
+            return lines
+        moves = get_line_moves(old_lines, new_lines)
+        return {str(moves[int(line)]): tests for line, tests in lines.items() if int(line) in moves and tests}
+
+    def _load_source(self, file_hash):
+        """Load a source, as it was when the map was recorded."""
+        return zlib.decompress((self._sources_path / file_hash).read_bytes())
+
+    def _save_source(self, file_hash, content):
+        """Save a source, content-addressed."""
+        source_path = self._sources_path / file_hash
+        if not source_path.exists():
+            self._sources_path.mkdir(parents=True, exist_ok=True)
+            source_path.write_bytes(zlib.compress(content))
@@ -0,0 +1,58 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""Pocketwalk content digests."""
+
+
+# [ Imports ]
+# [ -Python ]
+import hashlib
+import json
+import os
+# [ -Project ]
+from pocketwalk.plugins import merkle
+
+
+# [ Static ]
+_FILE_KEYS = ('target files', 'trigger files')
+
+
+# [ API ]
+def get_digest(tool, context, *, root, exclude=()):
+    """
+    Get the content digest for the tool's context.
+
+    The digest covers the tool's config, preconditions, limits, and the hashes
+    of its trigger and target files - everything but which files were affected
+    by the latest change, and any other excluded parts of the context.  Paths
+    under the root are made relative to it, so the digest is the same for every
+    clone of the project.  The file hashes are covered by their Merkle trees' root
+    hashes, reusing the context's trees where it has them.
+    """
+    keyed = {k: v for k, v in context.items() if k != 'affected files' and k not in exclude}
+    for key in _FILE_KEYS:
+        if key in keyed:
+            keyed[key] = _get_tree(context, key, root=root).hash
+    relative = _relative_to(keyed, prefix=str(root).rstrip(os.sep) + os.sep)
+    return hashlib.sha1(json.dumps([tool, relative], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# [ Internal ]
+def _get_tree(context, key, *, root):
+    """Get the Merkle tree of the context's files for the key, relative to the root."""
+    tree = getattr(context, 'trees', {}).get(key, None)
+    if tree is None or tree.root != str(root):
+        tree = merkle.MerkleTree.from_hashes(context[key], root=root)
+    return tree
+
+
+def _relative_to(data, *, prefix):
+    """Return the data with every string starting with the prefix stripped of it."""
+    if isinstance(data, str):
+        return data[len(prefix):] if data.startswith(prefix) else data
+    if isinstance(data, dict):
+        return {_relative_to(k, prefix=prefix): _relative_to(v, prefix=prefix) for k, v in data.items()}
+    if isinstance(data, list):
+        return [_relative_to(i, prefix=prefix) for i in data]
+    return data
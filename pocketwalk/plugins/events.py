@@ -0,0 +1,134 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk events.
+
+Structured events - tools starting, finishing, being stopped, skipped, and
+replayed, and the VCS's state - are emitted to the installed reporters, of the
+`pocketwalk_reporter` entry point.  Emitting an event only queues it, and only
+when a reporter's enabled for the event's project, so it costs next to nothing
+on the loop.  The reporters are sent the queued events in batches, from a thread
+of their own, so a slow one - writing to a log file, or a socket - never holds up
+the tools.  If the reporters fall too far behind, the oldest events are dropped,
+and the next batch notes how many were.  The queue is flushed when pocketwalk exits.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import atexit
+import collections
+import threading
+import time
+# [ -Project ]
+from pocketwalk.plugger import Plugger
+from pocketwalk.shell import Reporter
+
+
+# [ Static ]
+# events are gathered for this long before they're sent, so reporters are sent fewer, bigger batches
+_BATCH_SECONDS = 0.1
+_MAX_BATCH = 1000
+_MAX_QUEUED = 10000
+_EVENTS = None
+_EVENTS_LOCK = threading.Lock()
+
+
+# [ API ]
+def get_events():
+    """Get the process's events, loading the reporters, if they aren't already."""
+    global _EVENTS  # pylint: disable=global-statement
+    with _EVENTS_LOCK:
+        if _EVENTS is None:
+            _EVENTS = Events(reporters=Plugger('pocketwalk').resolve_all(Reporter))
+            atexit.register(_EVENTS.flush)
+        return _EVENTS
+
+
+def emit(root, event):
+    """Emit the event, for the project at the root."""
+    get_events().emit(root, event)
+
+
+class Events:
+    """Queue of events, sent to the reporters in batches, on a background thread."""
+
+    def __init__(self, *, reporters, max_queued=_MAX_QUEUED):
+        """Init the state."""
+        self._reporters = reporters
+        self._max_queued = max_queued
+        self._condition = threading.Condition()
+        self._queue = collections.deque()
+        self._configs = {}
+        self._enabled = {}
+        self._dropped = collections.Counter()
+        self._flushing = 0
+        self._sending = False
+        self._thread = None
+
+    # [ API ]
+    def configure(self, config):
+        """Configure the reporters for the config's project."""
+        enabled = [r for r in self._reporters if r.enabled(config)]
+        with self._condition:
+            self._configs[config['root']] = config
+            self._enabled[config['root']] = enabled
+
+    def emit(self, root, event):
+        """Queue the event, for the project at the root, if any reporters are enabled for it."""
+        root = str(root)
+        if not self._enabled.get(root, None):
+            return
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='pocketwalk-events', daemon=True)
+                self._thread.start()
+            if len(self._queue) >= self._max_queued:
+                dropped = self._queue.popleft()
+                self._dropped[dropped['root']] += 1
+            self._queue.append({**event, 'root': root, 'time': time.time()})
+            self._condition.notify_all()
+
+    def flush(self):
+        """Wait for every queued event to be sent."""
+        with self._condition:
+            self._flushing += 1
+            self._condition.notify_all()
+            self._condition.wait_for(lambda: not self._queue and not self._sending)
+            self._flushing -= 1
+
+    # [ Internal ]
+    def _run(self):
+        """Send the queue, a batch at a time."""
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue)
+                self._condition.wait_for(lambda: self._flushing or len(self._queue) >= _MAX_BATCH, timeout=_BATCH_SECONDS)
+                batch = list(self._queue)
+                self._queue.clear()
+                dropped, self._dropped = self._dropped, collections.Counter()
+                configs = dict(self._configs)
+                enabled = dict(self._enabled)
+                self._sending = True
+            self._send(batch, dropped=dropped, configs=configs, enabled=enabled)
+            with self._condition:
+                self._sending = False
+                self._condition.notify_all()
+
+    @staticmethod
+    def _send(batch, *, dropped, configs, enabled):
+        """Send the batch to the reporters enabled for each event's project, noting any events dropped before it."""
+        events_per_root = collections.defaultdict(list)
+        for root, count in dropped.items():
+            events_per_root[root].append({'event': 'events dropped', 'count': count, 'root': root, 'time': time.time()})
+        for this_event in batch:
+            events_per_root[this_event['root']].append(this_event)
+        for root, events in events_per_root.items():
+            for this_reporter in enabled.get(root, []):
+                try:
+                    this_reporter.report(events, config=configs[root])
+                # a failed reporter mustn't take the others down with it
+                except Exception as error:  # pylint: disable=broad-except
+                    print(f"Failed to report events to {type(this_reporter).__name__} ({error})")
@@ -0,0 +1,247 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk glob expansion.
+
+Each pattern is anchored at its literal directory prefix - the components before
+the first one with a wildcard - and only that subtree is walked, one pattern
+component at a time, so `src/*/test_*.py` never lists anything outside `src`.
+Directories ignored by the project's `.gitignore` files, by its exclude list,
+or for being a VCS's or pocketwalk's own, are never descended into, and ignored
+files are left out.  A pattern which would walk from the filesystem root is
+refused.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import fnmatch
+import os
+import pathlib
+import re
+
+
+# [ Static ]
+_MAGIC = re.compile(r'[*?[]')
+# never walked - the cache holds snapshots of the project's files, which mustn't be taken for the files
+_ALWAYS_IGNORED = ('.git/', '.hg/', '.svn/', '.pocketwalk.cache/')
+
+
+# [ API ]
+def split_literal_prefix(pattern):
+    """Split the pattern's components into its literal directory prefix, and the rest, from the first wildcard on."""
+    parts = pathlib.PurePosixPath(pattern).parts
+    for index, part in enumerate(parts):
+        if _MAGIC.search(part):
+            return parts[:index], parts[index:]
+    return parts[:-1], parts[-1:]
+
+
+def compile_ignore_pattern(line):
+    """
+    Compile a line of a .gitignore file into an ignore rule, or return None, for blank lines and comments.
+
+    The rule is a tuple of the regex matching paths relative to the ignore file's
+    directory, whether it re-includes, rather than ignores, and whether it only
+    applies to directories.
+    """
+    line = line.rstrip('\n')
+    if not line.strip() or line.startswith('#'):
+        return None
+    # trailing spaces are ignored, unless escaped
+    line = re.sub(r'(?<!\\) +$', '', line)
+    negated = line.startswith('!')
+    if negated:
+        line = line[1:]
+    elif line.startswith('\\'):
+        line = line[1:]
+    directories_only = line.endswith('/')
+    line = line.rstrip('/')
+    # patterns with a slash anywhere but the end are anchored at the ignore file's directory
+    anchored = '/' in line
+    line = line.lstrip('/')
+    regex = ''
+    index = 0
+    while index < len(line):
+        if line.startswith('**/', index):
+            regex += '(?:.*/)?'
+            index += 3
+        elif line.startswith('/**', index) and index + 3 == len(line):
+            regex += '/.*'
+            index += 3
+        elif line[index] == '*':
+            regex += '[^/]*'
+            index += 1
+        elif line[index] == '?':
+            regex += '[^/]'
+            index += 1
+        elif line[index] == '[' and ']' in line[index + 2:]:
+            end = line.index(']', index + 2)
+            regex += '[' + line[index + 1:end].replace('!', '^', 1).replace('\\', '\\\\') + ']'
+            index = end + 1
+        elif line[index] == '\\' and index + 1 < len(line):
+            regex += re.escape(line[index + 1])
+            index += 2
+        else:
+            regex += re.escape(line[index])
+            index += 1
+    prefix = '' if anchored else '(?:.*/)?'
+    return re.compile(prefix + regex + r'\Z'), negated, directories_only
+
+
+class IgnoreRules:
+    """
+    The ignore rules for a project - its .gitignore files, and its exclude list.
+
+    Nested .gitignore files apply below their own directory, and the last rule
+    matching a path decides whether it's ignored, as with git.  Parsed files are
+    kept until they change.
+    """
+
+    def __init__(self, root, *, exclude=(), gitignore=True):
+        """Init the state."""
+        self._root = pathlib.Path(root)
+        self._gitignore = gitignore
+        self._base_rules = [r for r in map(compile_ignore_pattern, list(_ALWAYS_IGNORED) + list(exclude)) if r]
+        self._parsed = {}
+
+    # [ API ]
+    def get_rules(self, directory, *, parent_rules):
+        """Get the rules which apply within the directory, given those which apply within its parent."""
+        if directory == self._root:
+            rules = [('', r) for r in self._base_rules]
+            if self._gitignore:
+                rules += self._read_rules(self._root / '.git' / 'info' / 'exclude', base='')
+        else:
+            rules = parent_rules
+        if self._gitignore:
+            base = '' if directory == self._root else directory.relative_to(self._root).as_posix() + '/'
+            own = self._read_rules(directory / '.gitignore', base=base)
+            if own:
+                rules = rules + own
+        return rules
+
+    @staticmethod
+    def is_ignored(relative, *, is_dir, rules):
+        """Return whether the path, relative to the root, is ignored by the rules."""
+        ignored = False
+        for base, (regex, negated, directories_only) in rules:
+            if directories_only and not is_dir:
+                continue
+            if not relative.startswith(base):
+                continue
+            if regex.match(relative[len(base):]):
+                ignored = not negated
+        return ignored
+
+    # [ Internal ]
+    def _read_rules(self, path, *, base):
+        """Read the rules in the ignore file at the path, if there is one, which apply below the base."""
+        try:
+            mtime = path.stat().st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+        cached = self._parsed.get(path, None)
+        if cached is None or cached[0] != mtime:
+            lines = path.read_text(errors='replace').splitlines()
+            cached = (mtime, [(base, r) for r in map(compile_ignore_pattern, lines) if r])
+            self._parsed[path] = cached
+        return cached[1]
+
+
+def glob(pattern, *, root, ignore_rules):
+    """
+    Glob the pattern, relative to the root, unless it's absolute, and return the sorted matches.
+
+    Only the pattern's literal prefix is walked from, and ignored paths under the root
+    are pruned.  Raises ValueError for a pattern which would walk from the filesystem root.
+    """
+    root = pathlib.Path(root)
+    prefix, rest = split_literal_prefix(pattern)
+    base = root.joinpath(*prefix)
+    if base == pathlib.Path(base.anchor):
+        raise ValueError(f"refusing to glob {pattern!r}, which would scan the whole filesystem - anchor it at a directory")
+    within_root = base == root or root in base.parents
+    # the ignore rules above the base still apply within it, but the base itself was asked for by name
+    rules = None
+    if within_root:
+        for directory in reversed([base, *base.parents]):
+            if directory == root or root in directory.parents:
+                rules = ignore_rules.get_rules(directory, parent_rules=rules)
+    matches = _Walk(root=root, ignore_rules=ignore_rules if within_root else None).match(base, rest, rules=rules)
+    return sorted(set(matches))
+
+
+# [ Internal ]
+class _Walk:
+    """A walk of a directory tree, matching a pattern's components."""
+
+    def __init__(self, *, root, ignore_rules):
+        """Init the state."""
+        self._root = root
+        self._ignore_rules = ignore_rules
+
+    def match(self, directory, parts, *, rules):
+        """Match the pattern's components within the directory, and yield the matching paths."""
+        part, rest = parts[0], parts[1:]
+        if part == '**':
+            if not rest:
+                yield str(directory)
+            else:
+                yield from self.match(directory, rest, rules=rules)
+            for path, is_dir, is_link in self._scan(directory, rules=rules):
+                # symlinked directories are left out, so a link back up the tree can't loop
+                if is_dir and not is_link:
+                    yield from self.match(pathlib.Path(path), parts, rules=self._get_rules(path, rules=rules))
+            return
+        if _MAGIC.search(part):
+            regex = re.compile(fnmatch.translate(part))
+            entries = [e for e in self._scan(directory, rules=rules) if regex.match(os.path.basename(e[0]))]
+        else:
+            entries = self._look_up(directory / part, rules=rules)
+        for path, is_dir, _is_link in entries:
+            if not rest:
+                yield path
+            elif is_dir:
+                yield from self.match(pathlib.Path(path), rest, rules=self._get_rules(path, rules=rules))
+
+    def _scan(self, directory, *, rules):
+        """Scan the directory for the entries which aren't ignored, as their paths, and whether they're directories, or links."""
+        try:
+            with os.scandir(directory) as entries:
+                found = [(e.path, e.is_dir(), e.is_symlink()) for e in entries]
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            return []
+        return [e for e in found if not self._is_ignored(e[0], is_dir=e[1], rules=rules)]
+
+    def _look_up(self, path, *, rules):
+        """Look the path up, as an entry, like those scanned, if it exists, and isn't ignored."""
+        try:
+            is_link = path.is_symlink()
+            is_dir = path.is_dir()
+            if not is_dir and not is_link:
+                path.lstat()
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            return []
+        if self._is_ignored(str(path), is_dir=is_dir, rules=rules):
+            return []
+        return [(str(path), is_dir, is_link)]
+
+    def _is_ignored(self, path, *, is_dir, rules):
+        """Return whether the path is ignored."""
+        if self._ignore_rules is None:
+            return False
+        return self._ignore_rules.is_ignored(_relative(path, self._root), is_dir=is_dir, rules=rules)
+
+    def _get_rules(self, path, *, rules):
+        """Get the rules which apply within the directory at the path."""
+        if self._ignore_rules is None:
+            return None
+        return self._ignore_rules.get_rules(pathlib.Path(path), parent_rules=rules)
+
+
+def _relative(path, root):
+    """Get the path relative to the root, as a posix string."""
+    return pathlib.Path(path).relative_to(root).as_posix()
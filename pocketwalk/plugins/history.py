@@ -0,0 +1,212 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk run history.
+
+Every tool process run is recorded, with its wall time, CPU time, peak memory,
+output size, targets, and outcome - passed, failed, timed out, stopped as stale,
+or otherwise cancelled - as a line of JSON, appended to a history file.  The
+history is summarized per tool, with percentiles and trends, and per target, for
+tuning a project's config.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import collections
+import json
+import math
+import pathlib
+import statistics
+import sys
+# [ -Project ]
+from pocketwalk.plugins import persistence
+
+
+# [ Static ]
+# the history is compacted down to its newer half once it outgrows this
+_MAX_BYTES = 8 * 1024 * 1024
+# trends compare the median of a tool's latest runs to that of the runs before them
+_TREND_RUNS = 10
+_COMPLETED = ('passed', 'failed', 'timed out')
+# linux reports peak RSS in KB, and macOS in bytes
+_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+# [ API ]
+class History:
+    """History of tool runs, appended to a file of JSON lines."""
+
+    def __init__(self, path):
+        """Init the state."""
+        self._path = pathlib.Path(path)
+
+    # [ API ]
+    def record(self, run):
+        """Record the run, behind the event loop."""
+        writer = persistence.get_writer()
+        writer.append(self._path, json.dumps(run, sort_keys=True) + '\n')
+        try:
+            size = self._path.stat().st_size
+        except FileNotFoundError:
+            return
+        if size > _MAX_BYTES:
+            # compacted in order with the records queued before it
+            writer.replace(self._path, self._compact)
+
+    def load(self):
+        """Load the recorded runs, oldest first."""
+        try:
+            lines = self._path.read_text(encoding='utf-8').splitlines()
+        except FileNotFoundError:
+            return []
+        runs = []
+        for this_line in lines:
+            try:
+                runs.append(json.loads(this_line))
+            except ValueError:
+                # a line cut short by a crash mid-write - the rest of the history is still good
+                continue
+        return runs
+
+    # [ Internal ]
+    def _compact(self):
+        """Get the history compacted down to its newer half."""
+        lines = self._path.read_text(encoding='utf-8').splitlines(keepends=True)
+        return ''.join(lines[len(lines) // 2:])
+
+
+def get_usage(rusage, *, spawn_rss=0):
+    """
+    Get a run's CPU time and peak memory, for the history, from the resource usage of its reaped process, if any.
+
+    A forked process starts with its parent's peak RSS, so a peak no higher than the
+    parent's, at spawn, can't be told apart from it, and is recorded as unknown.
+    """
+    if rusage is None:
+        return {'user seconds': None, 'system seconds': None, 'peak rss bytes': None}
+    return {
+        'user seconds': round(rusage.ru_utime, 3),
+        'system seconds': round(rusage.ru_stime, 3),
+        'peak rss bytes': rusage.ru_maxrss * _RSS_UNIT if rusage.ru_maxrss > spawn_rss else None,
+    }
+
+
+def combine_usage(usages):
+    """Combine the usage of a run's processes - its shards, say - into the run's, from what's known of it."""
+    known = [u for u in usages if u is not None]
+    user_seconds = [u['user seconds'] for u in known if u['user seconds'] is not None]
+    system_seconds = [u['system seconds'] for u in known if u['system seconds'] is not None]
+    peaks = [u['peak rss bytes'] for u in known if u['peak rss bytes'] is not None]
+    return {
+        'user seconds': round(sum(user_seconds), 3) if user_seconds else None,
+        'system seconds': round(sum(system_seconds), 3) if system_seconds else None,
+        'peak rss bytes': max(peaks, default=None),
+    }
+
+
+def get_percentile(values, percent):
+    """Get the nearest-rank percentile of the values, or None, if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * percent / 100) - 1, 0)]
+
+
+def get_trend(seconds):
+    """
+    Get the trend of a tool's run times, oldest first, as the fractional change in their median.
+
+    Compares the latest runs to as many runs before them.  Returns None until there
+    are enough runs to compare.
+    """
+    if len(seconds) < 2 * _TREND_RUNS:
+        return None
+    before = statistics.median(seconds[-2 * _TREND_RUNS:-_TREND_RUNS])
+    latest = statistics.median(seconds[-_TREND_RUNS:])
+    if not before:
+        return None
+    return (latest - before) / before
+
+
+def summarize_tools(runs):
+    """Summarize the runs per tool, slowest median run time first."""
+    runs_per_tool = collections.defaultdict(list)
+    for this_run in runs:
+        runs_per_tool[this_run['tool']].append(this_run)
+    summaries = []
+    for tool, tool_runs in runs_per_tool.items():
+        completed = [r for r in tool_runs if r['outcome'] in _COMPLETED]
+        seconds = [r['seconds'] for r in completed]
+        cpu_seconds = [r['user seconds'] + r['system seconds'] for r in completed if r['user seconds'] is not None]
+        outcomes = collections.Counter(r['outcome'] for r in tool_runs)
+        summaries.append({
+            'tool': tool,
+            'runs': len(tool_runs),
+            'outcomes': dict(outcomes),
+            'p50 seconds': get_percentile(seconds, 50),
+            'p90 seconds': get_percentile(seconds, 90),
+            'max seconds': max(seconds, default=None),
+            'mean cpu seconds': statistics.mean(cpu_seconds) if cpu_seconds else None,
+            'peak rss bytes': max((r['peak rss bytes'] for r in completed if r['peak rss bytes'] is not None), default=None),
+            'trend': get_trend(seconds),
+            'wasted seconds': sum(r['seconds'] for r in tool_runs if r['outcome'] not in _COMPLETED),
+        })
+    return sorted(summaries, key=lambda s: -(s['p50 seconds'] or 0))
+
+
+def get_slowest_targets(runs, *, count):
+    """
+    Get the slowest targets, with their mean seconds per run, slowest first.
+
+    A run's time is split evenly between its targets, so for runs against several
+    targets, a target's time is an estimate.
+    """
+    seconds_per_target = collections.defaultdict(list)
+    for this_run in runs:
+        if this_run['outcome'] not in _COMPLETED or not this_run['target paths']:
+            continue
+        share = this_run['seconds'] / len(this_run['target paths'])
+        for this_target in this_run['target paths']:
+            seconds_per_target[(this_run['tool'], this_target)].append(share)
+    means = [(tool, target, statistics.mean(s)) for (tool, target), s in seconds_per_target.items()]
+    return sorted(means, key=lambda m: -m[2])[:count]
+
+
+def format_stats(runs, *, count):
+    """Format the runs' stats - per tool, then the slowest targets - for the terminal."""
+    if not runs:
+        return "No runs recorded yet."
+    lines = [f"{'tool':<24} {'runs':>6} {'pass':>6} {'p50':>8} {'p90':>8} {'max':>8} {'cpu':>8} {'rss':>8} {'trend':>7} {'wasted':>8}"]
+    for this_summary in summarize_tools(runs):
+        passed = this_summary['outcomes'].get('passed', 0)
+        lines.append(
+            f"{this_summary['tool']:<24} {this_summary['runs']:>6} {passed / this_summary['runs']:>6.0%}"
+            f" {_format_seconds(this_summary['p50 seconds']):>8} {_format_seconds(this_summary['p90 seconds']):>8}"
+            f" {_format_seconds(this_summary['max seconds']):>8} {_format_seconds(this_summary['mean cpu seconds']):>8}"
+            f" {_format_bytes(this_summary['peak rss bytes']):>8} {_format_trend(this_summary['trend']):>7}"
+            f" {_format_seconds(this_summary['wasted seconds']):>8}",
+        )
+    slowest = get_slowest_targets(runs, count=count)
+    if slowest:
+        lines += ['', "slowest targets (mean seconds per run, split evenly between each run's targets):"]
+        lines += [f"{_format_seconds(seconds):>8}  {tool}: {target}" for tool, target, seconds in slowest]
+    return '\n'.join(lines)
+
+
+# [ Internal ]
+def _format_seconds(seconds):
+    """Format the seconds, if any."""
+    return '-' if seconds is None else f"{seconds:.2f}s"
+
+
+def _format_bytes(count):
+    """Format the byte count, if any, in MB."""
+    return '-' if count is None else f"{count / (1024 * 1024):.0f}MB"
+
+
+def _format_trend(trend):
+    """Format the trend, if any, as a percentage change."""
+    return '-' if trend is None else f"{trend:+.0%}"
@@ -0,0 +1,179 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk import graph.
+
+An incrementally maintained index of the imports of the project's python files,
+used to work out which files transitively import a changed module.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import ast
+import hashlib
+import pathlib
+# [ -Third Party ]
+import pytoml as toml
+
+
+# [ API ]
+def module_name_for(relative_path):
+    """
+    Get the module name for the path, relative to the project root, and whether it's a package.
+
+    Returns None for paths which aren't python modules.
+    """
+    parts = pathlib.PurePath(relative_path).with_suffix('').parts
+    if pathlib.PurePath(relative_path).suffix != '.py' or not parts:
+        return None
+    if parts[-1] == '__init__':
+        return '.'.join(parts[:-1]), True
+    return '.'.join(parts), False
+
+
+def parse_imports(source, *, module, is_package):
+    """
+    Parse the names of the modules the source imports.
+
+    Relative imports are resolved against the module.  For `from x import y`, both
+    `x.y` and `x` are returned, because `y` may be a module or just a name in `x`.
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return []
+    package = module if is_package else module.rpartition('.')[0]
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = _resolve_relative(node.module, level=node.level, package=package)
+            if base is None:
+                continue
+            if base:
+                names.add(base)
+            names.update(f"{base}.{alias.name}" if base else alias.name for alias in node.names if alias.name != '*')
+    return sorted(names)
+
+
+def get_dependencies(imports_per_path):
+    """
+    Get the graph of project paths to the project paths they import.
+
+    Importing a module also imports the packages it is in, so those are dependencies, too.
+    """
+    paths_per_module = {}
+    for path in imports_per_path:
+        module = module_name_for(path)
+        if module is not None:
+            paths_per_module[module[0]] = path
+    graph = {}
+    for path, names in imports_per_path.items():
+        dependencies = set()
+        for name in names:
+            parts = name.split('.')
+            for depth in range(1, len(parts) + 1):
+                dependency = paths_per_module.get('.'.join(parts[:depth]), None)
+                if dependency is not None and dependency != path:
+                    dependencies.add(dependency)
+        graph[path] = dependencies
+    return graph
+
+
+def get_closure(graph, path):
+    """Get every path the path transitively depends on, not including itself."""
+    closure = set()
+    to_visit = list(graph.get(path, ()))
+    while to_visit:
+        this_path = to_visit.pop()
+        if this_path in closure or this_path == path:
+            continue
+        closure.add(this_path)
+        to_visit.extend(graph.get(this_path, ()))
+    return closure
+
+
+def get_closure_hash(path, *, graph, hashes):
+    """Get a hash of the path's content together with the content of everything it transitively imports."""
+    closure_hash = hashlib.sha1(hashes[path].encode('utf-8'))
+    for dependency in sorted(get_closure(graph, path)):
+        closure_hash.update(f"\0{dependency}\0{hashes[dependency]}".encode('utf-8'))
+    return closure_hash.hexdigest()
+
+
+class ImportIndex:
+    """
+    Persistent index of the imports of each python file.
+
+    Files are only re-parsed when their content hash changes.
+    """
+
+    def __init__(self, path):
+        """Init the state."""
+        self._path = pathlib.Path(path)
+        self._entries = None
+
+    def get_graph(self, hashes, *, root):
+        """
+        Get the import graph for the hashed python files.
+
+        Paths in the graph match the paths of the hashes.  The index itself is kept
+        relative to the root.
+        """
+        if self._entries is None:
+            self._entries = self._load()
+        root = pathlib.Path(root)
+        relative_paths = {}
+        for path in hashes:
+            try:
+                relative_paths[path] = str(pathlib.Path(path).absolute().relative_to(root))
+            except ValueError:
+                # not in the project - can't be imported by module name from it
+                continue
+        updated = False
+        for path, relative_path in relative_paths.items():
+            file_hash = hashes[path]
+            entry = self._entries.get(relative_path, None)
+            if entry and entry['hash'] == file_hash:
+                continue
+            module, is_package = module_name_for(relative_path)
+            self._entries[relative_path] = {
+                'hash': file_hash,
+                'imports': parse_imports(pathlib.Path(path).read_bytes(), module=module, is_package=is_package),
+            }
+            updated = True
+        if updated:
+            self._save()
+        paths = {r: p for p, r in relative_paths.items()}
+        relative_graph = get_dependencies({r: self._entries[r]['imports'] for r in paths})
+        return {paths[r]: {paths[d] for d in dependencies} for r, dependencies in relative_graph.items()}
+
+    def _load(self):
+        """Load the saved index."""
+        try:
+            return toml.loads(self._path.read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            return {}
+
+    def _save(self):
+        """Save the index."""
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._path.write_text(toml.dumps(self._entries), encoding='utf-8')
+
+
+# [ Internal ]
+def _resolve_relative(module, *, level, package):
+    """Resolve a possibly-relative module name, returning None if it reaches past the top of the project."""
+    if not level:
+        return module or ''
+    package_parts = package.split('.') if package else []
+    if level - 1 > len(package_parts):
+        return None
+    base_parts = package_parts[:len(package_parts) - (level - 1)]
+    if module:
+        base_parts.append(module)
+    return '.'.join(base_parts)
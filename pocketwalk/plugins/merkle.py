@@ -0,0 +1,114 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk Merkle trees.
+
+A tree of directory hashes over a map of file paths to their content hashes.
+Two trees are equal if their root hashes are, and the files which differ between
+them are found by descending only into the directories whose hashes differ.
+Trees are updated by the changed files alone - every unchanged directory is
+shared with the tree it was updated from.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import hashlib
+import os
+import pathlib
+
+
+# [ API ]
+class MerkleTree:
+    """
+    Merkle tree of file hashes.
+
+    Paths under the root are kept relative to it, so trees of the same files in
+    different clones of the project have the same hash.
+    """
+
+    __slots__ = ('root', '_node')
+
+    def __init__(self, *, root, node=None):
+        """Init the state."""
+        self.root = str(root)
+        self._node = node
+
+    @classmethod
+    def from_hashes(cls, file_hashes, *, root):
+        """Get the tree of the file hashes."""
+        return cls(root=root).updated(file_hashes)
+
+    @property
+    def hash(self):
+        """Get the root hash."""
+        return self._node[0] if self._node else ''
+
+    def updated(self, changes):
+        """Get the tree updated with the changes, which map paths to their new hashes, or to None, if removed."""
+        node = _update_node(self._node, [(self._get_parts(p), h) for p, h in changes.items()])
+        return MerkleTree(root=self.root, node=node if node[1] else None)
+
+    def changed_paths(self, other):
+        """Get the paths which were added, or whose hashes changed, since the other tree."""
+        return [os.path.join(self.root, *parts) for parts in _changed_parts(self._node, other._node, ())]
+
+    # [ Internal ]
+    def _get_parts(self, path):
+        """Get the parts of the path, relative to the root, if it's under it."""
+        path = pathlib.PurePath(path)
+        try:
+            return path.relative_to(self.root).parts
+        except ValueError:
+            return path.parts
+
+
+# [ Internal ]
+def _update_node(node, changes):
+    """
+    Update the directory node with the changes, which are (path parts, hash) pairs relative to it.
+
+    Nodes are (hash, children) pairs, and files are their hashes.  Only the directories on the
+    changed paths are copied and re-hashed.
+    """
+    children = dict(node[1]) if node else {}
+    changes_per_child = {}
+    for parts, file_hash in changes:
+        if len(parts) > 1:
+            changes_per_child.setdefault(parts[0], []).append((parts[1:], file_hash))
+        elif file_hash is None:
+            children.pop(parts[0], None)
+        else:
+            children[parts[0]] = file_hash
+    for name, child_changes in changes_per_child.items():
+        child = children.get(name, None)
+        updated = _update_node(child if isinstance(child, tuple) else None, child_changes)
+        if updated[1]:
+            children[name] = updated
+        else:
+            children.pop(name, None)
+    return _hash_children(children), children
+
+
+def _hash_children(children):
+    """Hash the directory's children."""
+    digest = hashlib.sha1()
+    for name in sorted(children):
+        child = children[name]
+        entry = f"d{child[0]}" if isinstance(child, tuple) else f"f{child}"
+        digest.update(f"{name}\0{entry}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _changed_parts(node, other, prefix):
+    """Yield the parts of the paths under the node which were added, or whose hashes changed, since the other node."""
+    if node is None or (other is not None and node[0] == other[0]):
+        return
+    for name, child in node[1].items():
+        other_child = other[1].get(name, None) if other is not None else None
+        if isinstance(child, tuple):
+            yield from _changed_parts(child, other_child if isinstance(other_child, tuple) else None, prefix + (name,))
+        elif child != other_child:
+            yield prefix + (name,)
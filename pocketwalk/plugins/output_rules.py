@@ -0,0 +1,105 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk output rules.
+
+A tool's output is matched against its rules a line at a time, as it streams:
+lines matching a filter pattern are dropped as noise, before they're rendered or
+saved, and a line matching a fail-on pattern fails the tool on the spot.  Each
+set of patterns is compiled into a single regex, which is run over a whole chunk
+of lines at once, and only the lines it matches are picked out, so matching keeps
+up with tools writing megabytes a second.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import re
+
+
+# [ Static ]
+# a line held back this long without a newline is matched as it is, so it can't grow without bound
+_MAX_PARTIAL_BYTES = 64 * 1024
+
+
+# [ API ]
+def compile_patterns(patterns):
+    """
+    Compile the patterns into one regex, matching wherever any of them does, or None, if there are none.
+
+    Patterns are matched against the raw bytes of the output, with '^' and '$' matching
+    at the start and end of each line.
+    """
+    if not patterns:
+        return None
+    return re.compile(b'|'.join(b'(?:' + p.encode('utf-8') + b')' for p in patterns), re.MULTILINE)
+
+
+def find_lines(regex, data):
+    """Find the lines in the data which the regex matches, as the (start, end) of each, end included."""
+    position = 0
+    while True:
+        match = regex.search(data, position)
+        if match is None:
+            return
+        start = data.rfind(b'\n', 0, match.start()) + 1
+        end = data.find(b'\n', match.start()) + 1 or len(data)
+        yield start, end
+        position = end
+
+
+class OutputRules:
+    """A tool's output rules, applied to its output as it streams."""
+
+    def __init__(self, *, fail_on, filter_out):
+        """Init the state."""
+        self._fail_on = compile_patterns(fail_on)
+        self._filter_out = compile_patterns(filter_out)
+        self._partial = b''
+        self.failure = None
+        self.filtered = 0
+        self.kept_output = False
+
+    # [ API ]
+    def feed(self, data):
+        """
+        Apply the rules to the output, and return what's kept of it.
+
+        Only whole lines are returned - the rest of a line is held back until it's
+        finished, or the output is flushed.
+        """
+        data = self._partial + data
+        end = data.rfind(b'\n') + 1
+        if len(data) - end > _MAX_PARTIAL_BYTES:
+            end = len(data)
+        self._partial = data[end:]
+        return self._apply(data[:end])
+
+    def flush(self):
+        """Apply the rules to any line held back, once the output's ended, and return what's kept of it."""
+        data, self._partial = self._partial, b''
+        return self._apply(data)
+
+    # [ Internal ]
+    def _apply(self, lines):
+        """Apply the rules to the whole lines, and return what's kept of them."""
+        if not lines:
+            return lines
+        if self._filter_out is not None:
+            kept = []
+            last = 0
+            for start, end in find_lines(self._filter_out, lines):
+                kept.append(lines[last:start])
+                last = end
+                self.filtered += 1
+            kept.append(lines[last:])
+            lines = b''.join(kept)
+        if self._fail_on is not None and self.failure is None:
+            for start, end in find_lines(self._fail_on, lines):
+                self.failure = lines[start:end].strip().decode('utf-8', errors='replace')
+                break
+        if not self.kept_output and lines.strip():
+            self.kept_output = True
+        return lines
@@ -0,0 +1,212 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk output store.
+
+Tool output is stored as a sequence of independently zlib-compressed frames,
+followed by a small TOML index recording each frame's offset, compressed size,
+raw size, and line count, and a trailer giving the index's length.  The index
+lets the tail of the output be read, and the whole output be streamed, without
+ever holding all of it in memory.
+
+Output which was written straight to a file, without passing through python,
+is stored as-is, and indexed in raw frames instead.
+
+Output and its index are written off to the side, in one file, and renamed into
+place in one step, so a crash mid-write never leaves half of it behind, nor an
+index which doesn't match its output.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import os
+import pathlib
+import shutil
+import struct
+import zlib
+# [ -Third Party ]
+import pytoml as toml
+
+
+# [ Static ]
+_FRAME_SIZE = 64 * 1024
+# the index's length, and a marker telling indexed output from output saved before it was indexed
+_TRAILER = struct.Struct('>Q8s')
+_TRAILER_MARKER = b'pwindex1'
+
+
+# [ API ]
+class OutputWriter:
+    """
+    Incremental writer of framed, compressed output.
+
+    Frames are compressed as they fill, so output written as it streams is never
+    compressed all at once.  Nothing is in place at the path until the writer's closed.
+    """
+
+    def __init__(self, path):
+        """Init the state."""
+        self._path = pathlib.Path(path)
+        self._staging_path = self._path.with_name(self._path.name + '.writing')
+        self._file = self._staging_path.open('wb')
+        self._pending = b''
+        self._frames = []
+        self._size = 0
+
+    @property
+    def size(self):
+        """The size of the output written so far, before it's compressed."""
+        return self._size
+
+    def write(self, data):
+        """Write the data, compressing any complete frames."""
+        self._pending += data
+        self._size += len(data)
+        while len(self._pending) >= _FRAME_SIZE:
+            self._write_frame(self._pending[:_FRAME_SIZE])
+            self._pending = self._pending[_FRAME_SIZE:]
+
+    def close(self):
+        """Write the remaining data, and its index, and put the output in place."""
+        if self._pending:
+            self._write_frame(self._pending)
+            self._pending = b''
+        self._file.write(_get_index_trailer(self._frames, encoding='zlib'))
+        self._file.close()
+        os.replace(self._staging_path, self._path)
+
+    def discard(self):
+        """Discard anything written which isn't in place yet, leaving any output already at the path as it was."""
+        self._file.close()
+        self._staging_path.unlink(missing_ok=True)
+
+    def _write_frame(self, raw):
+        """Write a single compressed frame, and record it in the index."""
+        compressed = zlib.compress(raw)
+        self._frames.append([self._file.tell(), len(compressed), len(raw), raw.count(b'\n')])
+        self._file.write(compressed)
+
+
+def save_output(path, output):
+    """Save the output to the path."""
+    writer = OutputWriter(path)
+    writer.write(output)
+    writer.close()
+
+
+def adopt_raw_output(source, destination):
+    """Move uncompressed output written to the source path to the destination path, indexing it in raw frames."""
+    frames = []
+    with pathlib.Path(source).open('rb') as output_file:
+        for raw in iter(lambda: output_file.read(_FRAME_SIZE), b''):
+            offset = frames[-1][0] + frames[-1][1] if frames else 0
+            frames.append([offset, len(raw), len(raw), raw.count(b'\n')])
+    with pathlib.Path(source).open('ab') as output_file:
+        output_file.write(_get_index_trailer(frames, encoding='raw'))
+    pathlib.Path(source).replace(destination)
+
+
+def copy_output(source, destination):
+    """Copy the output saved to the source path to the destination path."""
+    destination = pathlib.Path(destination)
+    staging_path = destination.with_name(destination.name + '.writing')
+    shutil.copyfile(source, staging_path)
+    os.replace(staging_path, destination)
+
+
+def move_output(source, destination):
+    """Move the output saved to the source path to the destination path."""
+    pathlib.Path(source).replace(destination)
+
+
+def remove_output(path):
+    """Remove the output saved to the path, if any."""
+    pathlib.Path(path).unlink(missing_ok=True)
+
+
+def output_exists(path):
+    """Return whether or not output has been saved to the path."""
+    return pathlib.Path(path).exists()
+
+
+def load_summary(path):
+    """Load the size and line count of the output saved to the path."""
+    index = _load_index(path)
+    return {'size': index['size'], 'lines': index['lines']}
+
+
+def read_tail(path, *, lines):
+    """Read the last lines of the output saved to the path."""
+    index = _load_index(path)
+    # walk back from the end only as far as needed to cover the requested lines, plus the
+    # newline ending the line before them.
+    needed_frames = []
+    newlines = 0
+    for frame in reversed(index['frames']):
+        needed_frames.insert(0, frame)
+        newlines += frame[3]
+        if newlines > lines:
+            break
+    with pathlib.Path(path).open('rb') as output_file:
+        data = b''.join(_read_frame(output_file, frame, encoding=index['encoding']) for frame in needed_frames)
+    return tail_lines(data, lines=lines)
+
+
+def stream_output(path, sink):
+    """Stream the output saved to the path to the sink, a frame at a time."""
+    index = _load_index(path)
+    with pathlib.Path(path).open('rb') as output_file:
+        for frame in index['frames']:
+            sink.write(_read_frame(output_file, frame, encoding=index['encoding']))
+
+
+def tail_lines(data, *, lines):
+    """Return the last lines of the data."""
+    if lines <= 0:
+        return b''
+    return b''.join(data.splitlines(keepends=True)[-lines:])
+
+
+# [ Internal ]
+def _get_index_trailer(frames, *, encoding):
+    """Get the index of the frames, and the trailer following it, to end the output with."""
+    index = toml.dumps({
+        'encoding': encoding,
+        'size': sum(f[2] for f in frames),
+        'lines': sum(f[3] for f in frames),
+        'frames': frames,
+    }).encode('utf-8')
+    return index + _TRAILER.pack(len(index), _TRAILER_MARKER)
+
+
+def _load_index(path):
+    """
+    Load the index from the end of the output at the path.
+
+    Output saved before outputs were indexed has no index, and is treated as a
+    single raw frame.
+    """
+    with pathlib.Path(path).open('rb') as output_file:
+        end = output_file.seek(0, os.SEEK_END)
+        if end >= _TRAILER.size:
+            output_file.seek(end - _TRAILER.size)
+            length, marker = _TRAILER.unpack(output_file.read(_TRAILER.size))
+            if marker == _TRAILER_MARKER and length <= end - _TRAILER.size:
+                output_file.seek(end - _TRAILER.size - length)
+                return toml.loads(output_file.read(length).decode('utf-8'))
+        output_file.seek(0)
+        lines = sum(chunk.count(b'\n') for chunk in iter(lambda: output_file.read(_FRAME_SIZE), b''))
+    return {'encoding': 'raw', 'size': end, 'lines': lines, 'frames': [[0, end, end, lines]]}
+
+
+def _read_frame(output_file, frame, *, encoding):
+    """Read a single frame."""
+    offset, stored_size, _raw_size, _lines = frame
+    output_file.seek(offset)
+    stored = output_file.read(stored_size)
+    if encoding == 'raw':
+        return stored
+    return zlib.decompress(stored)
@@ -0,0 +1,159 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk write-behind persistence.
+
+Records saved as tools complete - contexts, return codes, target results, and
+the run history - are queued to a writer thread, rather than written, and
+serialized, on the event loop, where they'd hold up the other tools' output.
+The writer writes the queue in order, in batches, each file replaced atomically,
+via a temp file, so a crash never leaves a half-written record behind.  Queued
+content is read back from the queue until it's written, and the queue is
+flushed when pocketwalk exits.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import atexit
+import collections
+import os
+import pathlib
+import tempfile
+import threading
+
+
+# [ Static ]
+# queueing blocks once this many writes are waiting, so a slow disk can't grow the queue without bound
+_MAX_PENDING = 256
+_WRITER = None
+_WRITER_LOCK = threading.Lock()
+
+
+# [ API ]
+def get_writer():
+    """Get the process's writer, starting it if it isn't already."""
+    global _WRITER  # pylint: disable=global-statement
+    with _WRITER_LOCK:
+        if _WRITER is None:
+            _WRITER = Writer()
+            atexit.register(_WRITER.flush)
+        return _WRITER
+
+
+def write_atomic(path, data):
+    """Replace the file at the path with the data - text or bytes - atomically."""
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w' if isinstance(data, str) else 'wb', dir=path.parent, delete=False) as staging:
+        staging.write(data)
+    os.replace(staging.name, path)
+
+
+class Writer:
+    """Writer of files, in order, on a background thread."""
+
+    def __init__(self, *, max_pending=_MAX_PENDING):
+        """Init the state."""
+        self._max_pending = max_pending
+        self._condition = threading.Condition()
+        self._queue = collections.deque()
+        self._latest = {}
+        self._writing = False
+        self._thread = None
+
+    # [ API ]
+    def replace(self, path, content):
+        """
+        Queue replacing the file at the path with the content.
+
+        The content is text or bytes, or a function returning them, which is called on the
+        writer thread, so serializing a record doesn't hold up the caller either.
+        """
+        self._put('replace', path, content)
+
+    def append(self, path, content):
+        """Queue appending the text to the file at the path."""
+        self._put('append', path, content)
+
+    def read_text(self, path):
+        """Read the text of the file at the path, or the text queued to replace it, if it hasn't been written yet."""
+        with self._condition:
+            content = self._latest.get(str(path), None)
+        if content is None:
+            return pathlib.Path(path).read_text(encoding='utf-8')
+        content = _render(content)
+        return content if isinstance(content, str) else content.decode('utf-8')
+
+    def exists(self, path):
+        """Return whether the file at the path exists, or is queued to."""
+        with self._condition:
+            if str(path) in self._latest:
+                return True
+        return pathlib.Path(path).exists()
+
+    def flush(self):
+        """Wait for everything queued to be written."""
+        with self._condition:
+            self._condition.wait_for(lambda: not self._queue and not self._writing)
+
+    # [ Internal ]
+    def _put(self, kind, path, content):
+        """Queue the write."""
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='pocketwalk-writer', daemon=True)
+                self._thread.start()
+            self._condition.wait_for(lambda: len(self._queue) < self._max_pending)
+            self._queue.append((kind, str(path), content))
+            if kind == 'replace':
+                self._latest[str(path)] = content
+            self._condition.notify_all()
+
+    def _run(self):
+        """Write the queue, a batch at a time."""
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue)
+                batch = list(self._queue)
+                self._queue.clear()
+                self._writing = True
+                self._condition.notify_all()
+            self._write_batch(batch)
+            with self._condition:
+                for kind, path, content in batch:
+                    if kind == 'replace' and self._latest.get(path, None) is content:
+                        del self._latest[path]
+                self._writing = False
+                self._condition.notify_all()
+
+    @staticmethod
+    def _write_batch(batch):
+        """
+        Write the batch, in order.
+
+        A file replaced more than once in a batch is only written the last time, so the
+        files still reach each of their final states in the order they were queued.
+        """
+        last_replace = {path: i for i, (kind, path, _content) in enumerate(batch) if kind == 'replace'}
+        for index, (kind, path, content) in enumerate(batch):
+            if kind == 'replace' and last_replace[path] != index:
+                continue
+            try:
+                if kind == 'replace':
+                    write_atomic(path, _render(content))
+                else:
+                    pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+                    with pathlib.Path(path).open('a', encoding='utf-8') as append_file:
+                        append_file.write(content)
+            # a failed write mustn't take the writer down with it - the rest of the queue is still good
+            except Exception as error:  # pylint: disable=broad-except
+                print(f"Failed to write {path} ({error})")
+
+
+# [ Internal ]
+def _render(content):
+    """Render the content, if it's a function returning it."""
+    return content() if callable(content) else content
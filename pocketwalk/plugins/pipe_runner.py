@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk pipe runner.
+
+Runs a tool locally, with its output to a pipe, which is spliced into the tool's output
+file.  The output's copied by the OS, from the pipe to the file, and from the file to the
+terminal, so it never passes through python, unless there are output rules, which it's
+passed through on its way.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import os
+import pathlib
+# [ -Project ]
+from pocketwalk.plugins import output_store, processes
+
+
+# [ Static ]
+_SPLICE_BYTES = 1024 * 1024
+
+
+# [ API ]
+async def run(args, *, limits, cwd, output_path, renderer, label, rules=None):
+    """
+    Run the tool with its output to a pipe, rendering its output under the label.
+
+    The tool's killed the moment its output matches a fail-on pattern.  The raw output is
+    put in place at the output path once the tool's done.  Returns the size of the output,
+    the process, whether or not the process was killed for timing out, and its usage.
+    """
+    pending_path = output_path.with_suffix('.pending')
+    output_fds = os.pipe()
+    output_fd = os.open(pending_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, 0o644)
+    # the renderer sends from this, which stays readable once the output's renamed into place
+    output_file = pathlib.Path(pending_path).open('rb')
+
+    def render(count):
+        """Render the count of bytes last written to the output file."""
+        renderer.tool_output_file(label, output_file, offset=os.lseek(output_fd, 0, os.SEEK_CUR) - count, count=count)
+
+    def read():
+        """Copy and render what's waiting in the output, and return whether there was any."""
+        read_any, count = _splice_output(output_fds[0], output_fd, inspect=None if rules is None else rules.feed)
+        render(count)
+        return read_any
+
+    try:
+        ran = await processes.run(
+            args, limits=limits, cwd=cwd, output_fds=output_fds, read=read,
+            should_kill=lambda: rules is not None and rules.failure is not None,
+        )
+        if rules is not None:
+            render(_write_output(output_fd, rules.flush()))
+    finally:
+        os.close(output_fds[0])
+        os.close(output_fd)
+        renderer.close_output_file(output_file)
+    size = pending_path.stat().st_size
+    output_store.adopt_raw_output(pending_path, output_path)
+    return (size, *ran)
+
+
+# [ Internal ]
+def _splice_output(output_side, output_fd, *, inspect):
+    """
+    Copy what's waiting in the output pipe to the output file.
+
+    Output which is to be inspected, as it streams, is passed to the inspect function on
+    its way through, and only what it returns is copied.  Returns whether any output was
+    waiting, and how much was copied.
+    """
+    if inspect is None and hasattr(os, 'splice'):
+        count = os.splice(output_side, output_fd, _SPLICE_BYTES)
+        return bool(count), count
+    # splice is linux-only, and inspected output has to pass through python anyway
+    data = os.read(output_side, _SPLICE_BYTES)
+    read_any = bool(data)
+    if inspect is not None:
+        data = inspect(data)
+    return read_any, _write_output(output_fd, data)
+
+
+def _write_output(output_fd, data):
+    """Write all the data to the output file, and return how much was written."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(output_fd, view):]
+    return len(data)
@@ -0,0 +1,203 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk tool processes.
+
+Tools are spawned the same way wherever they run - by the tool runner, locally, and
+by a worker, for a remote one - each in a session of its own, so it can be killed
+along with its own subprocesses, with its I/O priority and resource limits applied
+by wrapper commands, before it's exec'd.  They're reaped via wait4, so their resource
+usage can be recorded, and they're waited on the same way, too, for their output, for
+their exit, and for their time to run out.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import os
+import resource
+import select
+import shutil
+import signal
+import subprocess
+import time
+# [ -Project ]
+from pocketwalk import reactor
+from pocketwalk.plugins import history
+
+
+# [ Static ]
+_IONICE_CLASSES = {'realtime': '1', 'best-effort': '2', 'idle': '3'}
+_MEGABYTE = 1024 * 1024
+# how often to check whether a tool has exited, where the OS can't signal it
+_EXIT_POLL_SECONDS = 0.1
+
+
+# [ API ]
+def with_io_priority(args, *, limits):
+    """Return the args, prefixed to run with the I/O priority from the limits."""
+    if 'ionice' not in limits:
+        return args
+    ionice = shutil.which('ionice')
+    if not ionice:
+        print(f"ionice not found - running {args[0]} with the default I/O priority.")
+        return args
+    return [ionice, '-c', _IONICE_CLASSES[limits['ionice']]] + args
+
+
+def with_limits(args, *, limits):
+    """
+    Return the args, prefixed to run with the limits, and the I/O priority.
+
+    Each limit's set by a wrapper, which execs the next, so the limits are in place in the
+    tool's own process before it's exec'd - the tool never runs without them, nor does
+    anything it forks.  A wrapper which can't be found is skipped, with a warning.
+    """
+    wrappers = []
+    rlimits = []
+    if 'max memory' in limits:
+        rlimits.append(f"--as={limits['max memory'] * _MEGABYTE}")
+    if 'max cpu time' in limits:
+        # the hard limit is a second past the soft limit, so the tool gets SIGXCPU before SIGKILL
+        rlimits.append(f"--cpu={limits['max cpu time']}:{limits['max cpu time'] + 1}")
+    if rlimits:
+        wrappers.append(('prlimit', 'memory and CPU time limits', rlimits + ['--']))
+    if 'nice' in limits:
+        # nice adjusts the niceness it's run with - pocketwalk's own - so the tool gets the one asked for
+        wrappers.append(('nice', 'nice level', ['-n', str(limits['nice'] - os.getpriority(os.PRIO_PROCESS, 0))]))
+    if 'cpu affinity' in limits:
+        wrappers.append(('taskset', 'CPU affinity', ['-c', ','.join(str(c) for c in limits['cpu affinity'])]))
+    prefix = []
+    for name, applies, options in wrappers:
+        path = shutil.which(name)
+        if not path:
+            print(f"{name} not found - running {args[0]} without its {applies}.")
+            continue
+        prefix += [path] + options
+    return prefix + with_io_priority(args, limits=limits)
+
+
+def spawn(args, *, limits, cwd, stdout, stdin=None):
+    """Spawn the tool in a session of its own, with its output and errors to stdout, under the limits."""
+    return subprocess.Popen(
+        with_limits(args, limits=limits),
+        stdin=stdin,
+        stdout=stdout,
+        stderr=subprocess.STDOUT,
+        start_new_session=True,
+        cwd=cwd,
+    )
+
+
+def open_exit_fd(process):
+    """Open a file descriptor which is readable once the process exits, or return None, if that's unsupported."""
+    try:
+        return os.pidfd_open(process.pid)
+    except (AttributeError, OSError):
+        return None
+
+
+def has_exited(process):
+    """Return whether the process has exited, without reaping it, so its resource usage is still there to be had."""
+    return os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None
+
+
+def reap(process, *, block=False):
+    """
+    Reap the process, if it's exited, or block until it does, and return its resource usage.
+
+    Returns None if it hasn't exited.  The process is reaped via wait4, rather than by the
+    process object, which would throw the usage away, and its RC is set from the exit status.
+    """
+    pid, status, rusage = os.wait4(process.pid, 0 if block else os.WNOHANG)
+    if not pid:
+        return None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return rusage
+
+
+def kill(process):
+    """Kill the process's whole session, so its own subprocesses don't outlive it, and return its resource usage."""
+    os.killpg(process.pid, signal.SIGKILL)
+    return reap(process, block=True)
+
+
+def get_wait_timeout(process, *, exit_fd, started, limits):
+    """
+    Get how long to wait on the tool before looking in on it again - None, to wait until it exits.
+
+    A tool which has run out of time is killed.  Returns the timeout, and whether or not the
+    tool was killed for timing out.
+    """
+    timeout = None if exit_fd is not None else _EXIT_POLL_SECONDS
+    if 'timeout' in limits:
+        remaining = limits['timeout'] - (time.monotonic() - started)
+        if remaining <= 0:
+            # kill the whole session, so the tool's own subprocesses don't outlive it
+            os.killpg(process.pid, signal.SIGKILL)
+            return 0, True
+        timeout = remaining if timeout is None else min(timeout, remaining)
+    return timeout, False
+
+
+def drain(output_fd, read):
+    """Read what's waiting on the output with the read function, until it returns that nothing was read."""
+    while select.select([output_fd], [], [], 0)[0]:
+        if not read():
+            break
+
+
+async def run(args, *, limits, cwd, output_fds, read, should_kill):
+    """
+    Run the tool, with its output to the output fds, calling the read function whenever there's output to read.
+
+    The read function returns whether any output was read.  The tool is killed if it runs
+    out of time, as soon as the should_kill function says so - once its output matches a
+    fail-on pattern, say - or if the run's cancelled.  Returns the process, whether or not
+    it was killed for timing out, and its usage, for the history.
+    """
+    output_side, input_side = output_fds
+    spawn_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        process = spawn(args, limits=limits, cwd=cwd, stdout=input_side)
+    finally:
+        # only the tool holds the output open, so it reads as ended once the tool's done with it
+        os.close(input_side)
+    try:
+        timed_out, rusage = await _follow(process, output_side, limits=limits, read=read, should_kill=should_kill)
+    except GeneratorExit:
+        print("TERMINATED")
+        kill(process)
+        raise
+    return process, timed_out, history.get_usage(rusage, spawn_rss=spawn_rss)
+
+
+# [ Internal ]
+async def _follow(process, output_fd, *, limits, read, should_kill):
+    """Follow the tool's output until it exits, and return whether or not it was killed for timing out, and its rusage."""
+    exit_fd = open_exit_fd(process)
+    started = time.monotonic()
+    try:
+        timed_out = False
+        reading = True
+        rusage = reap(process)
+        while rusage is None:
+            timeout, timed_out = get_wait_timeout(process, exit_fd=exit_fd, started=started, limits=limits)
+            if timed_out:
+                rusage = reap(process, block=True)
+                break
+            fds = ([output_fd] if reading else []) + ([exit_fd] if exit_fd is not None else [])
+            if output_fd in await reactor.wait_readable(fds, timeout=timeout):
+                reading = read()
+                if should_kill():
+                    rusage = kill(process)
+                    break
+            rusage = reap(process)
+        # the tool may have written more before it exited than has been read yet
+        drain(output_fd, read)
+        return timed_out, rusage
+    finally:
+        if exit_fd is not None:
+            os.close(exit_fd)
@@ -0,0 +1,85 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk PTY runner.
+
+Runs a tool locally, in a pseudo terminal, so its output comes out as it would on the
+user's own terminal - in color, and a line at a time.  The output's read as it's
+written, passed through the tool's output rules, if any, rendered, and compressed into
+the tool's output file.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import errno
+import os
+import pty
+# [ -Project ]
+from pocketwalk.plugins import output_store, processes
+
+
+# [ Static ]
+_READ_BYTES = 64 * 1024
+
+
+# [ API ]
+async def run(args, *, limits, cwd, output_path, renderer, label, rules=None):
+    """
+    Run the tool in a PTY, rendering its output under the label.
+
+    The tool's killed the moment its output matches a fail-on pattern.  What's kept of the
+    output is compressed into the output path as it's read.  Returns the size of the
+    output, the process, whether or not the process was killed for timing out, and its
+    usage.
+    """
+    output_side, input_side = pty.openpty()
+    output = output_store.OutputWriter(output_path)
+
+    def keep(chunk):
+        """Render and save what's kept of the output."""
+        if chunk:
+            renderer.tool_output(label, chunk)
+        output.write(chunk)
+
+    def read():
+        """Read what's waiting in the output, and return whether there was any."""
+        chunk, read_any = _read_output(output_side, rules=rules)
+        keep(chunk)
+        return read_any
+
+    try:
+        ran = await processes.run(
+            args, limits=limits, cwd=cwd, output_fds=(output_side, input_side), read=read,
+            should_kill=lambda: rules is not None and rules.failure is not None,
+        )
+        if rules is not None:
+            keep(rules.flush())
+        output.close()
+        return (output.size, *ran)
+    finally:
+        os.close(output_side)
+        # output which wasn't put in place was cut short, and is left out
+        output.discard()
+
+
+# [ Internal ]
+def _read_output(output_side, *, rules=None):
+    """
+    Read what's waiting in the output.
+
+    Returns what's kept of the output read, by the output rules, if any, and whether any was read.
+    """
+    try:
+        chunk = os.read(output_side, _READ_BYTES)
+    except OSError as error:
+        # reading a terminal nothing holds open anymore fails, rather than returning nothing
+        if error.errno != errno.EIO:
+            raise
+        chunk = b''
+    read_any = bool(chunk)
+    if rules is not None:
+        chunk = rules.feed(chunk)
+    return chunk, read_any
@@ -0,0 +1,380 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk remote executor.
+
+Tools, or shards of their targets, are run on workers - `pocketwalk worker`
+processes, on other machines, or on this one - over a simple protocol: each
+message is a line of JSON, followed by a raw payload of the message's `size`, if
+it has one.
+
+* the client sends `{"op": "run", "args": [...], "files": {path: hash}, "limits": {...}}`
+* the worker replies `{"event": "need", "hashes": [...]}`, with the hashes of the content it doesn't have
+* the client sends each as `{"op": "object", "hash": ..., "size": ...}`, followed by the content
+* the worker links the files into a snapshot, from its content-addressed store, replies
+  `{"event": "started"}`, and streams the tool's output as `{"event": "output", "size": ...}`,
+  followed by the output, then `{"event": "exit", "return code": ..., "timed out": ..., "usage": {...}}`
+
+Content is keyed by the hashes the contexts already use, so a worker is only ever
+sent content it's never seen.  Hanging up stops the run - the worker kills the tool.
+
+Workers are given as `host:port`, `unix:path`, or `local:N`, which starts N
+workers on this machine, each with a store of its own, as a stand-in for real ones.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import atexit
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+# [ -Project ]
+from pocketwalk import reactor
+
+
+# [ Static ]
+DEFAULT_PORT = 7787
+_CONNECT_TIMEOUT_SECONDS = 5
+_LOCAL_START_SECONDS = 5
+_READ_BYTES = 1024 * 1024
+
+
+# [ API ]
+def get_remote_executor():
+    """Get the remote executor plugin."""
+    return RemoteExecutor()
+
+
+def encode_message(message, payload=None):
+    """Encode the message as a line of JSON, followed by its payload, if it has one."""
+    if payload is None:
+        return json.dumps(message).encode('utf-8') + b'\n'
+    return json.dumps(dict(message, size=len(payload))).encode('utf-8') + b'\n' + payload
+
+
+def parse_address(address):
+    """
+    Parse the worker's address into its kind - 'tcp', 'unix', or 'local' - and where it is.
+
+    TCP workers are at a (host, port), with the port defaulting to the worker's own default,
+    unix workers are at a path, and local workers are how many to start.
+    """
+    kind, _separator, rest = address.partition(':')
+    if kind == 'unix':
+        return 'unix', rest
+    if kind == 'local':
+        return 'local', int(rest) if rest else os.cpu_count()
+    host, _separator, port = address.rpartition(':')
+    if not host:
+        return 'tcp', (address, DEFAULT_PORT)
+    return 'tcp', (host, int(port))
+
+
+def connect(kind, location):
+    """Connect to the worker of the kind at the location, returning the socket."""
+    if kind == 'unix':
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(_CONNECT_TIMEOUT_SECONDS)
+        try:
+            connection.connect(location)
+        except OSError:
+            connection.close()
+            raise
+    else:
+        connection = socket.create_connection(location, timeout=_CONNECT_TIMEOUT_SECONDS)
+        # output is streamed in small messages, which mustn't wait to be batched up
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    connection.settimeout(None)
+    return connection
+
+
+class MessageReader:
+    """Reader of messages from a connection's stream, however it's split up as it's read."""
+
+    def __init__(self):
+        """Init the state."""
+        self._buffer = bytearray()
+        self._message = None
+
+    # [ API ]
+    def feed(self, data):
+        """Feed the data read from the connection, and return the messages it completes, each with its payload."""
+        self._buffer += data
+        messages = []
+        while True:
+            if self._message is None:
+                end = self._buffer.find(b'\n')
+                if end < 0:
+                    return messages
+                self._message = json.loads(bytes(self._buffer[:end]).decode('utf-8'))
+                del self._buffer[:end + 1]
+            size = self._message.get('size', 0)
+            if len(self._buffer) < size:
+                return messages
+            messages.append((self._message, bytes(self._buffer[:size])))
+            del self._buffer[:size]
+            self._message = None
+
+
+class RemoteExecutor:
+    """
+    Remote executor plugin.
+
+    Runs the tools set to run remotely on the workers given by `workers`, handing each
+    shard to the next worker, in turn.  A tool no worker can be reached for, or whose
+    files changed after they were hashed, is run locally instead.
+    """
+
+    def __init__(self):
+        """Init the state."""
+        self._addresses = []
+        self._workers = []
+        self._tools = set()
+        self._next_worker = 0
+        self._local_processes = []
+        self._socket_dir = None
+        self._closing_at_exit = False
+
+    # [ API ]
+    def configure(self, config):
+        """Configure the tools to run on the workers, and the workers, starting any local ones, if they changed."""
+        self._tools = {t for t in config['tools'] if config[f'{t}_remote']} if config['workers'] else set()
+        if config['workers'] == self._addresses:
+            return
+        self.close()
+        self._addresses = list(config['workers'])
+        for this_address in self._addresses:
+            kind, location = parse_address(this_address)
+            if kind == 'local':
+                self._start_local_workers(location, root=pathlib.Path(config['root']))
+            else:
+                self._workers.append((kind, location))
+
+    def runs(self, tool):
+        """Return whether or not the executor runs the tool."""
+        return tool in self._tools
+
+    async def run(self, tool, *, root, shards, file_hashes, limits, on_output):
+        """
+        Run the tool's shards on the workers, against the files.
+
+        Returns each shard's result, or None, if the tool should be run locally instead.
+        Hanging up on the workers, when the run's done or cancelled, stops any shard
+        still running.
+        """
+        runs = []
+        try:
+            for this_shard in shards:
+                connection, worker = self._connect_next()
+                if connection is None:
+                    print(f"No worker could be reached to run {tool} - running it locally.")
+                    return None
+                runs.append(_ShardRun(connection, worker=worker, args=this_shard))
+            return await self._run_shards(runs, root=root, file_hashes=file_hashes, limits=limits, on_output=on_output)
+        finally:
+            for this_run in runs:
+                this_run.hang_up()
+
+    def close(self):
+        """Stop any local workers."""
+        for this_process in self._local_processes:
+            this_process.terminate()
+        for this_process in self._local_processes:
+            this_process.wait()
+        self._local_processes = []
+        self._workers = []
+        self._addresses = []
+        if self._socket_dir is not None:
+            shutil.rmtree(self._socket_dir, ignore_errors=True)
+            self._socket_dir = None
+
+    # [ Internal ]
+    def _start_local_workers(self, count, *, root):
+        """Start the local workers, each with a store of its own, so content is really shipped to each."""
+        if self._socket_dir is None:
+            # unix socket paths are limited to ~100 bytes, which a project's cache may well be deeper than
+            self._socket_dir = tempfile.mkdtemp(prefix='pocketwalk-workers-')
+        if not self._closing_at_exit:
+            atexit.register(self.close)
+            self._closing_at_exit = True
+        started = []
+        for _this_worker in range(count):
+            index = len(self._local_processes)
+            store_path = root / '.pocketwalk.cache' / 'workers' / str(index)
+            store_path.mkdir(parents=True, exist_ok=True)
+            socket_path = os.path.join(self._socket_dir, f'{index}.sock')
+            with (store_path / 'worker.log').open('ab') as log:
+                self._local_processes.append(subprocess.Popen(
+                    [
+                        sys.executable, '-m', 'pocketwalk.worker',
+                        '--listen', f'unix:{socket_path}', '--jobs', '1', '--store', str(store_path),
+                    ],
+                    stdin=subprocess.DEVNULL,
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                ))
+            started.append(socket_path)
+            self._workers.append(('unix', socket_path))
+        deadline = time.monotonic() + _LOCAL_START_SECONDS
+        while not all(os.path.exists(p) for p in started) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        print(f"Started {count} local workers.")
+
+    def _connect_next(self):
+        """Connect to the next worker which can be reached, returning the connection and the worker, or Nones."""
+        for _this_attempt in range(len(self._workers)):
+            kind, location = self._workers[self._next_worker % len(self._workers)]
+            self._next_worker += 1
+            try:
+                return connect(kind, location), _format_worker(kind, location)
+            except OSError as error:
+                print(f"Couldn't reach worker {_format_worker(kind, location)} ({error})")
+        return None, None
+
+    @staticmethod
+    async def _run_shards(runs, *, root, file_hashes, limits, on_output):
+        """Run the shards, streaming their output, until every shard has exited, or the output says to stop."""
+        for this_run in runs:
+            this_run.send({'op': 'run', 'args': this_run.args, 'files': file_hashes, 'limits': dict(limits)})
+        paths_by_hash = {h: p for p, h in file_hashes.items()}
+        running = {r.fileno(): (i, r) for i, r in enumerate(runs)}
+        while running:
+            for this_fd in await reactor.wait_readable(list(running)):
+                index, this_run = running[this_fd]
+                messages = this_run.read()
+                if messages is None:
+                    del running[this_fd]
+                    continue
+                for message, payload in messages:
+                    if message['event'] == 'need':
+                        this_run.upload(message['hashes'], root=root, paths_by_hash=paths_by_hash)
+                    elif message['event'] == 'started':
+                        this_run.started = True
+                    elif message['event'] == 'output':
+                        if not on_output(index, payload):
+                            # the shards still running are killed as they're hung up on
+                            return [r.result or {**_KILLED, 'usage': None} for r in runs]
+                    elif message['event'] == 'exit':
+                        this_run.result = {
+                            'return code': message['return code'],
+                            'timed out': message['timed out'],
+                            'usage': message['usage'],
+                            'failure reason': None,
+                        }
+                        del running[this_fd]
+        if not any(r.started for r in runs):
+            # no tool ever started, so the whole run can still be made locally
+            return None
+        return [r.result or {
+            'return code': 1,
+            'timed out': False,
+            'usage': None,
+            'failure reason': f"lost the connection to worker {r.worker}",
+        } for r in runs]
+
+
+# [ Internal ]
+_KILLED = {'return code': -signal.SIGKILL, 'timed out': False, 'failure reason': None}
+
+
+class _ShardRun:
+    """A shard's run, on a worker, over a connection."""
+
+    def __init__(self, connection, *, worker, args):
+        """Init the state."""
+        self._connection = connection
+        self._reader = MessageReader()
+        self._uploader = None
+        self.worker = worker
+        self.args = args
+        self.started = False
+        self.result = None
+
+    # [ API ]
+    def fileno(self):
+        """Get the connection's file descriptor."""
+        return self._connection.fileno()
+
+    def send(self, message):
+        """Send the message."""
+        self._connection.sendall(encode_message(message))
+
+    def read(self):
+        """Read what's waiting on the connection, and return the messages it completes, or None, once it's closed."""
+        try:
+            data = self._connection.recv(_READ_BYTES)
+        except ConnectionError:
+            data = b''
+        if not data:
+            return None
+        return self._reader.feed(data)
+
+    def upload(self, hashes, *, root, paths_by_hash):
+        """Upload the content with the hashes, on a thread of its own, so large uploads don't hold up the loop."""
+        self._uploader = threading.Thread(
+            target=_upload,
+            args=(self._connection, [h for h in hashes if h in paths_by_hash]),
+            kwargs={'root': root, 'paths_by_hash': paths_by_hash},
+            name='pocketwalk-upload',
+            daemon=True,
+        )
+        self._uploader.start()
+
+    def hang_up(self):
+        """Hang up on the worker, which stops the shard, if it's still running."""
+        try:
+            self._connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            # the worker already hung up
+            pass
+        # the uploader fails fast once the connection's shut down, and must be done with it before it's closed
+        if self._uploader is not None:
+            self._uploader.join()
+        self._connection.close()
+
+
+def _upload(connection, hashes, *, root, paths_by_hash):
+    """
+    Upload the content with the hashes to the worker.
+
+    Content is read from the working tree, and checked against its hash on the way.  A file
+    which changed after it was hashed makes the run stale, so the worker is hung up on.
+    """
+    try:
+        for this_hash in hashes:
+            content = (pathlib.Path(root) / paths_by_hash[this_hash]).read_bytes()
+            if hashlib.sha1(content).hexdigest() != this_hash:
+                connection.shutdown(socket.SHUT_RDWR)
+                return
+            connection.sendall(encode_message({'op': 'object', 'hash': this_hash}, content))
+    except OSError:
+        # the file was removed, or the connection was hung up on - either way the run's over
+        try:
+            connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def _format_worker(kind, location):
+    """Format the worker's address, for messages."""
+    if kind == 'tcp':
+        return f"{location[0]}:{location[1]}"
+    return f"unix:{location}"
+
+
+# [ Vulture ]
+assert all((
+    get_remote_executor,
+))
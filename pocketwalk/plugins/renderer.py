@@ -0,0 +1,343 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk renderer.
+
+Everything bound for the terminal - tool output and pocketwalk's own messages -
+is queued here and written by a dedicated thread, a frame at a time, so a slow
+terminal never stalls the loop which schedules the tools.  The queue is bounded:
+once it's full, live tool output is dropped, and a note of how much was dropped
+is written in its place.  Nothing is lost - every tool's full output is saved,
+and `pocketwalk show <tool>` replays it.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import errno
+import os
+import sys
+import threading
+import time
+# [ -Project ]
+from pocketwalk.plugins import output_store
+
+
+# [ Static ]
+_FRAME_SECONDS = 1 / 30
+_STATUS_SECONDS = 1
+_MAX_PENDING_BYTES = 4 * 1024 * 1024
+_CLEAR_LINE = b'\r\x1b[K'
+
+
+# [ API ]
+def format_lines(data, *, partial, prefix):
+    """
+    Format the data as whole, prefixed lines.
+
+    The partial line left over from the last data is prepended.  Returns the formatted
+    lines and the new partial line.
+    """
+    lines = (partial + data).split(b'\n')
+    return b''.join(prefix + line + b'\n' for line in lines[:-1]), lines[-1]
+
+
+def get_status(running, *, now):
+    """Get the status line for the running tools, which are {tool: start time}."""
+    if not running:
+        return b''
+    tools = ', '.join(f"{tool} {int(now - started)}s" for tool, started in sorted(running.items()))
+    return f"[pocketwalk] running: {tools}".encode('utf-8')
+
+
+class Renderer:
+    """
+    Rate-limited, non-blocking terminal renderer.
+
+    In live mode, tool output is written as it arrives.  While more than one tool is
+    running, it's written a whole line at a time, prefixed with the tool's name, so the
+    tools' outputs don't interleave mid-line.  In grouped mode, each tool's output is
+    written in one piece, once the tool finishes.  On a terminal, a status line of the
+    running tools is kept at the bottom.
+    """
+
+    def __init__(self):
+        """Init the state."""
+        self._mode = 'live'
+        self._fd = None
+        self._status_enabled = False
+        self._condition = threading.Condition()
+        self._pending = []
+        self._pending_bytes = 0
+        self._dropped = {}
+        self._partial = {}
+        self._open_line = None
+        self._running = {}
+        self._thread = None
+        self._closing = False
+        self._stdout = None
+
+    # [ API ]
+    def start(self, *, mode):
+        """Start rendering, in the given mode, taking over stdout."""
+        self._mode = mode
+        if self._thread is not None:
+            return
+        sys.stdout.flush()
+        self._stdout = sys.stdout
+        self._fd = sys.stdout.fileno()
+        self._status_enabled = os.isatty(self._fd)
+        sys.stdout = _RenderedStdout(self, stdout=self._stdout)
+        self._thread = threading.Thread(target=self._write_frames, name='pocketwalk-renderer', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Write everything still pending, stop rendering, and give stdout back."""
+        if self._thread is None:
+            return
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+        sys.stdout = self._stdout
+
+    def tool_started(self, tool):
+        """Note that the tool started."""
+        with self._condition:
+            self._running[tool] = time.monotonic()
+            self._partial[tool] = b''
+            self._condition.notify()
+
+    def tool_output(self, tool, data):
+        """Render output from the tool."""
+        if self._thread is None:
+            sys.stdout.buffer.write(data)
+            sys.stdout.flush()
+            return
+        if self._mode == 'grouped':
+            return
+        with self._condition:
+            if self._pending_bytes + len(data) > _MAX_PENDING_BYTES:
+                self._dropped[tool] = self._dropped.get(tool, 0) + len(data)
+                return
+            self._write_dropped_note(tool)
+            if len(self._running) > 1:
+                prefix = f"{tool} | ".encode('utf-8')
+                lines, self._partial[tool] = format_lines(data, partial=self._partial.get(tool, b''), prefix=prefix)
+                self._queue(tool, lines)
+            else:
+                self._queue(tool, self._partial.pop(tool, b'') + data)
+                self._partial[tool] = b''
+
+    def tool_output_file(self, tool, output_file, *, offset, count):
+        """
+        Render output from the tool which was written straight to the output file.
+
+        The output is copied from the file to the terminal by the OS, so it can't be split
+        into lines, and isn't prefixed with the tool's name.
+        """
+        if self._thread is None:
+            sys.stdout.flush()
+            _send(sys.stdout.fileno(), output_file, offset=offset, count=count)
+            return
+        if self._mode == 'grouped':
+            return
+        with self._condition:
+            self._end_open_line()
+            self._pending.append((output_file, offset, count))
+            self._condition.notify()
+
+    def close_output_file(self, output_file):
+        """Close an output file the tool's output was rendered from, once everything sent from it is written."""
+        with self._condition:
+            if self._thread is None:
+                output_file.close()
+                return
+            self._pending.append(output_file.close)
+            self._condition.notify()
+
+    def tool_finished(self, tool, *, output_path):
+        """
+        Note that the tool finished, rendering the rest of its output, or all of it, in grouped mode.
+
+        The output path is None for tools which were stopped before they finished.
+        """
+        with self._condition:
+            self._running.pop(tool, None)
+            partial = self._partial.pop(tool, b'')
+            if self._thread is None:
+                return
+            if self._mode == 'grouped':
+                self._dropped.pop(tool, None)
+                if output_path is not None:
+                    self._end_open_line()
+                    # streamed from the saved output by the writer, so it's never held in memory
+                    self._pending.append(output_path)
+            else:
+                self._write_dropped_note(tool)
+                if partial:
+                    self._queue(tool, f"{tool} | ".encode('utf-8') + partial + b'\n')
+            self._condition.notify()
+
+    def message(self, data):
+        """Render a message from pocketwalk itself.  Messages are never dropped."""
+        if self._thread is None:
+            sys.stdout.buffer.write(data)
+            sys.stdout.flush()
+            return
+        with self._condition:
+            self._queue(None, data)
+
+    def saved_output(self, output_path):
+        """Render all of the output saved to the path - streamed a frame at a time, so it's never held in memory."""
+        if self._thread is None:
+            output_store.stream_output(output_path, sys.stdout.buffer)
+            sys.stdout.flush()
+            return
+        with self._condition:
+            self._end_open_line()
+            self._pending.append(output_path)
+            self._condition.notify()
+
+    # [ Internal ]
+    def _queue(self, owner, data):
+        """Queue the data from the owner, ending any line another owner left open."""
+        if not data:
+            return
+        if self._open_line is not None and self._open_line != owner:
+            self._end_open_line()
+        self._pending.append(data)
+        self._pending_bytes += len(data)
+        self._open_line = None if data.endswith(b'\n') else owner
+        self._condition.notify()
+
+    def _end_open_line(self):
+        """End the line an owner left open."""
+        if self._open_line is not None:
+            self._pending.append(b'\n')
+            self._pending_bytes += 1
+            self._open_line = None
+
+    def _write_dropped_note(self, tool):
+        """Queue a note of how much of the tool's output was dropped, if any was."""
+        dropped = self._dropped.pop(tool, 0)
+        if dropped:
+            self._end_open_line()
+            self._queue(tool, (
+                f"{tool} | [{dropped} bytes of output not shown - run `pocketwalk show {tool}` to see them]\n"
+            ).encode('utf-8'))
+
+    def _write_frames(self):
+        """Write the pending output a frame at a time, until closed."""
+        status = b''
+        while True:
+            with self._condition:
+                while not self._pending and not self._closing:
+                    if not self._condition.wait(timeout=_STATUS_SECONDS if self._running else None):
+                        # refresh the status line's timings
+                        break
+                pending, self._pending, self._pending_bytes = self._pending, [], 0
+                new_status = get_status(self._running, now=time.monotonic()) if self._status_enabled else b''
+                closing = self._closing
+            if status:
+                self.write(_CLEAR_LINE)
+            for item in pending:
+                if isinstance(item, bytes):
+                    self.write(item)
+                elif isinstance(item, tuple):
+                    output_file, offset, count = item
+                    _send(self._fd, output_file, offset=offset, count=count)
+                elif callable(item):
+                    item()
+                else:
+                    output_store.stream_output(item, self)
+            status = b'' if closing else new_status
+            if status:
+                self.write(status)
+            if closing:
+                return
+            time.sleep(_FRAME_SECONDS)
+
+    def write(self, data):
+        """Write the data to the terminal, blocking only the writer thread."""
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(self._fd, view)
+            except BlockingIOError:
+                time.sleep(_FRAME_SECONDS)
+                continue
+            view = view[written:]
+
+
+# [ Internal ]
+def _send(out_fd, output_file, *, offset, count):
+    """Send part of the output file to the file descriptor, via sendfile, where the OS supports it."""
+    end = offset + count
+    while offset < end:
+        try:
+            sent = os.sendfile(out_fd, output_file.fileno(), offset, end - offset)
+        except BlockingIOError:
+            time.sleep(_FRAME_SECONDS)
+            continue
+        except OSError as error:
+            if error.errno not in (errno.EINVAL, errno.ENOSYS):
+                raise
+            # not every kind of file descriptor can be sent to
+            data = memoryview(os.pread(output_file.fileno(), end - offset, offset))
+            while data:
+                try:
+                    data = data[os.write(out_fd, data):]
+                except BlockingIOError:
+                    time.sleep(_FRAME_SECONDS)
+            return
+        if not sent:
+            # the file was truncated by a newer run
+            return
+        offset += sent
+
+
+class _RenderedStdout:
+    """A stand-in for stdout, which sends everything written to it through the renderer."""
+
+    def __init__(self, renderer, *, stdout):
+        """Init the state."""
+        self._renderer = renderer
+        self._stdout = stdout
+        self.buffer = _RenderedBuffer(renderer)
+        self.encoding = stdout.encoding
+
+    def write(self, text):
+        """Write the text."""
+        self._renderer.message(text.encode(self.encoding, errors='replace'))
+        return len(text)
+
+    def flush(self):
+        """Flush - the renderer flushes every frame on its own."""
+
+    def fileno(self):
+        """Get the underlying file descriptor."""
+        return self._stdout.fileno()
+
+    def isatty(self):
+        """Return whether the underlying stdout is a terminal."""
+        return self._stdout.isatty()
+
+
+class _RenderedBuffer:
+    """A stand-in for stdout's byte buffer, which sends everything written to it through the renderer."""
+
+    def __init__(self, renderer):
+        """Init the state."""
+        self._renderer = renderer
+
+    def write(self, data):
+        """Write the data."""
+        self._renderer.message(bytes(data))
+        return len(data)
+
+    def flush(self):
+        """Flush - the renderer flushes every frame on its own."""
@@ -0,0 +1,46 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""Pocketwalk reporters."""
+
+
+# [ Imports ]
+# [ -Python ]
+import json
+import pathlib
+
+
+# [ API ]
+def get_log_reporter():
+    """Get the log reporter plugin."""
+    return LogReporter()
+
+
+# [ Internal ]
+class LogReporter:
+    """
+    Log reporter.
+
+    Appends each event, as a line of JSON, to the log at `report_log`.
+    """
+
+    # [ API ]
+    @staticmethod
+    def enabled(config):
+        """Return whether or not the reporter is enabled by the config."""
+        return bool(config['report_log'])
+
+    @staticmethod
+    def report(events, *, config):
+        """Report the batch of events, oldest first."""
+        path = pathlib.Path(config['report_log'])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open('a', encoding='utf-8') as log:
+            log.write(''.join(json.dumps(e, sort_keys=True, default=str) + '\n' for e in events))
+
+
+# [ Vulture ]
+assert all((
+    get_log_reporter,
+))
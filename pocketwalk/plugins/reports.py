@@ -0,0 +1,81 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk result reports.
+
+Each tool's result is reported as a test case - passed, failed, or skipped, for
+tools whose preconditions never passed - with its run time, and the tail of its
+output for failures, in formats CI dashboards read: JUnit XML, and plain JSON.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import json
+import re
+import xml.etree.ElementTree as ElementTree
+
+
+# [ Static ]
+# control characters XML 1.0 can't hold - tools' colors are written with escapes
+_XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+# [ API ]
+def get_results(tools, *, tool_state, durations, tails):
+    """
+    Get each tool's result, for reporting.
+
+    Tools with no state never ran, and are reported as skipped.  Durations and tails
+    map the tools to their run time in seconds, and the tail of their output.
+    """
+    results = []
+    for tool in tools:
+        state = tool_state.get(tool, None)
+        if state is None:
+            status = 'skipped'
+        elif state['return code'] == 0:
+            status = 'passed'
+        else:
+            status = 'failed'
+        results.append({
+            'tool': tool,
+            'status': status,
+            'return code': None if state is None else state['return code'],
+            'failure reason': None if state is None else state['failure reason'],
+            'seconds': round(durations.get(tool, 0.0), 3),
+            'output': tails.get(tool, ''),
+        })
+    return results
+
+
+def format_json(results):
+    """Format the results as JSON."""
+    return json.dumps({'tools': results}, indent=2, sort_keys=True)
+
+
+def format_junit(results, *, name):
+    """Format the results as a JUnit XML test suite with the name."""
+    suite = ElementTree.Element('testsuite', {
+        'name': name,
+        'tests': str(len(results)),
+        'failures': str(sum(r['status'] == 'failed' for r in results)),
+        'skipped': str(sum(r['status'] == 'skipped' for r in results)),
+        'time': str(round(sum(r['seconds'] for r in results), 3)),
+    })
+    for this_result in results:
+        case = ElementTree.SubElement(suite, 'testcase', {
+            'classname': name,
+            'name': this_result['tool'],
+            'time': str(this_result['seconds']),
+        })
+        if this_result['status'] == 'skipped':
+            ElementTree.SubElement(case, 'skipped', {'message': "preconditions did not pass"})
+        elif this_result['status'] == 'failed':
+            message = f"RC {this_result['return code']}"
+            if this_result['failure reason']:
+                message += f" ({this_result['failure reason']})"
+            ElementTree.SubElement(case, 'failure', {'message': message}).text = _XML_INVALID.sub('', this_result['output'])
+    return ElementTree.tostring(suite, encoding='unicode')
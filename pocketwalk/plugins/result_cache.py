@@ -0,0 +1,312 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""Pocketwalk result cache."""
+
+
+# [ Imports ]
+# [ -Python ]
+from concurrent import futures
+import os
+import pathlib
+import shutil
+import struct
+import tempfile
+# [ -Third Party ]
+import pytoml as toml
+# [ -Project ]
+from pocketwalk import reactor
+from pocketwalk.plugger import Plugger
+from pocketwalk.plugins import output_store
+from pocketwalk.plugins.digests import get_digest
+from pocketwalk.shell import CacheBackend
+
+
+# [ Static ]
+_MEGABYTE = 1024 * 1024
+_PAYLOAD_FILES = ('result', 'output')
+_SECTION_HEADER = struct.Struct('>Q')
+_MAX_TRANSFERS = 8
+# the return codes of tools which aren't run against specific targets
+_UNTARGETED = '*'
+
+
+# [ API ]
+def get_result_cache(*, root=None):
+    """Get the result cache plugin, for the project at the root, which defaults to the current directory."""
+    return ResultCache(backends=Plugger('pocketwalk').resolve_all(CacheBackend), root=root)
+
+
+def select_evictions(entries, *, max_bytes):
+    """
+    Select the entries to evict to bring the cache under the max size.
+
+    Entries are (last-used time, size, name) tuples.  The least recently used
+    entries are evicted first.
+    """
+    total = sum(size for _used, size, _name in entries)
+    evictions = []
+    for _used, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        evictions.append(name)
+        total -= size
+    return evictions
+
+
+def pack_payload(sections):
+    """Pack the byte sections into a single payload for a shared cache."""
+    return b''.join(_SECTION_HEADER.pack(len(s)) + s for s in sections)
+
+
+def unpack_payload(payload):
+    """Unpack the byte sections from a shared cache payload, raising ValueError if it's truncated."""
+    sections = []
+    offset = 0
+    while offset < len(payload):
+        if len(payload) < offset + _SECTION_HEADER.size:
+            raise ValueError("the payload is truncated, in a section header")
+        (length,) = _SECTION_HEADER.unpack_from(payload, offset)
+        offset += _SECTION_HEADER.size
+        if len(payload) < offset + length:
+            raise ValueError("the payload is truncated, in a section")
+        sections.append(payload[offset:offset + length])
+        offset += length
+    return sections
+
+
+def parse_result(text, *, root):
+    """
+    Parse a cached result's return codes, with the targets' paths made absolute against the root.
+
+    Results are saved with paths relative to the root, so they apply to any checkout of the
+    project.  Raises ValueError if the result is malformed.
+    """
+    try:
+        return_codes = toml.loads(text)['return codes']
+    except (toml.TomlError, KeyError, TypeError) as error:
+        raise ValueError(f"the result is malformed ({error})") from error
+    if not isinstance(return_codes, dict) or not all(isinstance(r, int) for r in return_codes.values()):
+        raise ValueError("the result's return codes are malformed")
+    return {p if p == _UNTARGETED else str(pathlib.Path(root) / p): r for p, r in return_codes.items()}
+
+
+# [ Internal ]
+class ResultCache:
+    """
+    Result cache plugin for pocketwalk.
+
+    Results are content-addressed by the digest of the context they were produced
+    for, so every state which has been checked before can be replayed, no matter
+    how many other states have been checked since.  The cache is capped in size,
+    with the least recently used results evicted first.
+
+    Results missing locally are fetched from, and new results are published to, any
+    enabled shared cache backends.  Transfers run on worker threads, so they never
+    block the loop - a fetched result is picked up on the first lookup after it lands.
+    """
+
+    def __init__(self, *, backends, root=None):
+        """Init the state."""
+        self._root = pathlib.Path(root or pathlib.Path.cwd()).absolute()
+        self._backends = backends
+        self._executor = None
+        self._fetches = {}
+        # the cache's size, counted once, then kept up to date as results are added, so it's only
+        # scanned when it's over its max size
+        self._size = None
+
+    # [ API ]
+    async def get_cached_results(self, contexts_for_tools, *, config):
+        """Get the cached results for any of the tools whose contexts have been checked before."""
+        cached = {}
+        for tool, context in contexts_for_tools.items():
+            entry = self._get_results_path() / get_digest(tool, context, root=self._root)
+            if not (entry / 'result').exists() and not self._fetched(entry.name, config=config):
+                continue
+            try:
+                return_codes = parse_result((entry / 'result').read_text(), root=self._root)
+            # a result which can't be read is a miss, and is evicted, so it can be saved or fetched afresh
+            except (OSError, ValueError) as error:
+                print(f"Evicting an unreadable cached result for {tool} ({error})")
+                shutil.rmtree(entry, ignore_errors=True)
+                self._fetches.pop(entry.name, None)
+                continue
+            # mark the entry as recently used
+            os.utime(entry / 'result')
+            cached[tool] = {
+                'context': context,
+                'output': entry / 'output',
+                'return codes': return_codes,
+            }
+        return cached
+
+    async def save_result(self, tool, *, context, result, config):
+        """
+        Save the tool's result for its context.
+
+        A result with a failure reason - killed for its limits, timed out, cancelled, or lost
+        with its worker - says nothing about the context, so it isn't saved.
+        """
+        if result['failure reason']:
+            return
+        results_path = self._get_results_path()
+        results_path.mkdir(parents=True, exist_ok=True)
+        entry = results_path / get_digest(tool, context, root=self._root)
+        if entry.exists():
+            return
+        # build the entry off to the side, and move it into place in one step, so a partially
+        # written entry can never be read.
+        staging = pathlib.Path(tempfile.mkdtemp(dir=results_path, prefix='.staging-'))
+        output_store.copy_output(result['output'], staging / 'output')
+        return_codes = {_get_relative_path(p, root=self._root): r for p, r in result['return codes'].items()}
+        (staging / 'result').write_text(toml.dumps({'tool': tool, 'return codes': return_codes}))
+        try:
+            staging.rename(entry)
+        except OSError:
+            # the same result was saved concurrently
+            shutil.rmtree(staging)
+        # either way, the entry's new since the cache was counted
+        self._count(entry)
+        if self._size > config['cache_size'] * _MEGABYTE:
+            self._evict(max_bytes=config['cache_size'] * _MEGABYTE)
+        for backend in self._enabled_backends(config):
+            self._submit(self._publish, backend, entry, config=config)
+
+    # [ Internal ]
+    def _get_results_path(self):
+        """Get the path results are cached under."""
+        return self._root / '.pocketwalk.cache' / 'results'
+
+    def _enabled_backends(self, config):
+        """Get the shared cache backends enabled by the config."""
+        return [b for b in self._backends if b.enabled(config)]
+
+    def _submit(self, function, *args, **kwargs):
+        """Submit the function to run on a worker thread."""
+        if self._executor is None:
+            self._executor = futures.ThreadPoolExecutor(max_workers=_MAX_TRANSFERS, thread_name_prefix='pocketwalk-cache')
+        return self._executor.submit(function, *args, **kwargs)
+
+    def _fetched(self, digest, *, config):
+        """
+        Return whether or not the digest's result has been fetched from a shared cache.
+
+        Starts a fetch the first time a digest is asked about, and returns False until
+        that fetch has landed.
+        """
+        backends = self._enabled_backends(config)
+        if not backends:
+            return False
+        if digest not in self._fetches:
+            self._fetches[digest] = self._submit(self._fetch, backends, digest, config=config)
+            return False
+        fetch = self._fetches[digest]
+        if not fetch.done() or not fetch.result():
+            return False
+        # the result's installed, so it's found locally from now on, and counts towards the cache's size
+        del self._fetches[digest]
+        self._count(self._get_results_path() / digest)
+        return True
+
+    def _fetch(self, backends, digest, *, config):
+        """
+        Fetch the digest's result from the first backend which has a valid one, and install it locally.
+
+        Returns whether or not the result was fetched.  A corrupt payload is a miss, so it's
+        never installed, to be read on the loop.
+        """
+        for backend in backends:
+            try:
+                payload = backend.fetch(digest, config=config)
+            # purposely broad except here - a failure to fetch is just a cache miss
+            except Exception as error:  # pylint: disable=broad-except
+                print(f"Failed to fetch a cached result ({error})")
+                continue
+            if payload is None:
+                continue
+            try:
+                sections = unpack_payload(payload)
+                if len(sections) != len(_PAYLOAD_FILES):
+                    raise ValueError(f"expected {len(_PAYLOAD_FILES)} sections, but got {len(sections)}")
+                parse_result(sections[0].decode('utf-8'), root=self._root)
+            except ValueError as error:
+                print(f"Ignoring a corrupt shared result ({error})")
+                continue
+            break
+        else:
+            return False
+        results_path = self._get_results_path()
+        results_path.mkdir(parents=True, exist_ok=True)
+        staging = pathlib.Path(tempfile.mkdtemp(dir=results_path, prefix='.staging-'))
+        for name, section in zip(_PAYLOAD_FILES, sections):
+            (staging / name).write_bytes(section)
+        try:
+            staging.rename(results_path / digest)
+        except OSError:
+            shutil.rmtree(staging)
+        # wake the core, so it looks the result up again
+        reactor.notify()
+        return True
+
+    @staticmethod
+    def _publish(backend, entry, *, config):
+        """Publish the cached result in the entry to the backend."""
+        try:
+            sections = [(entry / n).read_bytes() if (entry / n).exists() else b'' for n in _PAYLOAD_FILES]
+            backend.publish(entry.name, pack_payload(sections), config=config)
+        except FileNotFoundError:
+            # the entry was evicted before it could be published
+            pass
+        # purposely broad except here - a failure to publish is not a failure of the run
+        except Exception as error:  # pylint: disable=broad-except
+            print(f"Failed to publish a cached result ({error})")
+
+    def _count(self, entry):
+        """Count the new entry in the cache's size, counting the whole cache the first time."""
+        if self._size is None:
+            self._size = sum(size for _used, size, _name in self._get_entries())
+            return
+        try:
+            self._size += sum(f.stat().st_size for f in entry.iterdir())
+        except FileNotFoundError:
+            pass
+
+    def _get_entries(self):
+        """Get the (last-used time, size, name) of every cached result."""
+        entries = []
+        for entry in self._get_results_path().iterdir():
+            if entry.name.startswith('.'):
+                continue
+            try:
+                used = (entry / 'result').stat().st_mtime
+                size = sum(f.stat().st_size for f in entry.iterdir())
+            except FileNotFoundError:
+                continue
+            entries.append((used, size, entry.name))
+        return entries
+
+    def _evict(self, *, max_bytes):
+        """Evict the least recently used results until the cache is under the max size."""
+        entries = self._get_entries()
+        evictions = set(select_evictions(entries, max_bytes=max_bytes))
+        for name in evictions:
+            shutil.rmtree(self._get_results_path() / name, ignore_errors=True)
+        self._size = sum(size for _used, size, name in entries if name not in evictions)
+
+
+def _get_relative_path(path, *, root):
+    """Get the target's path relative to the root, if it's within it, for results which apply to any checkout."""
+    if path == _UNTARGETED:
+        return path
+    try:
+        return str(pathlib.Path(path).relative_to(root))
+    except ValueError:
+        return path
+
+
+# [ Vulture ]
+assert all((
+    get_result_cache,
+))
@@ -0,0 +1,87 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk tool scheduler.
+
+Shares a fixed number of tool slots between several projects' tool runners.
+Slots are handed out fair-share: when one frees up, it goes to whichever
+project with tools waiting has the fewest tools running, so one project with a
+dozen slow tools can't starve the rest.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import collections
+import os
+# [ -Project ]
+from pocketwalk import reactor
+
+
+# [ API ]
+def select_grant(waiting, running):
+    """
+    Select the project to grant the next slot to, or None, if nothing is waiting.
+
+    Waiting maps the projects to the number of their tools waiting, and running maps
+    them to the number of their tools running.  The project with the fewest tools
+    running is granted the slot, with ties going to the project which comes first in
+    waiting.
+    """
+    candidates = [p for p, count in waiting.items() if count]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda p: (running.get(p, 0), list(waiting).index(p)))
+
+
+class Scheduler:
+    """Fair-share scheduler of tool slots between projects."""
+
+    def __init__(self, *, slots):
+        """Init the state."""
+        self.slots = slots
+        self._waiters = collections.OrderedDict()
+        self._running = collections.Counter()
+
+    # [ API ]
+    async def acquire(self, project):
+        """Wait for a slot for one of the project's tools."""
+        # each waiter has a pipe of its own, so a grant wakes exactly the waiter it's for
+        read_fd, write_fd = os.pipe()
+        self._waiters.setdefault(project, collections.deque()).append(write_fd)
+        self._grant()
+        try:
+            await reactor.wait_readable([read_fd])
+        except GeneratorExit:
+            if write_fd in self._waiters.get(project, ()):
+                self._waiters[project].remove(write_fd)
+                os.close(write_fd)
+            else:
+                # granted, but cancelled before it could run
+                self.release(project)
+            raise
+        finally:
+            os.close(read_fd)
+
+    def release(self, project):
+        """Release a slot held by one of the project's tools."""
+        self._running[project] -= 1
+        self._grant()
+
+    def get_running(self):
+        """Get the number of tools running per project."""
+        return {p: c for p, c in self._running.items() if c}
+
+    # [ Internal ]
+    def _grant(self):
+        """Grant the free slots to waiting tools."""
+        while sum(self._running.values()) < self.slots:
+            project = select_grant({p: len(w) for p, w in self._waiters.items()}, self._running)
+            if project is None:
+                return
+            write_fd = self._waiters[project].popleft()
+            self._running[project] += 1
+            os.write(write_fd, b'\0')
+            os.close(write_fd)
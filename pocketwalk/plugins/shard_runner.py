@@ -0,0 +1,98 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk shard runner.
+
+Runs a tool on an executor - on workers, say - split into shards of its targets, each
+of which is run as a process of its own.  The tool's files are shipped by their hashes,
+so the executor only needs to fetch the content it hasn't seen yet, and paths under the
+project root are passed relative to it, as the tool's run from the root of a snapshot.
+The shards' output is interleaved, a whole line at a time, into the tool's output.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import os
+import pathlib
+# [ -Project ]
+from pocketwalk.plugins import output_store
+
+
+# [ Static ]
+# a shard's line held back this long without a newline is passed on as it is, so it can't grow without bound
+_MAX_PARTIAL_BYTES = 1024 * 1024
+
+
+# [ API ]
+def split_shards(targets, *, count):
+    """
+    Split the targets into at most the count of shards, dealt out in turn, so each gets a spread of them.
+
+    There's always at least one shard, even without any targets, for tools which aren't
+    run against targets.
+    """
+    count = max(1, min(count, len(targets)))
+    return [targets[i::count] for i in range(count)]
+
+
+def get_remote_args(args, *, root):
+    """Get the args to run the tool with remotely - paths under the project root are made relative to it."""
+    remote_args = []
+    for this_arg in args:
+        path = pathlib.Path(this_arg)
+        if path.is_absolute() and (path == root or root in path.parents):
+            this_arg = os.path.relpath(path, root)
+        remote_args.append(this_arg)
+    return remote_args
+
+
+async def run(executor, tool, *, root, context, shards, output_path, renderer, label, rules=None):
+    """
+    Run the tool on the executor, with each shard's args, rendering its output under the label.
+
+    The output's passed through the output rules, if any, and saved to the output path, as
+    it streams.  Returns the size of the output, and each shard's result, or None, if the
+    executor couldn't run the tool.
+    """
+    file_hashes = {
+        os.path.relpath(p, root): h
+        for p, h in {**context['trigger files'], **context['target files']}.items()
+        if root in pathlib.Path(p).parents
+    }
+    output = output_store.OutputWriter(output_path)
+    partials = {}
+
+    def write(data, *, last=False):
+        """Pass the output through the output rules, if any, then render and save it."""
+        if rules is not None:
+            data = rules.feed(data) + (rules.flush() if last else b'')
+        if data:
+            renderer.tool_output(label, data)
+            output.write(data)
+
+    def on_output(index, data):
+        """Save and render the shard's output, and return whether to go on running."""
+        if len(shards) > 1:
+            data = partials.get(index, b'') + data
+            end = data.rfind(b'\n') + 1
+            if len(data) - end > _MAX_PARTIAL_BYTES:
+                end = len(data)
+            data, partials[index] = data[:end], data[end:]
+        write(data)
+        return rules is None or rules.failure is None
+
+    try:
+        results = await executor.run(
+            tool, root=root, shards=shards, file_hashes=file_hashes, limits=context['limits'], on_output=on_output,
+        )
+        if results is None:
+            return None
+        write(b''.join(p + b'\n' for p in partials.values() if p), last=True)
+        output.close()
+    finally:
+        # output which wasn't put in place was cut short, and is left out
+        output.discard()
+    return output.size, results
@@ -0,0 +1,150 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk snapshots.
+
+A snapshot is an immutable copy of a tool's input files, as they were hashed for
+its context, for the tool to run against instead of the live working tree.  File
+content is kept once, in a content-addressed object store, by the same hash the
+contexts use, and each snapshot is a tree of hardlinks to the objects, so making
+one costs a link per file, and a copy only of content never seen before.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import errno
+import hashlib
+import os
+import pathlib
+import shutil
+import tempfile
+
+
+# [ API ]
+class ObjectStore:
+    """Content-addressed store of file content, keyed by its sha1 hash."""
+
+    def __init__(self, path):
+        """Init the state."""
+        self._path = pathlib.Path(path)
+
+    # [ API ]
+    def add(self, path, *, file_hash):
+        """
+        Add the file's content to the store, if it isn't already, and return its object path.
+
+        Returns None if the file's content no longer has the hash - it changed after it was hashed.
+        """
+        object_path = self.get(file_hash)
+        if object_path is not None:
+            return object_path
+        with pathlib.Path(path).open('rb') as source:
+            return self._put(iter(lambda: source.read(1024 * 1024), b''), file_hash=file_hash)
+
+    def add_content(self, content, *, file_hash):
+        """
+        Add the content to the store, if it isn't already, and return its object path.
+
+        Returns None if the content doesn't have the hash.
+        """
+        object_path = self.get(file_hash)
+        if object_path is not None:
+            return object_path
+        return self._put([content], file_hash=file_hash)
+
+    def get(self, file_hash):
+        """Get the object path of the content with the hash, marking it as recently used, or None, if it isn't stored."""
+        object_path = self._get_object_path(file_hash)
+        if not object_path.exists():
+            return None
+        # marks it as recently used, for pruning
+        os.utime(object_path)
+        return object_path
+
+    def prune(self, *, max_bytes):
+        """
+        Prune the store down to the max bytes, least recently used content first.
+
+        Content linked into a snapshot is never pruned.
+        """
+        objects = [e for d in _scandir(self._path) if d.is_dir() for e in _scandir(d.path)]
+        stats = sorted(((e.stat(), e.path) for e in objects), key=lambda s: s[0].st_mtime)
+        total = sum(stat.st_size for stat, _path in stats)
+        for stat, path in stats:
+            if total <= max_bytes:
+                return
+            if stat.st_nlink == 1:
+                os.unlink(path)
+                total -= stat.st_size
+
+    # [ Internal ]
+    def _put(self, chunks, *, file_hash):
+        """Put the content, in chunks, in the store, and return its object path, or None, if it doesn't have the hash."""
+        object_path = self._get_object_path(file_hash)
+        object_path.parent.mkdir(parents=True, exist_ok=True)
+        # copied off to the side, and hashed as copied, so a file changing mid-copy can never
+        # leave content in the store under the wrong hash
+        with tempfile.NamedTemporaryFile(dir=object_path.parent, delete=False) as staging:
+            digest = hashlib.sha1()
+            for chunk in chunks:
+                digest.update(chunk)
+                staging.write(chunk)
+        if digest.hexdigest() != file_hash:
+            os.unlink(staging.name)
+            return None
+        # objects are shared by every snapshot linking them, so they must never be written to
+        os.chmod(staging.name, 0o444)
+        os.replace(staging.name, object_path)
+        return object_path
+
+    def _get_object_path(self, file_hash):
+        """Get the path the content with the hash is stored at."""
+        return self._path / file_hash[:2] / file_hash
+
+
+def build_snapshot(file_hashes, *, root, store, destination):
+    """
+    Build a snapshot of the files, mapped to their hashes, under the destination.
+
+    Files keep their paths relative to the root.  Returns whether the snapshot was
+    built - it isn't, if any file changed after it was hashed.
+    """
+    destination = pathlib.Path(destination)
+    for path, file_hash in file_hashes.items():
+        object_path = store.add(path, file_hash=file_hash)
+        if object_path is None:
+            remove_snapshot(destination)
+            return False
+        link_object(object_path, destination / pathlib.Path(path).relative_to(root))
+    return True
+
+
+def link_object(object_path, snapshot_path):
+    """Link the stored object into a snapshot at the path."""
+    snapshot_path = pathlib.Path(snapshot_path)
+    snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(object_path, snapshot_path)
+    except OSError as error:
+        if error.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        # hardlinks need the store and the snapshot on one filesystem which supports them
+        shutil.copyfile(object_path, snapshot_path)
+
+
+def remove_snapshot(destination):
+    """Remove the snapshot."""
+    shutil.rmtree(destination, ignore_errors=True)
+
+
+# [ Internal ]
+def _scandir(path):
+    """Scan the directory, if it exists."""
+    try:
+        with os.scandir(path) as entries:
+            return list(entries)
+    except FileNotFoundError:
+        return []
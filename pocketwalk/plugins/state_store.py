@@ -0,0 +1,146 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk state store.
+
+A project's tool states, and its VCS's phase, live in one store, shared by its
+core, tool runner, and VCS, and updated as each changes, rather than rebuilt
+every tick.  The aggregates the loop decides on - whether any tool is running,
+whether any has failed, and whether every configured tool has passed - are kept
+up to date alongside, so asking is O(1), and subscribers are called with each
+transition, so they can react to changes, rather than poll for them.
+"""
+
+
+# [ Static ]
+IDLE = 'idle'
+
+
+# [ API ]
+class StateStore:
+    """
+    Store of a project's tool states, and its VCS's phase.
+
+    A tool's state is its last result, if it has one, unless it's running, which
+    overrides it - stopping a tool leaves whatever result it had.
+    """
+
+    def __init__(self):
+        """Init the state."""
+        self._results = {}
+        self._running = set()
+        self._configured = frozenset()
+        self._failed = set()
+        self._unpassed = set()
+        self._vcs_phase = IDLE
+        self._subscribers = []
+        self._snapshot = None
+
+    # [ API ]
+    def subscribe(self, callback):
+        """
+        Subscribe the callback to transitions.
+
+        It's called with the key which changed - ('tool', name), or ('vcs', 'phase') -
+        and its old and new states.  A tool's state is None while it has none.
+        """
+        self._subscribers.append(callback)
+
+    def configure(self, tools):
+        """Set the tools which must all pass, for all_passed, if they changed."""
+        tools = frozenset(tools)
+        if tools == self._configured:
+            return
+        self._configured = tools
+        self._unpassed = {t for t in tools if not _passed(self._get_state(t))}
+
+    def set_running(self, tool):
+        """Set the tool as running, dropping its last result."""
+        old = self._get_state(tool)
+        self._results.pop(tool, None)
+        self._running.add(tool)
+        self._update(tool, old)
+
+    def set_stopped(self, tool):
+        """Set the tool as no longer running."""
+        old = self._get_state(tool)
+        self._running.discard(tool)
+        self._update(tool, old)
+
+    def set_result(self, tool, *, return_code, failure_reason=None):
+        """Set the tool's result."""
+        old = self._get_state(tool)
+        self._results[tool] = {'running': False, 'return code': return_code, 'failure reason': failure_reason}
+        self._update(tool, old)
+
+    def set_vcs_phase(self, phase):
+        """Set the VCS's phase - IDLE, or whatever it's busy doing."""
+        old, self._vcs_phase = self._vcs_phase, phase
+        if old != phase:
+            self._notify(('vcs', 'phase'), old, phase)
+
+    def get_tool_states(self):
+        """Get every tool's state, by tool - the same dict until the next change, so it mustn't be modified."""
+        if self._snapshot is None:
+            self._snapshot = {t: self._get_state(t) for t in {**self._results, **dict.fromkeys(self._running)}}
+        return self._snapshot
+
+    def get_return_code(self, tool):
+        """Get the tool's last return code, or None, if it has no result."""
+        result = self._results.get(tool, None)
+        return None if result is None else result['return code']
+
+    def get_vcs_phase(self):
+        """Get the VCS's phase."""
+        return self._vcs_phase
+
+    def any_running(self):
+        """Return whether any tool is running."""
+        return bool(self._running)
+
+    def any_failed(self):
+        """Return whether any tool which isn't running has a failed result."""
+        return bool(self._failed)
+
+    def all_passed(self):
+        """Return whether every configured tool has passed."""
+        return not self._unpassed
+
+    # [ Internal ]
+    def _get_state(self, tool):
+        """Get the tool's state, or None, if it has none."""
+        if tool in self._running:
+            return _RUNNING
+        return self._results.get(tool, None)
+
+    def _update(self, tool, old):
+        """Keep the aggregates up to date with the tool's new state, and notify the subscribers, if it changed."""
+        new = self._get_state(tool)
+        if new == old:
+            return
+        self._snapshot = None
+        for aggregate, is_member in (
+            (self._failed, new is not None and not new['running'] and new['return code'] != 0),
+            (self._unpassed, tool in self._configured and not _passed(new)),
+        ):
+            if is_member:
+                aggregate.add(tool)
+            else:
+                aggregate.discard(tool)
+        self._notify(('tool', tool), old, new)
+
+    def _notify(self, key, old, new):
+        """Notify the subscribers of the transition."""
+        for this_subscriber in self._subscribers:
+            this_subscriber(key, old, new)
+
+
+# [ Internal ]
+_RUNNING = {'running': True, 'return code': None, 'failure reason': None}
+
+
+def _passed(state):
+    """Return whether the state is a pass."""
+    return state is not None and state['return code'] == 0
@@ -7,91 +7,160 @@
 
 # [ Imports ]
 # [ -Python ]
+import functools
 import os
 import pathlib
-import pty
-import selectors
-import subprocess
-import sys
-from pprint import pprint
+import shlex
+import signal
+import time
 # [ -Third Party ]
 import pytoml as toml
 from runaway import signals
+# [ -Project ]
+from pocketwalk import reactor
+from pocketwalk.plugger import Plugger
+from pocketwalk.plugins import (
+    coverage_map, events, history, output_rules, output_store, persistence, pipe_runner, pty_runner, renderer, reports, scheduler,
+    shard_runner, snapshots, state_store,
+)
+from pocketwalk.plugins.digests import get_digest
+from pocketwalk.shell import Executor
+
+
+# [ Static ]
+_MEGABYTE = 1024 * 1024
+_REPLAY_TAIL_LINES = 10
+_REPORT_TAIL_LINES = 50
+_MAX_TARGET_RESULTS = 10000
+_MAX_TARGET_CONFIGS = 16
+# runs against more targets than this only record how many there were, in the history
+_MAX_HISTORY_TARGETS = 100
+_STATS_TARGETS = 10
+# only the first few args of a run are shown, so thousands of targets aren't formatted on every run
+_SHOWN_ARGS = 10
 
 
 # [ API ]
-def get_tool_runner():
-    """Get the tool runner plugin."""
-    return ToolRunner()
+def get_tool_runner(*, root=None, shared=None, state=None, label=None):
+    """
+    Get the tool runner plugin, for the project at the root, which defaults to the current directory.
+
+    The tools' states are kept in the project's state store, if it's given one.
+
+    Runners for several projects in one process are given the same shared dict, through
+    which they share a scheduler, which hands out the slots to run tools in, and a
+    renderer, in which each tool is labelled with its project's label, which defaults to its root's name.
+    """
+    return ToolRunner(root=root, shared=shared, executors=Plugger('pocketwalk').resolve_all(Executor), state=state, label=label)
+
+
+def format_args(args):
+    """Format the args to run a tool with, for the terminal, eliding all but the first few."""
+    shown = shlex.join(args[:_SHOWN_ARGS])
+    if len(args) > _SHOWN_ARGS:
+        return f"{shown} ... (+{len(args) - _SHOWN_ARGS} more)"
+    return shown
 
 
 # [ Internal ]
 class ToolRunner:
     """Tool Runner Plugin."""
 
-    def __init__(self):
+    def __init__(self, *, root=None, shared=None, executors=(), state=None, label=None):
         """Init the state."""
-        self._running_tools = {}
-        self._return_codes = {}
-        self._reported_tools = {}
+        self._root = pathlib.Path(root or pathlib.Path.cwd()).absolute()
+        self._state = state or state_store.StateStore()
+        self._executors = list(executors)
+        if shared is None:
+            self._scheduler = None
+            self._renderer = renderer.Renderer()
+        else:
+            self._scheduler = shared.setdefault('scheduler', scheduler.Scheduler(slots=os.cpu_count()))
+            self._renderer = shared.setdefault('renderer', renderer.Renderer())
+        # the rest are set from the config - only runners sharing a renderer prefix their labels
+        self._settings = {
+            'project label': label or self._root.name,
+            'label prefix': '' if shared is None else f"{label or self._root.name}/",
+            'pty': {},
+            'snapshot': {},
+            'shards': {},
+            'snapshot bytes': 0,
+        }
+        self._runs = _Runs()
 
     # [ API ]
     async def get_tool_state(self):
-        """Get the tool state."""
-        state = {}
-        for tool, return_code in self._return_codes.items():
-            state[tool] = {
-                'running': False,
-                'return code': return_code,
-            }
-        for tool in self._running_tools:
-            state[tool] = {
-                'running': True,
-                'return code': None,
-            }
-        return state
+        """Get the tool state - kept up to date in the state store, so it mustn't be modified."""
+        return self._state.get_tool_states()
 
-    def all_tools_passed(self, tools):
-        """Return whether all of the tools have passed."""
-        return all(self._return_codes.get(t, None) == 0 for t in tools)
+    def all_tools_passed(self):
+        """Return whether all of the configured tools have passed."""
+        return self._state.all_passed()
 
     def any_tools_not_done(self):
-        """Return whether any of the tools are not done."""
-        return bool(self._running_tools)
+        """
+        Return whether any of the tools are not done.
+
+        Tools replayed since the last check count as not done, so that the tools
+        depending on them get a chance to run.
+        """
+        return bool(self._runs.running or self._runs.replayed)
 
     async def return_codes(self, tools):
         """Return the return codes."""
-        return [self._return_codes[t] for t in tools if t in self._return_codes]
+        return_codes = [self._state.get_return_code(t) for t in tools]
+        return [r for r in return_codes if r is not None]
+
+    async def configure_output(self, config):
+        """Configure how tool output is captured and rendered, and how many tools may run at once."""
+        self._settings.update({
+            'pty': {tool: config[f'{tool}_pty'] for tool in config['tools']},
+            'snapshot': {tool: config[f'{tool}_snapshot'] for tool in config['tools']},
+            'shards': {tool: config[f'{tool}_shards'] for tool in config['tools']},
+            'snapshot bytes': config['cache_size'] * _MEGABYTE,
+        })
+        self._state.configure(config['tools'])
+        events.get_events().configure(config)
+        for this_executor in self._executors:
+            this_executor.configure(config)
+        if config['jobs']:
+            if self._scheduler is None:
+                self._scheduler = scheduler.Scheduler(slots=config['jobs'])
+            self._scheduler.slots = config['jobs']
+        self._renderer.start(mode=config['output'])
 
     async def ensure_tools_running(self, contexts_for_tools, *, on_completion):
         """
         Ensure the tools are running with their current contexts.
 
-        Calls the on_completion function with the tool and RC on completion of each tool.
-        Runs the tools concurrently.
+        Calls the on_completion function with the tool, its context, and its result on
+        completion of each tool, and with stale=True for a stale snapshot run, whose result
+        is only valid for its own context.  Runs the tools concurrently.
         """
         tools = contexts_for_tools.keys()
 
-        tools_to_start = [t for t in tools if t not in self._running_tools]
+        tools_to_start = [t for t in tools if t not in self._runs.running]
 
         if tools_to_start:
             print(f"Starting tools: {tools_to_start}")
 
         for this_tool in tools_to_start:
-            if this_tool in self._return_codes:
-                del self._return_codes[this_tool]
-            self._running_tools[this_tool] = {
+            self._state.set_running(this_tool)
+            run = self._runs.next_run()
+            self._runs.running[this_tool] = {
                 'context': contexts_for_tools[this_tool],
+                'run': run,
                 'process future': await signals.future(
                     self._run_tool,
                     this_tool,
                     context=contexts_for_tools[this_tool],
                     on_completion=on_completion,
+                    run=run,
                 ),
             }
 
-        for state in self._running_tools.values():
-            exc_info = state['process future'].exception
+        for future in [s['process future'] for s in self._runs.running.values()] + list(self._runs.stale.values()):
+            exc_info = future.exception
             if exc_info:
                 raise exc_info[1].with_traceback(exc_info[2])
 
@@ -99,7 +168,7 @@ class ToolRunner:
         """Get the tools which are failing their preconditions."""
         failing = {}
         for tool, current_context in contexts['current_state'].items():
-            if not all(self._return_codes.get(t, None) == 0 for t in current_context['preconditions']):
+            if not all(self._state.get_return_code(t) == 0 for t in current_context['preconditions']):
                 failing[tool] = current_context
             if any(t in current_context['preconditions'] for t in tools_to_run):
                 failing[tool] = current_context
@@ -109,10 +178,7 @@ class ToolRunner:
         """Filter out any previously reported tools."""
         unreported_tools = {}
         for tool, context in tools_with_contexts.items():
-            reported_context = self._reported_tools.get(tool, None)
-            context = context.copy()
-            if 'affected files' in context:
-                del context['affected files']
+            reported_context = self._runs.reported.get(tool, None)
             if reported_context != context:
                 unreported_tools[tool] = context
         return unreported_tools
@@ -120,17 +186,24 @@ class ToolRunner:
     async def cleanup(self):
         """Ensure the tools are stopped."""
         print("Cleaning up tools...")
-        tools_to_stop = list(self._running_tools.keys())
+        tools_to_stop = list(self._runs.running.keys())
 
         for this_tool in tools_to_stop:
-            await signals.cancel(self._running_tools[this_tool]['process future'])
-            del self._running_tools[this_tool]
-            self._return_codes[this_tool] = 130
+            await signals.cancel(self._runs.running[this_tool]['process future'])
+            del self._runs.running[this_tool]
+            self._state.set_result(this_tool, return_code=130, failure_reason="cancelled")
+            self._state.set_stopped(this_tool)
+            events.emit(self._root, {'event': 'tool stopped', 'tool': this_tool, 'reason': "cancelled"})
+        for this_run in list(self._runs.stale):
+            await signals.cancel(self._runs.stale.pop(this_run))
 
         if tools_to_stop:
             print(f"Cancelled running tools: {tools_to_stop}")
 
+        for this_executor in self._executors:
+            this_executor.close()
         print("Done.")
+        self._renderer.close()
 
     async def ensure_stale_tools_stopped(self, contexts_for_tools):
         """
@@ -140,183 +213,704 @@ class ToolRunner:
         """
         tools = contexts_for_tools.keys()
 
-        tools_to_stop = [t for t in tools if t in self._running_tools and (
-            self._running_tools[t]['context'] != contexts_for_tools[t]
+        tools_to_stop = [t for t in tools if t in self._runs.running and (
+            self._runs.running[t]['context'] != contexts_for_tools[t]
         )]
+        # runs against snapshots aren't affected by the changes - they finish, into the result cache
+        tools_to_finish = [t for t in tools_to_stop if self._runs.running[t]['run'] in self._runs.snapshots]
 
         for this_tool in tools_to_stop:
-            await signals.cancel(self._running_tools[this_tool]['process future'])
-            del self._running_tools[this_tool]
-
-        if tools_to_stop:
-            print(f"Stopped stale tools: {tools_to_stop}")
+            if this_tool in tools_to_finish:
+                self._runs.stale[self._runs.running[this_tool]['run']] = self._runs.running[this_tool]['process future']
+            else:
+                # so the run's recorded as stopped as stale, rather than cancelled
+                self._runs.running[this_tool]['stopping as stale'] = True
+                await signals.cancel(self._runs.running[this_tool]['process future'])
+                events.emit(self._root, {'event': 'tool stopped', 'tool': this_tool, 'reason': "stale"})
+            del self._runs.running[this_tool]
+            self._state.set_stopped(this_tool)
+
+        if tools_to_finish:
+            print(f"Letting stale tools finish against their snapshots: {tools_to_finish}")
+        if len(tools_to_finish) < len(tools_to_stop):
+            print(f"Stopped stale tools: {[t for t in tools_to_stop if t not in tools_to_finish]}")
 
     async def ensure_tools_stopped(self, contexts_for_tools, *, reason):
         """Ensure the tools are stopped."""
-        tools_to_stop = [t for t in self._running_tools if t in contexts_for_tools]
+        tools_to_stop = [t for t in self._runs.running if t in contexts_for_tools]
 
         for this_tool in tools_to_stop:
-            await signals.cancel(self._running_tools[this_tool]['process future'])
-            del self._running_tools[this_tool]
+            await signals.cancel(self._runs.running[this_tool]['process future'])
+            del self._runs.running[this_tool]
+            self._state.set_stopped(this_tool)
+            events.emit(self._root, {'event': 'tool stopped', 'tool': this_tool, 'reason': reason})
 
         if tools_to_stop:
             print(f"Stopped tools with {reason}: {tools_to_stop}")
 
     async def ensure_removed_tools_stopped(self, config):
         """Ensure tools not in the tools list are stopped."""
-        tools_to_stop = [t for t in self._running_tools if t not in config['tools']]
+        tools_to_stop = [t for t in self._runs.running if t not in config['tools']]
 
         for this_tool in tools_to_stop:
-            await signals.cancel(self._running_tools[this_tool]['process future'])
-            del self._running_tools[this_tool]
+            await signals.cancel(self._runs.running[this_tool]['process future'])
+            del self._runs.running[this_tool]
+            self._state.set_stopped(this_tool)
+            events.emit(self._root, {'event': 'tool stopped', 'tool': this_tool, 'reason': "removed"})
 
         if tools_to_stop:
             print(f"Stopped removed tools: {tools_to_stop}")
 
     async def replay_previous_results_for(self, tools):
-        """Replay the previous results for the given tools."""
-        previous_results = {t: {
-            'output': (
-                pathlib.Path.cwd() / '.pocketwalk.cache' / t
-            ).with_suffix('.output').read_bytes(),
-            'return code': max(toml.loads((
-                pathlib.Path.cwd() / '.pocketwalk.cache' / t
-            ).with_suffix('.return_codes').read_text()).values()),
-        } for t in tools.keys()}
+        """
+        Replay the previous results for the given tools.
+
+        Only a summary and the tail of the previous output are replayed - the full
+        output is available via `pocketwalk show <tool>`.
+        """
         return_codes = []
-        for this_tool, results in previous_results.items():
-            print(f"{this_tool} is unchanged.  Last output:")
-            print(results['output'].decode('utf-8'))
-            self._report_tool_result(this_tool, return_code=results['return code'])
-            return_codes.append(results['return code'])
-            self._return_codes[this_tool] = results['return code']
+        self._runs.replayed = set(tools)
+        for this_tool in tools.keys():
+            return_code = max(toml.loads(persistence.get_writer().read_text(self._get_rcs_path(this_tool))).values(), default=0)
+            print(f"{self._get_label(this_tool)} is unchanged.")
+            self._replay_output(this_tool, self._get_output_path(this_tool))
+            self._report_tool_result(this_tool, return_code=return_code)
+            events.emit(
+                self._root, {'event': 'tool replayed', 'tool': this_tool, 'reason': "unchanged", 'return code': return_code},
+            )
+            return_codes.append(return_code)
+            self._state.set_result(this_tool, return_code=return_code)
         for this_tool, context in tools.items():
-            context = context.copy()
-            if 'affected files' in context:
-                del context['affected files']
-            self._reported_tools[this_tool] = context
+            self._runs.reported[this_tool] = context
+        if tools:
+            # wake the core, so the tools depending on them get a chance to run
+            reactor.notify()
         return return_codes
 
+    async def replay_cached_results(self, cached_results, *, on_completion):
+        """
+        Replay cached results for the given tools, as if they had just been run.
+
+        Calls the on_completion function with the tool and its context for each tool.
+        """
+        self._runs.replayed |= set(cached_results)
+        for this_tool, cached in cached_results.items():
+            output_store.copy_output(cached['output'], self._get_output_path(this_tool))
+            persistence.get_writer().replace(self._get_rcs_path(this_tool), functools.partial(toml.dumps, cached['return codes']))
+            return_code = max(cached['return codes'].values(), default=0)
+            print(f"{self._get_label(this_tool)} has been run against this state before.")
+            self._replay_output(this_tool, cached['output'])
+            self._report_tool_result(this_tool, return_code=return_code)
+            events.emit(self._root, {'event': 'tool replayed', 'tool': this_tool, 'reason': "cached", 'return code': return_code})
+            self._state.set_result(this_tool, return_code=return_code)
+            self._runs.reported[this_tool] = cached['context']
+            await on_completion(this_tool, context=cached['context'])
+        if cached_results:
+            # wake the core, so the tools depending on them get a chance to run
+            reactor.notify()
+
+    async def write_reports(self, config):
+        """Write each tool's result to the report paths in the config, if any."""
+        paths = {f: config[f'report_{f}'] for f in ('junit', 'json') if config[f'report_{f}']}
+        if not paths:
+            return
+        tails = {}
+        for this_tool in config['tools']:
+            output_path = self._get_output_path(this_tool)
+            if output_store.output_exists(output_path):
+                tail = output_store.read_tail(output_path, lines=_REPORT_TAIL_LINES)
+                tails[this_tool] = tail.decode('utf-8', errors='replace')
+        results = reports.get_results(
+            config['tools'],
+            tool_state=await self.get_tool_state(),
+            durations=self._runs.durations,
+            tails=tails,
+        )
+        for report_format, path in paths.items():
+            pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+            if report_format == 'junit':
+                pathlib.Path(path).write_text(reports.format_junit(results, name=self._settings['project label']), encoding='utf-8')
+            else:
+                pathlib.Path(path).write_text(reports.format_json(results), encoding='utf-8')
+            print(f"Wrote the {report_format} report to {path}.")
+
+    async def show_stats(self, tools):
+        """Show the stats of the recorded runs of the tools, or of every tool, if none are given."""
+        runs = self._get_history().load()
+        if tools:
+            runs = [r for r in runs if r['tool'] in tools]
+        print(history.format_stats(runs, count=_STATS_TARGETS))
+        return 0
+
+    async def show_output(self, tool):
+        """Stream the full output from the tool's last run to stdout."""
+        output_path = self._get_output_path(tool)
+        if not output_store.output_exists(output_path):
+            print(f"No saved output for {tool}.")
+            return 1
+        self._renderer.saved_output(output_path)
+        return 0
+
     # [ Internal ]
-    @staticmethod
-    def _report_tool_result(tool, *, return_code):
+    def _get_output_path(self, tool):
+        """Get the path the tool's output is saved to."""
+        return (self._root / '.pocketwalk.cache' / tool).with_suffix('.output')
+
+    def _get_history(self):
+        """Get the history of tool runs."""
+        return history.History(self._root / '.pocketwalk.cache' / 'history.jsonl')
+
+    def _record_run(self, tool, *, targets, seconds, outcome, ran=None):
+        """Record a run of the tool's process in the history, with how it ran, if it ran to the end - its CPU time, say."""
+        ran = ran or {}
+        self._get_history().record({
+            'tool': tool,
+            'started': time.time() - seconds,
+            'seconds': round(seconds, 3),
+            **(ran.get('usage', None) or history.get_usage(None)),
+            'output bytes': ran.get('output bytes', None),
+            'targets': len(targets),
+            'target paths': [self._get_relative_target(t) for t in targets] if len(targets) <= _MAX_HISTORY_TARGETS else [],
+            'outcome': outcome,
+            'return code': ran.get('return code', None),
+        })
+
+    def _get_relative_target(self, target):
+        """Get the target relative to the project root - targets may also be test IDs."""
+        if pathlib.Path(target).is_absolute():
+            return os.path.relpath(target, self._root)
+        return target
+
+    def _get_rcs_path(self, tool):
+        """Get the path the tool's per-target RC's are saved to."""
+        return (self._root / '.pocketwalk.cache' / tool).with_suffix('.return_codes')
+
+    def _get_label(self, tool):
+        """Get the tool's label, in rendered output."""
+        return self._settings['label prefix'] + tool
+
+    def _replay_output(self, tool, output_path):
+        """Replay a summary and the tail of the output saved to the path."""
+        summary = output_store.load_summary(output_path)
+        print(f"Last output ({summary['lines']} lines, {summary['size']} bytes) ended with:")
+        tail = output_store.read_tail(output_path, lines=_REPLAY_TAIL_LINES)
+        self._renderer.message(tail if tail.endswith(b'\n') or not tail else tail + b'\n')
+        if _REPLAY_TAIL_LINES < summary['lines']:
+            print(f"(run `pocketwalk show {tool}` for the full output)")
+
+    def _report_tool_result(self, tool, *, return_code, failure_reason=None):
         """Report the tool's result."""
-        if return_code != 0:
-            print(f"{tool} failed with RC {return_code}")
+        label = self._get_label(tool)
+        if failure_reason:
+            print(f"{label} failed with RC {return_code} ({failure_reason})")
+        elif return_code != 0:
+            print(f"{label} failed with RC {return_code}")
+        else:
+            print(f"{label} passed")
+
+    @staticmethod
+    def _normalize_return_code(return_code, *, timed_out):
+        """
+        Normalize the return code.
+
+        Timeouts and deaths-by-signal are mapped to the shell's RC conventions, so that
+        they count as failures when the max RC is taken.
+        """
+        if timed_out:
+            return 124
+        if return_code < 0:
+            return 128 - return_code
+        return return_code
+
+    @staticmethod
+    def _get_failure_reason(return_code, *, limits, timed_out, usage=None):
+        """
+        Get the reason a tool failed, if it failed due to a resource limit or a signal.
+
+        A SIGKILL is only put down to the CPU time limit if the tool's usage shows it reached
+        the limit - it may as well have come from the OOM killer, or the user.
+        """
+        if timed_out:
+            return f"timed out after {limits['timeout']}s"
+        if return_code <= 128:
+            return None
+        signum = return_code - 128
+        if 'max cpu time' in limits and (
+                signum == signal.SIGXCPU or (signum == signal.SIGKILL and _get_cpu_seconds(usage) >= limits['max cpu time'])
+        ):
+            return f"exceeded the CPU time limit of {limits['max cpu time']}s"
+        try:
+            name = signal.Signals(signum).name
+        except ValueError:
+            return None
+        if 'max memory' in limits:
+            return f"killed by {name}, with a memory limit of {limits['max memory']} MB"
+        return f"killed by {name}"
+
+    async def _run_tool(self, tool, *, context, on_completion, run):
+        """
+        Run a single tool.
+
+        A tool set to use snapshots runs against a snapshot of its files, in which case it's
+        labelled and saves its output by run, so a stale run can finish alongside the fresh one.
+        """
+        started = time.monotonic()
+        # coverage data is recorded against the working tree's paths, so coverage runs never use snapshots
+        snapshot_path = None
+        if self._settings['snapshot'].get(tool, False) and context['affected by'] != 'coverage':
+            snapshot_path = self._build_snapshot(tool, context=context, run=run)
+        label = self._get_label(tool) if snapshot_path is None else f"{self._get_label(tool)}@{run}"
+        output_path = self._get_output_path(tool) if snapshot_path is None else self._get_run_output_path(tool, run=run)
+        try:
+            if context['affected by'] == 'coverage':
+                return_code, failure_reason, return_codes = await self._run_covered_tests(
+                    tool, context=context, label=label, output_path=output_path, run=run,
+                )
+            else:
+                return_code, failure_reason, return_codes = await self._run_targets(
+                    tool, context=context, label=label, output_path=output_path, run=run, snapshot_path=snapshot_path,
+                )
+            self._renderer.tool_finished(label, output_path=output_path)
+            if run in self._runs.stale:
+                await self._finish_stale_run(tool, context=context, label=label, run=run, on_completion=on_completion, result={
+                    'output': output_path,
+                    'return codes': return_codes,
+                    'failure reason': failure_reason,
+                })
+                return
+            if output_path != self._get_output_path(tool):
+                output_store.move_output(output_path, self._get_output_path(tool))
+        finally:
+            if snapshot_path is not None:
+                snapshots.remove_snapshot(snapshot_path)
+                output_store.remove_output(output_path)
+                self._runs.snapshots.discard(run)
+                self._get_object_store().prune(max_bytes=self._settings['snapshot bytes'])
+        self._report_tool_result(tool, return_code=return_code, failure_reason=failure_reason)
+        events.emit(self._root, {
+            'event': 'tool finished',
+            'tool': tool,
+            'run': run,
+            'return code': return_code,
+            'failure reason': failure_reason,
+            'seconds': round(time.monotonic() - started, 3),
+            'stale': False,
+        })
+        persistence.get_writer().replace(self._get_rcs_path(tool), functools.partial(toml.dumps, return_codes))
+        await on_completion(tool, context=context, result={
+            'output': self._get_output_path(tool),
+            'return codes': return_codes,
+            'failure reason': failure_reason,
+        })
+        self._state.set_result(tool, return_code=return_code, failure_reason=failure_reason)
+        self._runs.durations[tool] = time.monotonic() - started
+        self._runs.reported[tool] = context
+        del self._runs.running[tool]
+        self._state.set_stopped(tool)
+        if not self._runs.running:
+            print("No tools running.")
+        # wake the core, so it can react to the result
+        reactor.notify()
+
+    async def _run_covered_tests(self, tool, *, context, label, output_path, run):
+        """
+        Run the tests which executed the lines changed since the tool's coverage was recorded, and record their coverage.
+
+        Returns the RC, the reason for any failure due to a limit or signal, and the RC's
+        for the context's targets.
+        """
+        selected_tests = self._select_covered_tests(tool, context=context)
+        targets = sorted(context['target files']) if selected_tests is None else selected_tests
+        if '{affected_targets}' in context['config'] and not targets:
+            self._skip_run(output_path, notice=b"No test executed any of the changed lines.\n")
+            return 0, None, {'*': 0}
+        # so coverage data left by an earlier run can never be mistaken for this run's
+        (self._root / context['coverage']['data']).unlink(missing_ok=True)
+        return_code, failure_reason = await self._run_tool_process(
+            tool, context=context, targets=targets, label=label, output_path=output_path, run=run,
+        )
+        data_path = self._root / context['coverage']['data']
+        recorded = self._get_coverage_map(tool).record(
+            data_path,
+            source_hashes={**context['trigger files'], **context['target files']},
+            root=self._root,
+            full_run=selected_tests is None,
+            selected=selected_tests or [],
+            return_code=return_code,
+        )
+        if not recorded:
+            self._renderer.message(
+                f"No coverage data found at {data_path}.  Is the tool run with `--cov-context=test`?\n".encode('utf-8'),
+            )
+        return return_code, failure_reason, {'*': return_code}
+
+    async def _run_targets(self, tool, *, context, label, output_path, run, snapshot_path):
+        """
+        Run the tool against the targets which haven't passed as they are, under its current config, and record their RC's.
+
+        Returns the RC, the reason for any failure due to a limit or signal, and the RC's
+        for the context's targets.
+        """
+        config_digest = get_digest(tool, context, root=self._root, exclude=('target files',))
+        target_results = await self._load_target_results(tool)
+        # re-insert the current config's results, so they're the last to be dropped
+        checked = target_results.pop(config_digest, {})
+        target_results[config_digest] = checked
+        targets = self._get_targets(context=context, checked=checked)
+        if '{affected_targets}' in context['config'] and not targets:
+            self._skip_run(output_path, notice=b"Every target has been checked, as-is, before, and passed.\n")
+            return 0, None, self._get_rcs(context=context, checked=checked, return_code=0)
+        return_code, failure_reason = await self._run_tool_process(
+            tool, context=context, targets=targets, label=label, output_path=output_path, run=run, snapshot_path=snapshot_path,
+        )
+        target_results[config_digest] = self._record_target_results(
+            checked,
+            [context['target files'][t] for t in targets],
+            return_code=return_code,
+        )
+        await self._save_target_results(tool, target_results)
+        return_codes = self._get_rcs(context=context, checked=target_results[config_digest], return_code=return_code)
+        return return_code, failure_reason, return_codes
+
+    def _skip_run(self, output_path, *, notice):
+        """Skip running the tool, showing the notice, and saving it as the tool's output."""
+        self._renderer.message(notice)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_store.save_output(output_path, notice)
+
+    def _build_snapshot(self, tool, *, context, run):
+        """
+        Build a snapshot of the tool's files for the run, and return its path.
+
+        Returns None if a file changed after it was hashed - the run's context is already
+        stale, so it runs against the working tree, and is stopped as stale, as usual.
+        """
+        cache_path = self._root / '.pocketwalk.cache'
+        snapshot_path = cache_path / 'snapshots' / f'{tool}.{run}'
+        snapshots.remove_snapshot(snapshot_path)
+        built = snapshots.build_snapshot(
+            {**context['trigger files'], **context['target files']},
+            root=self._root,
+            store=self._get_object_store(),
+            destination=snapshot_path,
+        )
+        if not built:
+            return None
+        self._runs.snapshots.add(run)
+        return snapshot_path
+
+    def _get_object_store(self):
+        """Get the store of the content snapshots are linked from."""
+        return snapshots.ObjectStore(self._root / '.pocketwalk.cache' / 'objects')
+
+    def _get_run_output_path(self, tool, *, run):
+        """Get the path the run's output is saved to, until it's known to be current."""
+        return (self._root / '.pocketwalk.cache' / tool).with_suffix(f'.{run}.output')
+
+    async def _finish_stale_run(self, tool, *, context, label, run, result, on_completion):
+        """Finish a stale snapshot run, passing its result on only for its own context."""
+        del self._runs.stale[run]
+        print(f"{label} finished against a stale snapshot - its result is cached for that snapshot.")
+        events.emit(self._root, {
+            'event': 'tool finished',
+            'tool': tool,
+            'run': run,
+            'return code': max(result['return codes'].values(), default=0),
+            'failure reason': result['failure reason'],
+            'stale': True,
+        })
+        await on_completion(tool, context=context, result=result, stale=True)
+
+    async def _run_tool_process(self, tool, *, context, targets, label, output_path, run, snapshot_path=None):
+        """
+        Run the tool's process against the targets, and record the run in the history.
+
+        The tool is run by the executor which runs it, if any, and otherwise locally, in the
+        snapshot, if given.  The output is saved to the output path as it streams.  Returns the
+        normalized RC, and the reason for any failure due to a limit or signal.
+        """
+        rules = self._get_output_rules(context)
+        executor = self._get_executor(tool, context=context)
+        # remote runs don't take a local slot, unless they fall back to running locally
+        acquired = executor is None and self._scheduler is not None
+        if acquired:
+            await self._scheduler.acquire(self._root)
+        started = time.monotonic()
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            ran = None
+            if executor is not None:
+                ran = await self._run_remote(
+                    executor, tool, context=context, targets=targets, label=label, output_path=output_path, rules=rules, run=run,
+                )
+            if ran is None:
+                if not acquired and self._scheduler is not None:
+                    await self._scheduler.acquire(self._root)
+                    acquired = True
+                ran = await self._run_local(
+                    tool, context=context, targets=targets, label=label, output_path=output_path, rules=rules, run=run,
+                    snapshot_path=snapshot_path,
+                )
+        except GeneratorExit:
+            self._renderer.tool_finished(label, output_path=None)
+            self._record_run(
+                tool, targets=targets, seconds=time.monotonic() - started,
+                outcome='stale' if self._runs.is_stopping_as_stale(tool, run=run) else 'cancelled',
+            )
+            raise
+        finally:
+            if acquired:
+                self._scheduler.release(self._root)
+        if rules is not None:
+            ran['return code'], ran['failure reason'] = self._apply_output_rules(
+                rules,
+                return_code=ran['return code'],
+                failure_reason=ran['failure reason'],
+                pass_when_filtered=context['output rules'].get('pass when filtered', False),
+            )
+        if ran['timed out']:
+            outcome = 'timed out'
         else:
-            print(f"{tool} passed")
+            outcome = 'passed' if ran['return code'] == 0 else 'failed'
+        self._record_run(tool, targets=targets, seconds=time.monotonic() - started, outcome=outcome, ran=ran)
+        return ran['return code'], ran['failure reason']
+
+    async def _run_local(self, tool, *, context, targets, label, output_path, rules, run, snapshot_path):
+        """
+        Run the tool's process locally, against the targets, in the snapshot, if given.
+
+        Returns how it ran - the size of its output, its normalized RC, whether or not it timed
+        out, its usage, and the reason for any failure due to a limit or signal.
+        """
+        if snapshot_path is not None:
+            targets = [str(snapshot_path / pathlib.Path(t).relative_to(self._root)) for t in targets]
+        args = self._get_args(tool, context=context, targets=targets)
+        print(f"Running {format_args(args)}")
+        events.emit(self._root, {'event': 'tool started', 'tool': tool, 'run': run, 'args': args, 'executor': None})
+        self._renderer.tool_started(label)
+        output_bytes, process, timed_out, usage = await (pty_runner if self._settings['pty'].get(tool, True) else pipe_runner).run(
+            args,
+            limits=context['limits'],
+            cwd=self._root if snapshot_path is None else snapshot_path,
+            output_path=output_path,
+            renderer=self._renderer,
+            label=label,
+            rules=rules,
+        )
+        ran = {
+            'output bytes': output_bytes,
+            'return code': self._normalize_return_code(process.returncode, timed_out=timed_out),
+            'timed out': timed_out,
+            'usage': usage,
+        }
+        ran['failure reason'] = self._get_failure_reason(
+            ran['return code'], limits=context['limits'], timed_out=timed_out, usage=ran['usage'],
+        )
+        return ran
+
+    async def _run_remote(self, executor, tool, *, context, targets, label, output_path, rules, run):
+        """
+        Run the tool on the executor, against the targets, split into the tool's shards.
+
+        Returns as for a local run, or None, if the executor couldn't run the tool.
+        """
+        shards = [
+            shard_runner.get_remote_args(self._get_args(tool, context=context, targets=s), root=self._root)
+            for s in shard_runner.split_shards(targets, count=self._settings['shards'].get(tool, 1))
+        ]
+        for this_shard in shards:
+            print(f"Running {format_args(this_shard)}")
+        self._renderer.tool_started(label)
+        events.emit(self._root, {
+            'event': 'tool started', 'tool': tool, 'run': run, 'shards': shards, 'executor': type(executor).__name__,
+        })
+        ran = await shard_runner.run(
+            executor,
+            tool,
+            root=self._root,
+            context=context,
+            shards=shards,
+            output_path=output_path,
+            renderer=self._renderer,
+            label=label,
+            rules=rules,
+        )
+        if ran is None:
+            return None
+        return self._get_shards_outcome(*ran, limits=context['limits'])
+
+    @classmethod
+    def _get_shards_outcome(cls, output_bytes, results, *, limits):
+        """Get how a run split into shards ran, as for a local run, from the size of its output, and each shard's result."""
+        return_codes = [cls._normalize_return_code(r['return code'], timed_out=r['timed out']) for r in results]
+        # the limits apply to each shard's process, so each shard's failure is put down to its own usage
+        failure_reason = next((r['failure reason'] for r in results if r['failure reason']), None) or next(filter(None, (
+            cls._get_failure_reason(c, limits=limits, timed_out=r['timed out'], usage=r['usage'])
+            for c, r in zip(return_codes, results)
+        )), None)
+        return {
+            'output bytes': output_bytes,
+            'return code': max(return_codes),
+            'timed out': any(r['timed out'] for r in results),
+            'usage': history.combine_usage([r['usage'] for r in results]),
+            'failure reason': failure_reason,
+        }
+
+    def _get_executor(self, tool, *, context):
+        """Get the executor which runs the tool, if any - coverage data is recorded locally, so coverage runs are always local."""
+        if context['affected by'] == 'coverage':
+            return None
+        return next((e for e in self._executors if e.runs(tool)), None)
 
     @staticmethod
-    def _process_output(stdout):
-        """Process the output."""
-        line = os.read(stdout, 1024)
-        if line:
-            sys.stdout.buffer.write(line)
-            sys.stdout.flush()
-
-        return line
-
-    async def _run_tool(self, tool, *, context, on_completion):
-        """Run a single tool."""
-        if tool in self._return_codes:
-            del self._return_codes[tool]
-        previous_rcs = await self._load_rcs(tool, context=context)
-        targets_used = self._get_targets(previous_rcs=previous_rcs, context=context)
+    def _get_args(tool, *, context, targets):
+        """Get the args to run the tool with, against the targets."""
         substituted = []
-        # add previously failing targets that are still valid targets to the list to run
         for this_arg in context['config']:
             if this_arg == '{affected_targets}':
-                substituted += targets_used
+                substituted += targets
             else:
                 substituted.append(this_arg)
-        args = [tool] + substituted
-        if not targets_used:
-            targets_used = ["*"]
-        pprint(args)
-        output, process = await self._run_pty(args)
-
-        self._report_tool_result(tool, return_code=process.returncode)
-        await on_completion(tool, context=context)
-        (pathlib.Path.cwd() / '.pocketwalk.cache' / tool).with_suffix('.output').write_bytes(output)
-        await self._save_rcs(tool, targets_used=targets_used, return_code=process.returncode, previous_rcs=previous_rcs)
-        self._return_codes[tool] = process.returncode
-        context = context.copy()
-        if 'affected files' in context:
-            del context['affected files']
-        self._reported_tools[tool] = context
-        del self._running_tools[tool]
-        if not self._running_tools:
-            print("No tools running.")
+        return [tool] + substituted
+
+    @staticmethod
+    def _get_output_rules(context):
+        """Get the output rules for the context, or None, if it has none."""
+        if not context['output rules']:
+            return None
+        return output_rules.OutputRules(
+            fail_on=context['output rules'].get('fail on', []),
+            filter_out=context['output rules'].get('filter out', []),
+        )
+
+    @staticmethod
+    def _apply_output_rules(rules, *, return_code, failure_reason, pass_when_filtered):
+        """
+        Apply the outcome of the output rules to the RC and the failure reason, and return them.
 
-    async def _load_rcs(self, tool, *, context):
-        """Load saved RC's."""
-        rc_path = (pathlib.Path.cwd() / '.pocketwalk.cache' / tool).with_suffix('.return_codes')
-        # TOML parsing
+        A tool whose output matched a fail-on pattern fails, with RC 1.  A tool which failed
+        of its own accord, but whose output was all filtered out, passes, if set to.
+        """
+        if rules.failure is not None:
+            return 1, f"output matched a fail-on pattern: {rules.failure!r}"
+        if pass_when_filtered and return_code and failure_reason is None and rules.filtered and not rules.kept_output:
+            return 0, None
+        return return_code, failure_reason
+
+    def _get_coverage_map(self, tool):
+        """Get the tool's coverage map."""
+        cache_path = self._root / '.pocketwalk.cache'
+        return coverage_map.CoverageMap(cache_path / f'{tool}.coverage_map', sources_path=cache_path / 'sources')
+
+    def _select_covered_tests(self, tool, *, context):
+        """
+        Select the tests which executed the lines changed since the tool's coverage was recorded.
+
+        Returns None when the tool needs a full run.
+        """
+        selected = self._get_coverage_map(tool).select_tests(
+            source_hashes={**context['trigger files'], **context['target files']},
+            target_files=context['target files'],
+            root=self._root,
+            full_run_every=context['coverage']['full run every'],
+        )
+        if selected is None:
+            print(f"Running all of {tool}'s tests, to refresh its coverage.")
+        return selected
+
+    def _get_target_results_path(self, tool):
+        """Get the path the tool's results per target content are saved to."""
+        return (self._root / '.pocketwalk.cache' / tool).with_suffix('.target_results')
+
+    async def _load_target_results(self, tool):
+        """
+        Load the tool's saved results per target content.
+
+        Results are keyed by the digest of the tool's config, then by the hash of the
+        target's content.
+        """
         try:
-            previous_rcs = {path: rc for path, rc in toml.loads(rc_path.read_text()).items() if path in context['target files']}
+            return toml.loads(persistence.get_writer().read_text(self._get_target_results_path(tool)))
         except FileNotFoundError:
-            previous_rcs = {}
-        return previous_rcs
-
-    async def _save_rcs(self, tool, *, targets_used, return_code, previous_rcs):
-        """Save RC's."""
-        rc_path = (pathlib.Path.cwd() / '.pocketwalk.cache' / tool).with_suffix('.return_codes')
-        # save old RC's for current targets
-        new_rcs = {}
-        for path in list(previous_rcs.keys()):
-            new_rcs[path] = previous_rcs[path]
-        # save the actual RC's for paths that were used
-        for path in targets_used:
-            new_rcs[path] = return_code
-        rc_path.write_text(toml.dumps(new_rcs))
+            return {}
+
+    async def _save_target_results(self, tool, target_results):
+        """Save the tool's results per target content, for the most recently used configs."""
+        recent = dict(list(target_results.items())[-_MAX_TARGET_CONFIGS:])
+        persistence.get_writer().replace(self._get_target_results_path(tool), functools.partial(toml.dumps, recent))
 
     @staticmethod
-    def _get_targets(*, context, previous_rcs):
-        """Get targets for the tool."""
-        targets_used = []
-        # add previously failing targets that are still valid targets to the list to run
-        for path, return_code in list(previous_rcs.items()):
-            if return_code != 0:
-                targets_used.append(path)
-        if '{affected_targets}' in context['config']:
-            targets_used += context['affected files']
-        return list(set(targets_used))
-
-    async def _run_pty(self, args):
-        """Run a PTY."""
-        try:
-            # make a pseudo terminal for the subprocess so we get colors and such
-            output_side, input_side = pty.openpty()
-            process = subprocess.Popen(args, stdout=input_side, stderr=subprocess.STDOUT, start_new_session=True)
-            await signals.sleep(1)
+    def _record_target_results(checked, content_hashes, *, return_code):
+        """
+        Record the RC for the checked target content.
+
+        The most recently checked content is kept at the end, and the oldest content is
+        dropped once there are too many results to keep.
+        """
+        recorded = {h: rc for h, rc in checked.items() if h not in content_hashes}
+        for content_hash in content_hashes:
+            recorded[content_hash] = return_code
+        return dict(list(recorded.items())[-_MAX_TARGET_RESULTS:])
 
-            selector = selectors.DefaultSelector()
-            selector.register(output_side, selectors.EVENT_READ, self._process_output)
+    @staticmethod
+    def _get_rcs(*, context, checked, return_code):
+        """
+        Get the RC's for the context's targets.
+
+        Tools which aren't run against specific targets get their RC under '*'.
+        """
+        if '{affected_targets}' in context['config'] and context['affected by'] != 'coverage':
+            return {p: checked[h] for p, h in context['target files'].items() if h in checked}
+        return {'*': return_code}
 
-            output = b''
-            while selector.get_map():
-                await signals.sleep(0)
-                events = selector.select(0)
-                for key, _mask in events:
-                    output += key.data(output_side)
-                if process.poll() is not None:
-                    break
+    @staticmethod
+    def _get_targets(*, context, checked):
+        """
+        Get targets for the tool.
 
-            while process.poll() is None:
-                signals.sleep(0)
+        Targets are only used if their exact content has never been checked under the tool's
+        current config, or if it failed the last time it was.
+        """
+        if '{affected_targets}' not in context['config']:
+            return []
+        return sorted(p for p, h in context['target files'].items() if checked.get(h, None) != 0)
 
-            return output, process
 
-        except GeneratorExit:
-            print("TERMINATED")
-            process.terminate()
-            process.kill()
-            raise
+class _Runs:
+    """The tool runner's record of its tools' runs."""
 
-        finally:
-            os.close(input_side)
-            os.close(output_side)
-            selector.close()
+    def __init__(self):
+        """Init the state."""
+        # the running tools' contexts, run numbers, and futures, by tool
+        self.running = {}
+        # the futures of stale runs left to finish against their snapshots, by run
+        self.stale = {}
+        # the runs against snapshots
+        self.snapshots = set()
+        # the contexts the tools' results were last reported for, by tool
+        self.reported = {}
+        # the tools replayed since the last check on whether any tools are not done
+        self.replayed = set()
+        # how long each tool's last run took
+        self.durations = {}
+        self._count = 0
+
+    def next_run(self):
+        """Get the number of the next run."""
+        self._count += 1
+        return self._count
+
+    def is_stopping_as_stale(self, tool, *, run):
+        """Return whether the tool's run is being stopped as stale, rather than cancelled."""
+        running = self.running.get(tool, {})
+        return running.get('run', None) == run and running.get('stopping as stale', False)
+
+
+def _get_cpu_seconds(usage):
+    """Get the CPU time in the usage, or 0, if it's unknown."""
+    if usage is None:
+        return 0
+    return (usage['user seconds'] or 0) + (usage['system seconds'] or 0)
 
 
 # [ Vulture ]
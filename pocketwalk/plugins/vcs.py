@@ -7,48 +7,81 @@
 
 # [ Imports ]
 # [ -Python ]
+import os
 import pathlib
-import select
+import shutil
 import subprocess
 import sys
 import termios
 # [ -Third Party ]
 from runaway import signals
+# [ -Project ]
+from pocketwalk import reactor
+from pocketwalk.plugins import events, state_store
+
+
+# [ Static ]
+# the VCS's waiting to prompt, in order - VCS's for several projects in one process share stdin
+_PROMPT_QUEUE = []
+_PROMPT_POLL_SECONDS = 0.1
+# a commit message of just this shows the full diff, instead
+_SHOW_DIFF = '?'
+_DIFFSTAT_FILES = 50
 
 
 # [ API ]
-def get_vcs():
-    """Get the vcs plugin."""
-    return VCS()
+def get_vcs(*, root=None, state=None):
+    """Get the vcs plugin, for the project at the root, which defaults to the current directory, and its state store."""
+    return VCS(root=root, state=state)
+
+
+def parse_status(output):
+    """
+    Parse `git status --porcelain -z` output into (status code, path) pairs.
+
+    Renames and copies are followed by their original path, which is skipped.
+    """
+    entries = output.decode('utf-8', errors='surrogateescape').split('\0')
+    parsed = []
+    entries_iter = iter(e for e in entries if e)
+    for this_entry in entries_iter:
+        code, path = this_entry[:2], this_entry[3:]
+        parsed.append((code, path))
+        if code[0] in 'RC':
+            next(entries_iter, None)
+    return parsed
 
 
 # [ Internal ]
 class VCS:
     """VCS plugin for the pocketwalk shell."""
 
-    def __init__(self):
+    def __init__(self, *, root=None, state=None):
         """Init the state."""
+        self._root = pathlib.Path(root or pathlib.Path.cwd()).absolute()
+        self._state = state or state_store.StateStore()
         self._vcs_future = None
         self._notified = False
 
     # [ API ]
-    async def update_vcs(self, config, *, tool_state):
-        """Handle version control actions."""
+    async def update_vcs(self, config):
+        """Handle version control actions, as the tools' states in the state store call for."""
         if await self._exception_occurred():
             await self._re_raise_exception()
-        elif await self._should_stop_vcs(config, tool_state=tool_state):
+        elif await self._should_stop_vcs(config):
             await self._stop_vcs()
             self._notified = False
-        elif await self._should_start_vcs(config, tool_state=tool_state):
+        elif await self._should_start_vcs(config):
             await self._start_vcs(config)
             self._notified = False
-        elif await self._should_notify(config, tool_state=tool_state):
+        elif await self._should_notify(config):
             print("No changes detected - no updates to commit.")
+            events.emit(self._root, {'event': 'vcs', 'state': "no changes"})
             self._notified = True
 
     def vcs_running(self):
         """Return whether or not vcs is running."""
-        return bool(self._vcs_future)
+        return self._state.get_vcs_phase() != state_store.IDLE
 
     async def cleanup(self):
         """Clean up a running vcs future."""
@@ -56,26 +89,28 @@ class VCS:
             print("Cleaning up VCS tasks...")
             await signals.cancel(self._vcs_future)
             self._vcs_future = None
+            self._state.set_vcs_phase(state_store.IDLE)
+            events.emit(self._root, {'event': 'vcs', 'state': "cancelled"})
             print("Done.")
 
     # [ Internal ]
-    async def _should_notify(self, config, *, tool_state):
+    async def _should_notify(self, config):
         """Return whether or not to notify."""
         return (
             not config['no_vcs'] and
             not self._vcs_future and
-            not await self._any_tools_are_running(tool_state) and
-            not await self._not_all_tools_passed(tool_state) and
+            not await self._any_tools_are_running() and
+            not await self._not_all_tools_passed() and
             not self._notified
         )
 
-    async def _any_tools_are_running(self, tool_state):
+    async def _any_tools_are_running(self):
         """Return whether or not any tools are running."""
-        return any(t['running'] for t in tool_state.values())
+        return self._state.any_running()
 
-    async def _not_all_tools_passed(self, tool_state):
+    async def _not_all_tools_passed(self):
         """Return whether or not all the tools have passed."""
-        return not all(t['return code'] == 0 for t in tool_state.values())
+        return self._state.any_failed()
 
     async def _get_all_tracked_paths(self, config):
         """Get all tracked."""
@@ -104,150 +139,159 @@ class VCS:
         """Stop the vcs."""
         await signals.cancel(self._vcs_future)
         self._vcs_future = None
+        self._state.set_vcs_phase(state_store.IDLE)
+        events.emit(self._root, {'event': 'vcs', 'state': "cancelled"})
 
     async def _start_vcs(self, config):
         """Start the vcs."""
+        self._state.set_vcs_phase('staging')
         self._vcs_future = await signals.future(self._run_vcs, config)
 
     async def _run_vcs(self, config):
-        """Run the VCS commands."""
-        to_remove = await self._get_missing_vcs_paths()
-        to_add = await self._get_new_vcs_paths(config)
-        changed = await self._get_changed_vcs_paths(config)
-        await self._show_user_changes(
-            to_remove=to_remove,
-            to_add=to_add,
-            changed=changed,
-        )
-        print('prompting for commit message...')
-        commit_message = await self._prompt_for_commit_message()
-        self._remove_missing_vcs_paths(to_remove)
-        self._add_paths_to_vcs(to_add)
-        self._add_paths_to_vcs(changed)
-        self._commit_vcs(commit_message)
+        """
+        Run the VCS commands.
+
+        The commit is staged in bulk into a copy of the index, so the diffstat and diff shown
+        are exactly what will be committed, and a cancelled commit leaves the real index as it was.
+        """
+        to_remove, to_add, changed = await self._get_vcs_changes(config)
+        index_path = self._stage_commit(to_remove=to_remove, to_add=to_add + changed)
+        try:
+            self._show_user_changes(index_path)
+            print('prompting for commit message...')
+            self._state.set_vcs_phase('prompting')
+            events.emit(self._root, {'event': 'vcs', 'state': "prompting"})
+            commit_message = await self._prompt_for_commit_message()
+            while commit_message == _SHOW_DIFF:
+                self._show_full_diff(index_path)
+                commit_message = await self._prompt_for_commit_message()
+            self._state.set_vcs_phase('committing')
+            self._commit_vcs(commit_message, index_path=index_path)
+        finally:
+            index_path.unlink(missing_ok=True)
         self._vcs_future = None
+        self._state.set_vcs_phase(state_store.IDLE)
         self._notified = True
-
-    async def _get_missing_vcs_paths(self):
-        """Get paths to remove."""
-        status_lines = subprocess.run(
-            ['git', 'status', '--porcelain'],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-        ).stdout.splitlines()
-        to_delete = [l.strip().split(' ', 1)[-1] for l in status_lines if l.strip().startswith('D')]
-        return to_delete
-
-    async def _get_new_vcs_paths(self, config):
-        """Get paths to add."""
-        # XXX use path for all paths
+        # wake the core, so it can react to the commit
+        reactor.notify()
+
+    def _git(self, *args, index_path=None, stdin_paths=None, **kwargs):
+        """
+        Run the git command in the root.
+
+        The command uses the index at the index path, if given, and reads the stdin paths,
+        if given, NUL-separated from stdin, rather than from argv, so any number fit.
+        """
+        env = None if index_path is None else {**os.environ, 'GIT_INDEX_FILE': str(index_path)}
+        stdin_input = None
+        if stdin_paths is not None:
+            stdin_input = b''.join(p.encode('utf-8', errors='surrogateescape') + b'\0' for p in stdin_paths)
+        return subprocess.run(['git', *args], cwd=self._root, env=env, input=stdin_input, **kwargs)
+
+    async def _get_vcs_changes(self, config):
+        """Get the paths to remove, the tracked paths to add, and the tracked paths which changed."""
         # XXX for git use git root instead of cwd
-        status_lines = subprocess.run(
-            ['git', 'status', '--porcelain'],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-        ).stdout.splitlines()
-        to_add = [l.strip().split(' ', 1)[-1] for l in status_lines if l.startswith('??')]
-        tracked = [
-            str(pathlib.Path(p).absolute().relative_to(pathlib.Path.cwd()))
-            for p in await self._get_all_tracked_paths(config)
-        ]
-        tracked_to_add = [l for l in to_add if l in tracked]
-        directories = [l for l in to_add if l.endswith('/')]
-        in_new_dir = [t for t in tracked if any(t.startswith(d) for d in directories)]
-        return tracked_to_add + in_new_dir
-
-    async def _get_changed_vcs_paths(self, config):
-        """Get paths which changed."""
-        status_lines = subprocess.run(
-            ['git', 'status', '--porcelain'],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-        ).stdout.splitlines()
-        to_add = [l.strip().split(' ', 1)[-1] for l in status_lines if l.strip().startswith('M')]
-        tracked = [
-            str(pathlib.Path(p).absolute().relative_to(pathlib.Path.cwd()))
+        status = parse_status(self._git('status', '--porcelain', '-z', stdout=subprocess.PIPE).stdout)
+        to_remove = [p for code, p in status if code.strip().startswith('D')]
+        untracked = [p for code, p in status if code == '??']
+        modified = [p for code, p in status if code.strip().startswith('M')]
+        tracked = {
+            str(pathlib.Path(p).absolute().relative_to(self._root))
             for p in await self._get_all_tracked_paths(config)
-        ]
-        tracked_to_add = [l for l in to_add if l in tracked]
-        return tracked_to_add
-
-    async def _show_user_changes(self, *, to_remove, to_add, changed):
-        """Show the user changes."""
-        print(f"removing: {to_remove}")
-        print(f"adding: {to_add}")
-        print(subprocess.run(
-            ['git', 'diff', '--color', '--'] + changed,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-        ).stdout.decode('utf-8'))
+        }
+        directories = [p for p in untracked if p.endswith('/')]
+        in_new_dir = [t for t in sorted(tracked) if any(t.startswith(d) for d in directories)]
+        to_add = [p for p in untracked if p in tracked] + in_new_dir
+        changed = [p for p in modified if p in tracked]
+        return to_remove, to_add, changed
+
+    def _stage_commit(self, *, to_remove, to_add):
+        """Stage the commit into a copy of the index, returning the copy's path."""
+        real_index = self._root / self._git(
+            'rev-parse', '--git-path', 'index',
+            stdout=subprocess.PIPE, universal_newlines=True,
+        ).stdout.strip()
+        index_path = real_index.with_name('pocketwalk.index')
+        if real_index.exists():
+            shutil.copyfile(real_index, index_path)
+        if to_remove:
+            self._git('update-index', '--remove', '-z', '--stdin', index_path=index_path, stdin_paths=to_remove)
+        if to_add:
+            self._git(
+                '--literal-pathspecs', 'add', '--pathspec-from-file=-', '--pathspec-file-nul',
+                index_path=index_path, stdin_paths=to_add,
+            )
+        return index_path
+
+    def _show_user_changes(self, index_path):
+        """Show the user a diffstat of the staged changes, streamed straight to stdout."""
+        print(f"changes in {self._root}:")
+        sys.stdout.flush()
+        self._git(
+            'diff', '--cached', '--stat', f'--stat-count={_DIFFSTAT_FILES}', '--color=always',
+            index_path=index_path,
+        )
 
-    async def _async_input(self, prompt: str) -> str:
-        """Async input prompt."""
-        readable = []  # type: List[int]
-        print(prompt, end='')
+    def _show_full_diff(self, index_path):
+        """Show the user the full diff of the staged changes, through git's pager, if on a terminal."""
         sys.stdout.flush()
-        while not readable:
-            readable, _writeable, _executable = select.select([sys.stdin], [], [], 0)
+        self._git('--paginate', 'diff', '--cached', '--color=always', index_path=index_path)
+
+    async def _async_input(self, prompt: str) -> str:
+        """Async input prompt, once any other VCS's prompt is answered."""
+        _PROMPT_QUEUE.append(self)
+        try:
+            while _PROMPT_QUEUE[0] is not self:
+                await signals.sleep(_PROMPT_POLL_SECONDS)
+            print(prompt, end='')
+            sys.stdout.flush()
             try:
-                await signals.sleep(0)
+                await reactor.wait_readable([sys.stdin])
             except GeneratorExit:
                 print("input cancelled...")
-                termios.tcflush(sys.stdin, termios.TCIFLUSH)
+                # a daemon's stdin is a pipe of its clients' answers, rather than a terminal
+                if sys.stdin.isatty():
+                    termios.tcflush(sys.stdin, termios.TCIFLUSH)
                 raise
-        return sys.stdin.readline().rstrip()
+            return sys.stdin.readline().rstrip()
+        finally:
+            _PROMPT_QUEUE.remove(self)
 
     async def _prompt_for_commit_message(self):
         """Prompt for commit message."""
         print("your files are still being monitored for changes.")
         print("if changes are made, the commit will be cancelled and you will be reprompted when all the checks pass again.")
-        return await self._async_input("commit message: ")
-
-    @staticmethod
-    def _remove_missing_vcs_paths(to_remove):
-        """Remove missing vcs paths."""
-        if to_remove:
-            subprocess.run(['git', 'rm'] + to_remove)
-
-    @staticmethod
-    def _add_paths_to_vcs(to_add):
-        """Add vcs paths."""
-        if to_add:
-            subprocess.run(['git', 'add'] + to_add)
+        return await self._async_input(f"commit message ({_SHOW_DIFF} to see the full diff): ")
 
-    @staticmethod
-    def _commit_vcs(message):
-        """Commit changes to vcs."""
-        subprocess.run(['git', 'commit', '-m', message])
+    def _commit_vcs(self, message, *, index_path):
+        """Commit the changes staged in the index at the path, and make it the real index, if committed."""
+        if self._git('commit', '-m', message, index_path=index_path).returncode == 0:
+            os.replace(index_path, index_path.with_name('index'))
+            events.emit(self._root, {'event': 'vcs', 'state': "committed"})
+        else:
+            events.emit(self._root, {'event': 'vcs', 'state': "commit failed"})
 
     async def _paths_changed(self, config):
         """Return whether or not the paths changed."""
-        return (
-            await self._get_missing_vcs_paths() or
-            await self._get_new_vcs_paths(config) or
-            await self._get_changed_vcs_paths(config)
-        )
+        return any(await self._get_vcs_changes(config))
 
-    async def _should_stop_vcs(self, config, *, tool_state):
+    async def _should_stop_vcs(self, config):
         """Return whether or not to stop vcs."""
         return await self._vcs_is_running() and (
-            await self._any_tools_are_running(tool_state) or
-            await self._not_all_tools_passed(tool_state) or
+            await self._any_tools_are_running() or
+            await self._not_all_tools_passed() or
             not await self._paths_changed(config) or
             config['no_vcs']
         )
 
-    async def _should_start_vcs(self, config, *, tool_state):
+    async def _should_start_vcs(self, config):
         """Return whether or not to start vcs."""
         return (
             not config['no_vcs'] and
             not await self._vcs_is_running() and
             not (
-                await self._any_tools_are_running(tool_state) or
-                await self._not_all_tools_passed(tool_state)
+                await self._any_tools_are_running() or
+                await self._not_all_tools_passed()
             ) and
             await self._paths_changed(config)
         )
@@ -0,0 +1,285 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""Pocketwalk watcher."""
+
+
+# [ Imports ]
+# [ -Python ]
+import ctypes
+import errno
+import heapq
+import os
+import pathlib
+import struct
+import time
+# [ -Third Party ]
+from runaway import signals
+# [ -Project ]
+from pocketwalk import reactor
+from pocketwalk.plugins import globbing
+
+
+# [ Static ]
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_WATCH_MASK = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+_LISTING_CHANGES = _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+_EVENT_HEADER = struct.Struct('iIII')
+# editors write a file in several steps - let them finish before reacting
+_SETTLE_SECONDS = 0.02
+# polling backs off from the min, doubling while nothing changes, up to the configured max
+_POLL_MIN_SECONDS = 0.25
+_POLL_BACKOFF = 2
+_LIBC = ctypes.CDLL(None, use_errno=True)
+
+
+# [ API ]
+def get_watcher():
+    """Get the watcher plugin."""
+    return Watcher()
+
+
+def next_poll_interval(interval, *, changed, ceiling):
+    """Get the interval to next poll a path at, which had been polled at the interval, and changed, or not."""
+    if changed:
+        return _POLL_MIN_SECONDS
+    return min(interval * _POLL_BACKOFF, max(ceiling, _POLL_MIN_SECONDS))
+
+
+# [ Internal ]
+class Watcher:
+    """
+    Watcher plugin for pocketwalk.
+
+    Watches the project's directories via inotify, so that waiting for a change costs
+    nothing until one happens.  Where inotify isn't available, or its watch limit is
+    reached, falls back to polling the watched paths' stats.  One watcher can watch
+    several projects, each watched via its own config.
+
+    Polling is adaptive: each path is polled at its own interval, which doubles every
+    time it's found unchanged, up to the configured max, and snaps back to the min for
+    it and its directory when it changes, so recently edited parts of the tree are
+    polled often, and cold ones rarely.
+    """
+
+    def __init__(self):
+        """Init the state."""
+        self._inotify_fd = _inotify_init()
+        self._watches = {}
+        self._projects = {}
+        self._tracked = set()
+        self._directories = set()
+        self._rescan = True
+        self._stats = {}
+        self._intervals = {}
+        self._due = {}
+        self._schedule = []
+        self._poll_max = _POLL_MIN_SECONDS
+
+    # [ API ]
+    async def watch(self, config):
+        """Watch the paths the config tracks, and the config itself, for the config's project."""
+        tracked = {str(pathlib.Path(config['config_path']).absolute())}
+        for tool in config['tools']:
+            tracked.update(config[f'{tool}_targets'], config[f'{tool}_triggers'])
+        # events arrive with absolute paths, so tracked paths must be absolute to be matched against them
+        tracked = {os.path.abspath(os.path.join(config['root'], p)) for p in tracked}
+        project = {'tracked': tracked, 'exclude': tuple(config['exclude']), 'gitignore': not config['no_gitignore']}
+        if self._rescan or project != self._projects.get(config['root'], None):
+            self._projects[config['root']] = project
+            self._tracked = set().union(*(p['tracked'] for p in self._projects.values()))
+            self._directories = self._get_directories(self._tracked, projects=self._projects)
+            self._rescan = False
+            if self._inotify_fd is not None:
+                self._add_watches()
+        self._poll_max = config['poll_max']
+        if self._inotify_fd is None:
+            self._schedule_polls()
+
+    async def get_poll_seconds(self):
+        """Get the longest a change can currently go unnoticed, in seconds, or None, if not polling."""
+        if self._inotify_fd is not None:
+            return None
+        return max(self._intervals.values(), default=_POLL_MIN_SECONDS)
+
+    async def wait_for_events(self):
+        """Wait for a watched path to change, or for a notification via the reactor."""
+        while True:
+            if self._inotify_fd is None:
+                timeout = max(self._schedule[0][0] - time.monotonic(), 0) if self._schedule else None
+                ready = await reactor.wait_readable([reactor.get_notify_fd()], timeout=timeout)
+            else:
+                ready = await reactor.wait_readable([reactor.get_notify_fd(), self._inotify_fd])
+            if reactor.get_notify_fd() in ready:
+                reactor.clear_notifications()
+                return
+            if self._inotify_fd is None:
+                if self._poll_due():
+                    return
+            elif ready:
+                await signals.sleep(_SETTLE_SECONDS)
+                if self._read_events():
+                    return
+
+    # [ Internal ]
+    @staticmethod
+    def _get_directories(tracked, *, projects):
+        """
+        Get the directories to watch.
+
+        That's every directory in the projects - new files anywhere may match a tool's
+        globs - skipping hidden and cache directories, and those globbing leaves out, for
+        being in the project's exclude list, or ignored by its .gitignore files, plus the
+        directories of any tracked paths outside the projects, or in skipped directories.
+        """
+        directories = set()
+        for root, project in projects.items():
+            ignore_rules = globbing.IgnoreRules(root, exclude=project['exclude'], gitignore=project['gitignore'])
+            # the rules which apply within each directory, by its path, as they're found by the walk
+            rules = {}
+            for this_dir, dir_names, _file_names in os.walk(root):
+                directory = pathlib.Path(this_dir)
+                dir_rules = ignore_rules.get_rules(directory, parent_rules=rules.pop(this_dir, None))
+                dir_names[:] = [d for d in dir_names if not _is_skipped(d) and not ignore_rules.is_ignored(
+                    (directory / d).relative_to(root).as_posix(), is_dir=True, rules=dir_rules,
+                )]
+                rules.update((os.path.join(this_dir, d), dir_rules) for d in dir_names)
+                directories.add(this_dir)
+        for path in tracked:
+            directories.add(str(pathlib.Path(path).parent))
+        return directories
+
+    def _add_watches(self):
+        """Add inotify watches for any directories not yet watched."""
+        watched = set(self._watches.values())
+        for directory in self._directories - watched:
+            watch_descriptor = _LIBC.inotify_add_watch(self._inotify_fd, os.fsencode(directory), _WATCH_MASK)
+            if watch_descriptor >= 0:
+                self._watches[watch_descriptor] = directory
+            elif ctypes.get_errno() == errno.ENOSPC:
+                print("The inotify watch limit has been reached - polling for changes instead.")
+                os.close(self._inotify_fd)
+                self._inotify_fd = None
+                self._watches = {}
+                return
+
+    def _read_events(self):
+        """
+        Read the pending inotify events, and return whether any are relevant.
+
+        Changes to tracked paths are relevant, as is any file being created, removed, or
+        renamed, since it may match a tool's globs.
+        """
+        data = b''
+        try:
+            while True:
+                chunk = os.read(self._inotify_fd, 65536)
+                if not chunk:
+                    break
+                data += chunk
+        except BlockingIOError:
+            pass
+        relevant = False
+        offset = 0
+        while offset < len(data):
+            watch_descriptor, mask, _cookie, name_length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_length].rstrip(b'\0'))
+            offset += name_length
+            if mask & _IN_Q_OVERFLOW:
+                # events were dropped - anything could have changed
+                self._rescan = True
+                relevant = True
+                continue
+            if mask & _IN_IGNORED:
+                # the watched directory is gone
+                self._watches.pop(watch_descriptor, None)
+                self._rescan = True
+                continue
+            path = os.path.join(self._watches.get(watch_descriptor, ''), name)
+            if path in self._tracked:
+                relevant = True
+                continue
+            if not name or _is_skipped(name):
+                continue
+            if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                self._rescan = True
+            if mask & _LISTING_CHANGES:
+                relevant = True
+        return relevant
+
+    def _schedule_polls(self):
+        """Schedule polls of any newly watched paths, taking their stats now, and drop those no longer watched."""
+        watched = self._directories | self._tracked
+        for path in set(self._intervals) - watched:
+            del self._intervals[path]
+            del self._due[path]
+            del self._stats[path]
+        now = time.monotonic()
+        for path in watched - set(self._intervals):
+            self._stats[path] = _get_stat(path)
+            self._intervals[path] = _POLL_MIN_SECONDS
+            self._due[path] = now + _POLL_MIN_SECONDS
+            heapq.heappush(self._schedule, (self._due[path], path))
+
+    def _poll_due(self):
+        """Poll the paths which are due, rescheduling each, and return whether any changed."""
+        now = time.monotonic()
+        changed = set()
+        due = set()
+        while self._schedule and self._schedule[0][0] <= now:
+            due_time, path = heapq.heappop(self._schedule)
+            # entries for paths no longer watched, or since rescheduled, are dropped lazily
+            if self._due.get(path, None) == due_time:
+                due.add(path)
+        for path in due:
+            stat = _get_stat(path)
+            if stat != self._stats[path]:
+                self._stats[path] = stat
+                changed.add(path)
+        # a change is likely to be followed by more nearby - its directory snaps back too
+        hot = changed | {os.path.dirname(p) for p in changed if os.path.dirname(p) in self._intervals}
+        for path in due | hot:
+            self._intervals[path] = next_poll_interval(self._intervals[path], changed=path in hot, ceiling=self._poll_max)
+            self._due[path] = now + self._intervals[path]
+            heapq.heappush(self._schedule, (self._due[path], path))
+        return bool(changed)
+
+
+def _get_stat(path):
+    """Get the parts of the path's stat which change when it does, or None, if it doesn't exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def _is_skipped(name):
+    """Return whether the named file or directory is skipped, for being hidden or a cache."""
+    return name.startswith('.') or name == '__pycache__'
+
+
+def _inotify_init():
+    """Init inotify, returning its file descriptor, or None, if it isn't available."""
+    try:
+        inotify_fd = _LIBC.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except AttributeError:
+        return None
+    return inotify_fd if inotify_fd >= 0 else None
+
+
+# [ Vulture ]
+assert all((
+    get_watcher,
+))
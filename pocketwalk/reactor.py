@@ -0,0 +1,183 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk reactor.
+
+Runaway's own sleep handler only sleeps the process when every coroutine is
+sleeping, and anything waiting on a file descriptor has to poll it with
+`sleep(0)`, which spins the CPU.  The handlers here park waiting coroutines
+instead, and when every coroutine is parked, block in a single `select` across
+every file descriptor any of them is waiting on, until the first is ready or
+the soonest timeout passes.
+
+Threads and signal handlers wake the reactor via `notify`, which writes to a
+self-pipe any coroutine can wait on.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import os
+import select
+import time
+import types
+# [ -Third Party ]
+import runaway
+from runaway import actions
+from runaway.core import DEFAULT_HANDLERS
+
+
+# [ Static ]
+_NOTIFY_READ, _NOTIFY_WRITE = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+
+
+# [ API ]
+class WaitReadable:
+    """Wait for any of the file descriptors to be readable."""
+
+    def __init__(self, fds, *, timeout):
+        """Init the state."""
+        self.fds = list(fds)
+        self.timeout = timeout
+
+    def __eq__(self, other):
+        """Return whether self is equal to other."""
+        return (
+            isinstance(other, type(self)) and
+            self.__dict__ == other.__dict__
+        )
+
+    def __str__(self):
+        """String representation."""
+        return str(self.__dict__)
+
+    __repr__ = __str__
+
+
+@types.coroutine
+def wait_readable(fds, *, timeout=None):
+    """
+    Wait for any of the file descriptors to be readable, or for the timeout to pass.
+
+    Returns the readable file descriptors, which are empty on a timeout.
+    """
+    return (yield WaitReadable(fds, timeout=timeout))
+
+
+def notify():
+    """Wake anything waiting on the notify file descriptor.  Safe to call from threads and signal handlers."""
+    try:
+        os.write(_NOTIFY_WRITE, b'\0')
+    except BlockingIOError:
+        # the pipe is full of unread notifications already
+        pass
+
+
+def get_notify_fd():
+    """Get the file descriptor which is readable after a notification."""
+    return _NOTIFY_READ
+
+
+def clear_notifications():
+    """Clear any pending notifications."""
+    try:
+        while os.read(_NOTIFY_READ, 4096):
+            pass
+    except BlockingIOError:
+        pass
+
+
+def handle_sleep(sleep_signal, *, action, queue):
+    """Handle a sleep signal, by parking the sleeper until its wake time."""
+    waiter = _Waiter(fds=[], wake_time=time.monotonic() + sleep_signal.seconds)
+    return queue + [actions.Send(waiter, value=None, source=action)]
+
+
+def handle_waitreadable(wait_signal, *, action, queue):
+    """Handle a wait-readable signal, by parking the waiter until a file descriptor is ready or it times out."""
+    wake_time = None if wait_signal.timeout is None else time.monotonic() + wait_signal.timeout
+    waiter = _Waiter(fds=wait_signal.fds, wake_time=wake_time)
+    return queue + [actions.Send(waiter, value=None, source=action)]
+
+
+def handle_park(_park_signal, *, action, queue):
+    """
+    Handle a park signal from a waiter which isn't ready yet.
+
+    Requeues the waiter.  If every queued action is a parked waiter, blocks until one
+    of them is ready.
+    """
+    new_queue = queue + [action]
+    waiters = [a.coro for a in new_queue if isinstance(a, actions.Send) and isinstance(a.coro, _Waiter)]
+    if len(waiters) < len(new_queue):
+        return new_queue
+    now = time.monotonic()
+    wake_times = [w.wake_time for w in waiters if w.wake_time is not None]
+    timeout = max(0, min(wake_times) - now) if wake_times else None
+    fds = list({fd for w in waiters for fd in w.fds})
+    if fds:
+        select.select(fds, [], [], timeout)
+    elif timeout is not None:
+        time.sleep(timeout)
+    return new_queue
+
+
+def run(coro):
+    """Run the coroutine with the reactor's handlers."""
+    return runaway.run(coro, **HANDLERS)
+
+
+HANDLERS = {
+    **DEFAULT_HANDLERS,
+    'sleep': handle_sleep,
+    'waitreadable': handle_waitreadable,
+    # signal handlers are looked up by the lowercased name of the signal's class
+    '_park': handle_park,
+}
+
+
+# [ Internal ]
+class _Park:
+    """Signal that a waiter isn't ready yet."""
+
+
+class _Waiter:
+    """
+    A coro stand-in for a parked wait.
+
+    Returns the ready file descriptors to the waiting coroutine once any are ready,
+    or nothing once the wake time has passed, and signals to stay parked otherwise.
+    """
+
+    def __init__(self, *, fds, wake_time):
+        """Init the state."""
+        self.fds = fds
+        self.wake_time = wake_time
+
+    def send(self, _value):
+        """Check whether the wait is over."""
+        if self.fds:
+            ready, _writeable, _exceptional = select.select(self.fds, [], [], 0)
+            if ready:
+                raise StopIteration(ready)
+        if self.wake_time is not None and self.wake_time <= time.monotonic():
+            raise StopIteration([])
+        return _Park()
+
+    @staticmethod
+    def throw(*exc_info):
+        """Raise the exception - there's no coroutine to throw it into."""
+        raise exc_info[1]
+
+    def close(self):
+        """Close the wait - there's nothing to clean up."""
+
+
+# [ Vulture ]
+assert all((
+    handle_sleep,
+    handle_waitreadable,
+    handle_park,
+))
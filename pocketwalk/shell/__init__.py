@@ -13,3 +13,8 @@ from pocketwalk.shell.vcs import VCS
 from pocketwalk.shell.config import Config
 from pocketwalk.shell.context_manager import ContextManager
 from pocketwalk.shell.tool_runner import ToolRunner
+from pocketwalk.shell.result_cache import ResultCache
+from pocketwalk.shell.cache_backend import CacheBackend
+from pocketwalk.shell.executor import Executor
+from pocketwalk.shell.reporter import Reporter
+from pocketwalk.shell.watcher import Watcher
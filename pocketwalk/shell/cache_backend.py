@@ -0,0 +1,37 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""Pocketwalk cache backend interface."""
+
+
+# [ Imports ]
+import abc
+
+
+# [ API ]
+class CacheBackend(abc.ABC):
+    """
+    Shared cache backend plugin for pocketwalk.
+
+    Any number of backends may be installed.  Each decides for itself, from the config,
+    whether it is enabled.
+
+    Backends are called from worker threads, never from the loop, so they may block.
+    """
+
+    # [ API ]
+    @abc.abstractmethod
+    def enabled(self, config):
+        """Return whether or not the backend is enabled by the config."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def fetch(self, digest, *, config):
+        """Fetch the payload for the digest, or None, if there isn't one."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def publish(self, digest, payload, *, config):
+        """Publish the payload for the digest."""
+        raise NotImplementedError
@@ -30,6 +30,11 @@ class Config(abc.ABC):
         """Return whether to loop till pass."""
         raise NotImplementedError
 
+    @abc.abstractmethod
+    async def get_command(self):
+        """Get the command to run, and its arguments."""
+        raise NotImplementedError
+
     @abc.abstractmethod
     async def get_config(self):
         """Get the config."""
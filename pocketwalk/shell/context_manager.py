@@ -36,8 +36,7 @@ class ContextManager(abc.ABC):
         """Return the contexts in a and not in b."""
         raise NotImplementedError
 
-    @staticmethod
     @abc.abstractmethod
-    async def save_context(tool, *, context):
+    async def save_context(self, tool, *, context):
         """Save the current context for the given tool."""
         raise NotImplementedError
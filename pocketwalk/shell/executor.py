@@ -0,0 +1,48 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""Pocketwalk executor interface."""
+
+
+# [ Imports ]
+import abc
+
+
+# [ API ]
+class Executor(abc.ABC):
+    """
+    Executor plugin for pocketwalk, which runs tools somewhere other than in local processes.
+
+    Any number of executors may be installed.  Each decides for itself, from the config,
+    which tools, if any, it runs.  Tools no executor runs are run locally.
+    """
+
+    # [ API ]
+    @abc.abstractmethod
+    def configure(self, config):
+        """Configure the executor from the config."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def runs(self, tool):
+        """Return whether or not the executor runs the tool."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def run(self, tool, *, root, shards, file_hashes, limits, on_output):
+        """
+        Run the tool's shards - each a list of args, relative to the project root - against the files.
+
+        The files are given relative to the project root, mapped to the hashes of their
+        content.  Calls on_output with each shard's index and output as it streams, and
+        stops the run if it returns False.  Returns each shard's result - its raw 'return
+        code', whether it 'timed out', its 'usage', and its 'failure reason', if any - or
+        None, if the tool couldn't be run, and should be run locally instead.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def close(self):
+        """Release the executor's resources."""
+        raise NotImplementedError
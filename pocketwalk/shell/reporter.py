@@ -0,0 +1,32 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""Pocketwalk reporter interface."""
+
+
+# [ Imports ]
+import abc
+
+
+# [ API ]
+class Reporter(abc.ABC):
+    """
+    Reporter plugin for pocketwalk, which is sent structured events - tools starting, finishing, and so on.
+
+    Any number of reporters may be installed.  Each decides for itself, from the config,
+    whether it is enabled.
+
+    Events are sent in batches, from a thread of their own, never from the loop, so reporters may block.
+    """
+
+    # [ API ]
+    @abc.abstractmethod
+    def enabled(self, config):
+        """Return whether or not the reporter is enabled by the config."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def report(self, events, *, config):
+        """Report the batch of events, oldest first."""
+        raise NotImplementedError
@@ -0,0 +1,25 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""Pocketwalk result cache interface."""
+
+
+# [ Imports ]
+import abc
+
+
+# [ API ]
+class ResultCache(abc.ABC):
+    """Result cache plugin for pocketwalk."""
+
+    # [ API ]
+    @abc.abstractmethod
+    async def get_cached_results(self, contexts_for_tools, *, config):
+        """Get the cached results for any of the tools whose contexts have been checked before."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def save_result(self, tool, *, context, result, config):
+        """Save the tool's result for its context."""
+        raise NotImplementedError
@@ -21,12 +21,12 @@ class ToolRunner(abc.ABC):
     # [ API ]
     @abc.abstractmethod
     async def get_tool_state(self):
-        """Get the tool state."""
+        """Get the tool state - kept up to date in the state store, so it mustn't be modified."""
         raise NotImplementedError
 
     @abc.abstractmethod
-    def all_tools_passed(self, tools):
-        """Return whether all of the tools have passed."""
+    def all_tools_passed(self):
+        """Return whether all of the configured tools have passed."""
         raise NotImplementedError
 
     @abc.abstractmethod
@@ -39,13 +39,19 @@ class ToolRunner(abc.ABC):
         """Return the return codes."""
         raise NotImplementedError
 
+    @abc.abstractmethod
+    async def configure_output(self, config):
+        """Configure how tool output is rendered."""
+        raise NotImplementedError
+
     @abc.abstractmethod
     async def ensure_tools_running(self, contexts_for_tools, *, on_completion):
         """
         Ensure the tools are running with their current contexts.
 
-        Calls the on_completion function with the tool and RC on completion of each tool.
-        Runs the tools concurrently.
+        Calls the on_completion function with the tool, its context, and its result on
+        completion of each tool, and with stale=True for a stale snapshot run, whose result
+        is only valid for its own context.  Runs the tools concurrently.
         """
         raise NotImplementedError
 
@@ -87,3 +93,27 @@ class ToolRunner(abc.ABC):
     async def replay_previous_results_for(self, tools):
         """Replay the previous results for the given tools."""
         raise NotImplementedError
+
+    @abc.abstractmethod
+    async def replay_cached_results(self, cached_results, *, on_completion):
+        """
+        Replay cached results for the given tools, as if they had just been run.
+
+        Calls the on_completion function with the tool and its context for each tool.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def write_reports(self, config):
+        """Write each tool's result to the report paths in the config, if any."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def show_stats(self, tools):
+        """Show the stats of the recorded runs of the tools, or of every tool, if none are given."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def show_output(self, tool):
+        """Show the full output from the tool's last run."""
+        raise NotImplementedError
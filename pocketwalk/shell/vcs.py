@@ -20,8 +20,8 @@ class VCS(abc.ABC):
 
     # [ API ]
     @abc.abstractmethod
-    async def update_vcs(self, config, *, tool_state):
-        """Handle version control actions."""
+    async def update_vcs(self, config):
+        """Handle version control actions, as the tools' states in the state store call for."""
         raise NotImplementedError
 
     @abc.abstractmethod
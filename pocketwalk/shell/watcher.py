@@ -0,0 +1,30 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""Pocketwalk watcher interface."""
+
+
+# [ Imports ]
+import abc
+
+
+# [ API ]
+class Watcher(abc.ABC):
+    """Watcher plugin for pocketwalk."""
+
+    # [ API ]
+    @abc.abstractmethod
+    async def watch(self, config):
+        """Watch the paths the config tracks, and the config itself."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def get_poll_seconds(self):
+        """Get the longest a change can currently go unnoticed, in seconds, or None, if not polling."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def wait_for_events(self):
+        """Wait for a watched path to change, or for a notification via the reactor."""
+        raise NotImplementedError
@@ -0,0 +1,288 @@
+#! /usr/bin/env python
+# coding: utf-8
+
+
+"""
+Pocketwalk worker.
+
+A worker runs tools for pocketwalk processes elsewhere - on other machines, or, as
+a stand-in for them, on the same one - via the remote executor's protocol, as
+described in `pocketwalk.plugins.remote`.
+
+Each connection runs one tool process.  The worker asks for the content it doesn't
+have yet, by hash, links the tool's files into a snapshot of their own, from its
+content-addressed store, and runs the tool there, with the client's limits,
+streaming its output back.  The tool is killed the moment the client hangs up.
+The worker runs whatever it's asked to, so it must only listen where it's trusted.
+"""
+
+
+# [ Imports ]
+# [ -Python ]
+import argparse
+import os
+import pathlib
+import resource
+import select
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+# [ -Project ]
+from pocketwalk.plugins import history, processes, remote, snapshots
+
+
+# [ Static ]
+_MEGABYTE = 1024 * 1024
+_READ_BYTES = 1024 * 1024
+
+
+# [ API ]
+def main(arguments=None):
+    """Serve runs as a worker, as set by the arguments, which default to the CLI's."""
+    parser = argparse.ArgumentParser(prog='pocketwalk worker', description="Run tools for pocketwalk, on this machine.")
+    parser.add_argument(
+        '--listen',
+        help="Where to listen for runs - host:port, or unix:path. [default: %(default)s]",
+        metavar='ADDRESS',
+        default=f'127.0.0.1:{remote.DEFAULT_PORT}',
+    )
+    parser.add_argument(
+        '--jobs',
+        help="Max tools to run at once - the rest wait their turn. [default: one per CPU]",
+        metavar='N',
+        type=int,
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        '--store',
+        help="Directory to keep the content shipped to the worker in. [default: %(default)s]",
+        metavar='PATH',
+        default='~/.cache/pocketwalk/worker',
+    )
+    parser.add_argument(
+        '--store-size',
+        help="Max size of the content kept, in MB. [default: %(default)s]",
+        metavar='MB',
+        type=int,
+        default=1024,
+    )
+    args = parser.parse_args(sys.argv[1:] if arguments is None else arguments)
+    # so the tools still running are killed on the way out, rather than orphaned
+    signal.signal(signal.SIGTERM, lambda *_args: sys.exit(0))
+    worker = Worker(store_path=pathlib.Path(args.store).expanduser(), jobs=args.jobs, store_bytes=args.store_size * _MEGABYTE)
+    worker.serve(args.listen)
+    return 0
+
+
+class Worker:
+    """Worker, running tools for pocketwalk, one per connection."""
+
+    def __init__(self, *, store_path, jobs, store_bytes):
+        """Init the state."""
+        self._store = snapshots.ObjectStore(store_path / 'objects')
+        self._store_bytes = store_bytes
+        self._snapshots_path = store_path / 'snapshots'
+        self._slots = threading.BoundedSemaphore(jobs)
+        self._processes = set()
+        self._runs_lock = threading.Lock()
+        self._runs = 0
+
+    # [ API ]
+    def serve(self, address):
+        """Serve runs at the address, until stopped."""
+        listener = self._listen(address)
+        print(f"Serving on {address}.", flush=True)
+        try:
+            while True:
+                connection, _peer = listener.accept()
+                threading.Thread(
+                    target=self._serve_connection, args=(connection,), name='pocketwalk-worker-run', daemon=True,
+                ).start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.close()
+            for this_process in list(self._processes):
+                os.killpg(this_process.pid, signal.SIGKILL)
+
+    # [ Internal ]
+    @staticmethod
+    def _listen(address):
+        """Listen at the address."""
+        kind, location = remote.parse_address(address)
+        if kind == 'unix':
+            # a socket file nothing's listening on is left over from a worker which didn't exit cleanly
+            pathlib.Path(location).unlink(missing_ok=True)
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(location)
+        elif kind == 'tcp':
+            listener = socket.create_server(location)
+        else:
+            raise ValueError(f"a worker can't listen at {address!r} - give it a host:port, or a unix:path")
+        listener.listen()
+        return listener
+
+    def _serve_connection(self, connection):
+        """Serve the run requested over the connection."""
+        with self._runs_lock:
+            self._runs += 1
+        try:
+            self._serve_run(_Channel(connection))
+        # a failed run mustn't take the worker down with it
+        except (OSError, ValueError, KeyError) as error:
+            print(f"Run failed ({error})", flush=True)
+        finally:
+            connection.close()
+            with self._runs_lock:
+                self._runs -= 1
+                # only pruned between runs, so content a run's been sent can't be pruned before it's linked
+                if not self._runs:
+                    self._store.prune(max_bytes=self._store_bytes)
+
+    def _serve_run(self, channel):
+        """Receive the run's files, and run it against a snapshot of them."""
+        request, _payload = channel.receive()
+        if request is None:
+            return
+        if request['op'] != 'run':
+            raise ValueError(f"expected a run, but got {request['op']!r}")
+        for this_path in request['files']:
+            parts = pathlib.PurePosixPath(this_path).parts
+            if not parts or parts[0] == '/' or '..' in parts:
+                raise ValueError(f"refusing to write {this_path!r}, outside of the snapshot")
+        needed = sorted({h for h in request['files'].values() if self._store.get(h) is None})
+        channel.send({'event': 'need', 'hashes': needed})
+        remaining = set(needed)
+        while remaining:
+            message, payload = channel.receive()
+            if message is None:
+                # the client hung up before sending everything - the run went stale
+                return
+            if message['op'] == 'object' and message['hash'] in remaining:
+                if self._store.add_content(payload, file_hash=message['hash']) is None:
+                    raise ValueError(f"the content sent as {message['hash']} has another hash")
+                remaining.discard(message['hash'])
+        with self._slots:
+            self._snapshots_path.mkdir(parents=True, exist_ok=True)
+            snapshot_path = pathlib.Path(tempfile.mkdtemp(dir=self._snapshots_path))
+            try:
+                for this_path, this_hash in request['files'].items():
+                    snapshots.link_object(self._store.get(this_hash), snapshot_path / this_path)
+                channel.send({'event': 'started'})
+                self._run_tool(channel, request['args'], limits=request['limits'], cwd=snapshot_path)
+            finally:
+                snapshots.remove_snapshot(snapshot_path)
+
+    def _run_tool(self, channel, args, *, limits, cwd):
+        """
+        Run the tool, streaming its output over the channel, then its exit.
+
+        The tool is killed if it runs out of time, or the client hangs up - the client
+        sends nothing else while the tool runs.
+        """
+        # the tool's run exactly as the tool runner would run it locally
+        spawn_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        output_side, input_side = os.pipe()
+        try:
+            process = processes.spawn(args, limits=limits, cwd=cwd, stdout=input_side, stdin=subprocess.DEVNULL)
+        except OSError as error:
+            os.close(output_side)
+            channel.send({'event': 'output'}, f"{args[0]}: {error}\n".encode('utf-8'))
+            channel.send({'event': 'exit', 'return code': 127, 'timed out': False, 'usage': history.get_usage(None)})
+            return
+        finally:
+            # only the tool holds the pipe open, so it reads as ended once the tool's done with it
+            os.close(input_side)
+        self._processes.add(process)
+        exit_fd = None
+        try:
+            exit_fd = processes.open_exit_fd(process)
+            timed_out = self._stream_output(channel, output_side, process=process, exit_fd=exit_fd, limits=limits)
+            if timed_out is None:
+                return
+            rusage = processes.reap(process, block=True)
+            channel.send({
+                'event': 'exit',
+                'return code': process.returncode,
+                'timed out': timed_out,
+                'usage': history.get_usage(rusage, spawn_rss=spawn_rss),
+            })
+        finally:
+            if process.returncode is None:
+                processes.kill(process)
+            self._processes.discard(process)
+            os.close(output_side)
+            if exit_fd is not None:
+                os.close(exit_fd)
+
+    @staticmethod
+    def _stream_output(channel, output_side, *, process, exit_fd, limits):
+        """
+        Stream the tool's output over the channel, until it exits.
+
+        Returns whether or not the tool was killed for timing out, or None, if it was killed
+        because the client hung up.
+        """
+        started = time.monotonic()
+        fds = [output_side, channel.fileno()] + ([exit_fd] if exit_fd is not None else [])
+
+        def send():
+            """Send what's waiting in the output over the channel, and return whether there was any."""
+            data = os.read(output_side, _READ_BYTES)
+            if data:
+                channel.send({'event': 'output'}, data)
+            return bool(data)
+
+        while True:
+            timeout, timed_out = processes.get_wait_timeout(process, exit_fd=exit_fd, started=started, limits=limits)
+            if timed_out:
+                return True
+            readable, _writable, _exceptional = select.select(fds, [], [], timeout)
+            if channel.fileno() in readable:
+                os.killpg(process.pid, signal.SIGKILL)
+                return None
+            if output_side in readable:
+                if not send():
+                    return False
+            elif exit_fd in readable or (exit_fd is None and processes.has_exited(process)):
+                # the tool may have written more before it exited than has been read yet
+                processes.drain(output_side, send)
+                return False
+
+
+# [ Internal ]
+class _Channel:
+    """A connection, as a channel of messages."""
+
+    def __init__(self, connection):
+        """Init the state."""
+        self._connection = connection
+        self._reader = remote.MessageReader()
+        self._messages = []
+
+    # [ API ]
+    def fileno(self):
+        """Get the connection's file descriptor."""
+        return self._connection.fileno()
+
+    def receive(self):
+        """Receive the next message, and its payload, or Nones, once the connection's closed."""
+        while not self._messages:
+            data = self._connection.recv(_READ_BYTES)
+            if not data:
+                return None, None
+            self._messages += self._reader.feed(data)
+        return self._messages.pop(0)
+
+    def send(self, message, payload=None):
+        """Send the message, with its payload, if it has one."""
+        self._connection.sendall(remote.encode_message(message, payload))
+
+
+# [ Main ]
+if __name__ == '__main__':
+    sys.exit(main())
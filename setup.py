@@ -70,5 +70,21 @@ setup(
         'pocketwalk_cancellation': [
             'cancellation = pocketwalk.plugins.cancellation:get_cancellation',
         ],
+        'pocketwalk_resultcache': [
+            'result_cache = pocketwalk.plugins.result_cache:get_result_cache',
+        ],
+        'pocketwalk_watcher': [
+            'watcher = pocketwalk.plugins.watcher:get_watcher',
+        ],
+        'pocketwalk_cachebackend': [
+            'directory = pocketwalk.plugins.cache_backends:get_directory_backend',
+            'http = pocketwalk.plugins.cache_backends:get_http_backend',
+        ],
+        'pocketwalk_executor': [
+            'remote = pocketwalk.plugins.remote:get_remote_executor',
+        ],
+        'pocketwalk_reporter': [
+            'log = pocketwalk.plugins.reporters:get_log_reporter',
+        ],
     },
 )
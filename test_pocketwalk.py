@@ -22,21 +22,73 @@ Features:
     * if not single run, repeat tools forever, waiting for conditions to change between runs
     * cancel running tools and report cancelled and last aggregate result (max RC)
     * VCS commit
+    * report tools killed for exceeding resource limits (test_failure_reason)
+    * never leave a tool running without its resource limits (test_spawn)
+    * replay a summary and the tail of unchanged tools' output (test_tail_lines, test_output_writer)
+    * show the full output of a tool on request (test_split_cli_args)
+    * replay results for any previously checked state, within a size-capped cache (test_select_evictions, test_save_result)
+    * share results through pluggable shared caches (test_http_backend, test_directory_backend)
+    * share results between checkouts, rejecting corrupt ones (test_payload_round_trip, test_parse_result)
+    * only check target content which hasn't been checked before (test_get_targets)
+    * only check targets which transitively import a changed module (test_parse_imports, test_import_closure, test_fold_in_imports)
+    * only run the tests which executed changed lines (test_decode_numbits, test_changed_lines, test_prune_test_ids, test_record_without_coverage_data)
+    * render concurrent tools' output a whole line at a time, with a status line (test_format_lines, test_status)
+    * send everything bound for the terminal through the renderer, started or not (test_unstarted_renderer)
+    * capture piped output without passing it through python (test_adopt_raw_output)
+    * compare contexts, and find affected files, by Merkle tree (test_merkle_changed_paths, test_merkle_update, test_tagged_contexts,
+      test_file_maps_follow_file_sets)
+    * serve the watch loop to clients from a daemon (test_daemon_events, test_daemon_bad_requests, test_daemon_slow_client)
+    * watch several projects from one process, sharing tool slots fair-share (test_select_grant, test_project_labels)
+    * run once as a batch, starting each tool as soon as its preconditions pass (test_split_batch)
+    * report results as JUnit XML and JSON (test_junit_report)
+    * stage commits of any size in bulk, showing a diffstat first (test_parse_status)
+    * run tools against snapshots of their files, letting stale runs finish into the cache (test_snapshot)
+    * poll idle paths less and less often, and changed ones often again, without a file watcher (test_next_poll_interval, test_watch_tracked_paths)
+    * record every tool run's time, CPU, memory, and outcome, and report percentiles per tool (test_get_percentile)
+    * fail tools on output patterns, and filter noise out of their output, as it streams (test_output_rules)
+    * save results behind the event loop, in order, atomically, reading queued results back (test_writer)
+    * glob from each pattern's literal prefix, pruning .gitignored and excluded directories (test_ignore_rules)
+    * watch only the directories globbing looks inside, and those of tracked paths (test_watch_ignored_directories)
+    * run tools, or shards of their targets, on workers, shipping only unseen content (test_message_reader, test_split_shards, test_remote_executor)
+    * send structured events to reporter plugins, in batches, off the loop (test_format_args, test_events)
+    * keep tool states and the VCS phase in a store, updated and notified as they change (test_state_store)
 """
 
 
 # [ Imports ]
 # [ -Python ]
+import asyncio
 import enum
+import hashlib
+import http.server
+import io
+import json
+import os
+import pathlib
+import selectors
+import socket
+import subprocess
+import tempfile
+import threading
 import typing
 import sys
-from unittest.mock import sentinel, MagicMock
+import xml.etree.ElementTree as ElementTree
+import zlib
+from unittest.mock import sentinel, MagicMock, patch
 # [ -Third Party ]
 import dado
 from runaway import signals, testing, handlers
 import utaw
 # [ -Project ]
-from pocketwalk.core import Core
+from pocketwalk.core import Core, get_project_labels, split_batch
+from pocketwalk import daemon, reactor, worker
+from pocketwalk.plugins import (
+    cache_backends, context_manager, coverage_map, digests, events, globbing, history, import_graph, merkle, output_rules, output_store, persistence, processes, remote, renderer, reporters, reports, result_cache,
+    scheduler, snapshots, state_store, vcs, watcher,
+)
+from pocketwalk.plugins.config import Config
+from pocketwalk.plugins.shard_runner import split_shards
+from pocketwalk.plugins.tool_runner import ToolRunner, format_args
 
 
 # pylint: disable=protected-access
@@ -68,8 +120,11 @@ def test_should_loop(cancelled, loop_forever, vcs_running, loop_till_pass, all_t
     config = MagicMock()
     vcs = MagicMock()
     cancellation = MagicMock()
-    core = Core(context_manager=None, tool_runner=tool_runner, config=config, vcs=vcs, cancellation=cancellation)
-    tester = Tester(core._should_loop).called_with_args(sentinel.tools)
+    core = Core(
+        context_manager=None, tool_runner=tool_runner, config=config, vcs=vcs, cancellation=cancellation, result_cache=None,
+        watcher=None, state=MagicMock(),
+    )
+    tester = Tester(core.should_loop).called_with_args(sentinel.tools)
     tester.calls(cancellation.cancelled).with_args()
     tester.receives(cancelled)
     if cancelled:
@@ -85,7 +140,7 @@ def test_should_loop(cancelled, loop_forever, vcs_running, loop_till_pass, all_t
     tester.calls(config.loop_till_pass).with_args()
     tester.receives(loop_till_pass)
     if loop_till_pass:
-        tester.calls(tool_runner.all_tools_passed).with_args(sentinel.tools)
+        tester.calls(tool_runner.all_tools_passed).with_args()
         tester.receives(all_tools_passed)
         if not all_tools_passed:
             return tester.returns(result)
@@ -94,6 +149,837 @@ def test_should_loop(cancelled, loop_forever, vcs_running, loop_till_pass, all_t
     return tester.returns(result)
 
 
+@dado.data_driven(['return_code', 'limits', 'timed_out', 'usage', 'normalized', 'reason'], {
+    'passed': [0, {}, False, None, 0, None],
+    'failed': [1, {}, False, None, 1, None],
+    'timed_out': [-9, {'timeout': 5}, True, None, 124, "timed out after 5s"],
+    'cpu_limit': [-24, {'max cpu time': 3}, False, None, 152, "exceeded the CPU time limit of 3s"],
+    'cpu_hard_limit': [
+        -9, {'max cpu time': 3}, False, {'user seconds': 3.5, 'system seconds': 0.5}, 137, "exceeded the CPU time limit of 3s",
+    ],
+    'killed_under_cpu_limit': [-9, {'max cpu time': 3}, False, {'user seconds': 1.0, 'system seconds': None}, 137, "killed by SIGKILL"],
+    'memory_limit': [-11, {'max memory': 10}, False, None, 139, "killed by SIGSEGV, with a memory limit of 10 MB"],
+    'signal': [-15, {}, False, None, 143, "killed by SIGTERM"],
+})
+def test_failure_reason(return_code, limits, timed_out, usage, normalized, reason):
+    """Test the failure reasons reported for tools killed by resource limits."""
+    utaw.assertEqual(ToolRunner._normalize_return_code(return_code, timed_out=timed_out), normalized)
+    utaw.assertEqual(ToolRunner._get_failure_reason(normalized, limits=limits, timed_out=timed_out, usage=usage), reason)
+
+
+@dado.data_driven(['argv', 'command', 'arguments', 'options'], {
+    'no_args': [[], 'watch', [], []],
+    'options_only': [['--run', 'once'], 'watch', [], ['--run', 'once']],
+    'show': [['show', 'pytest'], 'show', ['pytest'], []],
+    'show_with_options': [['show', 'pytest', '--no-vcs'], 'show', ['pytest'], ['--no-vcs']],
+})
+def test_split_cli_args(argv, command, arguments, options):
+    """Test splitting the command from the CLI options."""
+    utaw.assertEqual(Config._split_cli_args(argv), (command, arguments, options))
+
+
+@dado.data_driven(['data', 'lines', 'tail'], {
+    'more_than_asked': [b'a\nb\nc\n', 2, b'b\nc\n'],
+    'fewer_than_asked': [b'a\nb\n', 5, b'a\nb\n'],
+    'partial_last_line': [b'a\nb\nc', 2, b'b\nc'],
+    'none_asked': [b'a\n', 0, b''],
+})
+def test_tail_lines(data, lines, tail):
+    """Test getting the tail of replayed output."""
+    utaw.assertEqual(output_store.tail_lines(data, lines=lines), tail)
+
+
+def test_adopt_raw_output():
+    """Test indexing output written straight to a file, for replay."""
+    with tempfile.TemporaryDirectory() as output_dir:
+        pending = pathlib.Path(output_dir) / 'tool.pending'
+        pending.write_bytes(b'line\n' * 20000)
+        output_store.adopt_raw_output(pending, pathlib.Path(output_dir) / 'tool.output')
+        utaw.assertFalse(pending.exists())
+        utaw.assertEqual(output_store.load_summary(pathlib.Path(output_dir) / 'tool.output'), {'size': 100000, 'lines': 20000})
+        utaw.assertEqual(output_store.read_tail(pathlib.Path(output_dir) / 'tool.output', lines=2), b'line\nline\n')
+
+
+def test_output_writer():
+    """Test that output is put in place with its index in one step, and that unindexed output is still read."""
+    with tempfile.TemporaryDirectory() as output_dir:
+        path = pathlib.Path(output_dir) / 'tool.output'
+        output_store.save_output(path, b'old\n')
+        writer = output_store.OutputWriter(path)
+        writer.write(b'new line\n' * 20000)
+        # cut short before it's closed, so the old output is left as it was
+        writer.discard()
+        utaw.assertEqual(output_store.read_tail(path, lines=5), b'old\n')
+        output_store.save_output(path, b'new line\n' * 20000)
+        utaw.assertEqual(output_store.load_summary(path), {'size': 180000, 'lines': 20000})
+        streamed = io.BytesIO()
+        output_store.stream_output(path, streamed)
+        utaw.assertEqual(streamed.getvalue(), b'new line\n' * 20000)
+        utaw.assertEqual(sorted(p.name for p in pathlib.Path(output_dir).iterdir()), ['tool.output'])
+        path.write_bytes(b'unindexed\n')
+        utaw.assertEqual(output_store.read_tail(path, lines=1), b'unindexed\n')
+
+
+def test_snapshot():
+    """Test that snapshots link the content they were hashed with, which is never copied from a file which changed since."""
+    with tempfile.TemporaryDirectory() as root:
+        root = pathlib.Path(root)
+        (root / 'pkg').mkdir()
+        (root / 'pkg' / 'a.py').write_bytes(b'a = 1\n')
+        file_hashes = {str(root / 'pkg' / 'a.py'): hashlib.sha1(b'a = 1\n').hexdigest()}
+        store = snapshots.ObjectStore(root / 'objects')
+        utaw.assertTrue(snapshots.build_snapshot(file_hashes, root=root, store=store, destination=root / 'snap'))
+        (root / 'pkg' / 'a.py').write_bytes(b'a = 2\n')
+        utaw.assertEqual((root / 'snap' / 'pkg' / 'a.py').read_bytes(), b'a = 1\n')
+        # the hashed content is still in the store, so a snapshot of it can still be built
+        utaw.assertTrue(snapshots.build_snapshot(file_hashes, root=root, store=store, destination=root / 'again'))
+        utaw.assertEqual((root / 'again' / 'pkg' / 'a.py').read_bytes(), b'a = 1\n')
+        snapshots.remove_snapshot(root / 'again')
+        empty_store = snapshots.ObjectStore(root / 'empty')
+        utaw.assertFalse(snapshots.build_snapshot(file_hashes, root=root, store=empty_store, destination=root / 'stale'))
+        utaw.assertFalse((root / 'stale').exists())
+        store.prune(max_bytes=0)
+        utaw.assertEqual((root / 'snap' / 'pkg' / 'a.py').stat().st_nlink, 2)
+        snapshots.remove_snapshot(root / 'snap')
+        store.prune(max_bytes=0)
+        utaw.assertEqual(list((root / 'objects').glob('*/*')), [])
+
+
+def test_writer():
+    """Test that the writer writes in order, reads back what it's yet to write, and leaves no staging files."""
+    with tempfile.TemporaryDirectory() as root:
+        root = pathlib.Path(root)
+        writer = persistence.Writer()
+        blocker = threading.Event()
+        # holds the writer thread up, so the writes after it queue up behind it
+        writer.replace(root / 'first', lambda: blocker.wait() and 'first')
+        writer.replace(root / 'a' / 'record', 'one')
+        writer.append(root / 'log', 'x\n')
+        utaw.assertTrue(writer.exists(root / 'a' / 'record'))
+        utaw.assertEqual(writer.read_text(root / 'a' / 'record'), 'one')
+        writer.replace(root / 'a' / 'record', lambda: 'two')
+        utaw.assertEqual(writer.read_text(root / 'a' / 'record'), 'two')
+        blocker.set()
+        writer.append(root / 'log', 'y\n')
+        writer.flush()
+        utaw.assertEqual((root / 'first').read_text(), 'first')
+        utaw.assertEqual((root / 'a' / 'record').read_text(), 'two')
+        utaw.assertEqual((root / 'log').read_text(), 'x\ny\n')
+        utaw.assertEqual(sorted(p.name for p in (root / 'a').iterdir()), ['record'])
+
+
+@dado.data_driven(['entries', 'max_bytes', 'evictions'], {
+    'under_cap': [[(1, 10, 'a'), (2, 10, 'b')], 20, []],
+    'over_cap': [[(3, 10, 'a'), (1, 10, 'b'), (2, 10, 'c')], 15, ['b', 'c']],
+    'empty': [[], 0, []],
+})
+def test_select_evictions(entries, max_bytes, evictions):
+    """Test that the least recently used results are evicted first."""
+    utaw.assertEqual(result_cache.select_evictions(entries, max_bytes=max_bytes), evictions)
+
+
+@dado.data_driven(['old', 'new', 'changed'], {
+    'unchanged': [{'/r/a.py': '1', '/r/b/c.py': '2'}, {'/r/a.py': '1', '/r/b/c.py': '2'}, []],
+    'changed_nested': [{'/r/a.py': '1', '/r/b/c.py': '2'}, {'/r/a.py': '1', '/r/b/c.py': '3'}, ['/r/b/c.py']],
+    'added': [{'/r/a.py': '1'}, {'/r/a.py': '1', '/r/b/d.py': '4'}, ['/r/b/d.py']],
+    'removed': [{'/r/a.py': '1', '/r/b/c.py': '2'}, {'/r/a.py': '1'}, []],
+    'outside_root': [{'/x/e.py': '5'}, {'/x/e.py': '6'}, ['/x/e.py']],
+})
+def test_merkle_changed_paths(old, new, changed):
+    """Test finding the files which changed between Merkle trees."""
+    old_tree = merkle.MerkleTree.from_hashes(old, root='/r')
+    new_tree = merkle.MerkleTree.from_hashes(new, root='/r')
+    utaw.assertEqual(sorted(new_tree.changed_paths(old_tree)), changed)
+    utaw.assertEqual(old_tree.hash == new_tree.hash, old == new)
+
+
+def test_merkle_update():
+    """Test that updating a Merkle tree by its changes matches building it afresh."""
+    old = {'/r/a.py': '1', '/r/b/c.py': '2', '/r/b/d/e.py': '3'}
+    new = {'/r/a.py': '1', '/r/b/c.py': '4', '/r/f.py': '5'}
+    updated = merkle.MerkleTree.from_hashes(old, root='/r').updated({'/r/b/c.py': '4', '/r/b/d/e.py': None, '/r/f.py': '5'})
+    utaw.assertEqual(updated.hash, merkle.MerkleTree.from_hashes(new, root='/r').hash)
+    utaw.assertEqual(merkle.MerkleTree.from_hashes(new, root='/r').hash, merkle.MerkleTree.from_hashes(
+        {'/s/a.py': '1', '/s/b/c.py': '4', '/s/f.py': '5'}, root='/s',
+    ).hash)
+
+
+@dado.data_driven(['event'], {
+    'output': [{'event': 'output', 'data': b'\x1b[32mpassed\xff\n'}],
+    'state': [{'event': 'state', 'tools': {'pytest': {'running': True, 'return code': None, 'failure reason': None}}}],
+    'request': [{'op': 'rerun', 'tools': ['pytest']}],
+})
+def test_daemon_events(event):
+    """Test that daemon events and requests round-trip as lines of JSON, whatever bytes the output holds."""
+    line = daemon.encode_event(event)
+    utaw.assertEqual(line.count(b'\n'), 1)
+    utaw.assertEqual(daemon.decode_event(line.rstrip(b'\n')), event)
+
+
+@dado.data_driven(['request', 'dropped'], {
+    'valid': [b'{"op": "state"}\n', False],
+    'not_json': [b'not json\n', True],
+    'no_op': [b'{"tools": []}\n', True],
+    'not_an_object': [b'[1, 2]\n', True],
+    'rerun_list': [b'{"op": "rerun", "tools": ["flake8"]}\n', False],
+    'rerun_string': [b'{"op": "rerun", "tools": "flake8"}\n', True],
+    'no_newline': [b'x' * (64 * 1024 + 1), True],
+})
+def test_daemon_bad_requests(request, dropped):
+    """Test that a client sending a malformed request is dropped, rather than the server."""
+    server = daemon.Server()
+    served, client = socket.socketpair()
+    with client:
+        served.setblocking(False)
+        server._clients[served] = {'incoming': b'', 'outgoing': b''}
+        server._selector.register(served, selectors.EVENT_READ)
+        client.sendall(request)
+        with patch('pocketwalk.reactor.notify'):
+            # read until there's nothing left to read, or the client's dropped
+            while served in server._clients and server._selector.select(0):
+                server._read_requests(served)
+        utaw.assertEqual(served not in server._clients, dropped)
+        served.close()
+
+
+def test_daemon_slow_client():
+    """Test that the server queues what a client isn't taking yet, rather than blocking, and drops a client too far behind."""
+    server = daemon.Server()
+    served, client = socket.socketpair()
+    with client:
+        served.setblocking(False)
+        server._clients[served] = {'incoming': b'', 'outgoing': b''}
+        server._selector.register(served, selectors.EVENT_READ)
+        event = {'event': 'output', 'data': b'x' * 65536}
+        while server._clients.get(served, {}).get('outgoing', b'') == b'':
+            server._send(served, event)
+        utaw.assertEqual(server._selector.get_key(served).events, selectors.EVENT_READ | selectors.EVENT_WRITE)
+        while served in server._clients:
+            server._send(served, event)
+        utaw.assertTrue(served._closed)
+
+
+@dado.data_driven(['waiting', 'running', 'granted'], {
+    'nothing_waiting': [{'a': 0, 'b': 0}, {'a': 1}, None],
+    'fewest_running': [{'a': 2, 'b': 1}, {'a': 3, 'b': 1}, 'b'],
+    'none_running': [{'a': 1, 'b': 1}, {'a': 1}, 'b'],
+    'tie_goes_first': [{'b': 1, 'a': 1}, {'a': 1, 'b': 1}, 'b'],
+})
+def test_select_grant(waiting, running, granted):
+    """Test that a free tool slot goes to the waiting project with the fewest tools running."""
+    utaw.assertEqual(scheduler.select_grant(waiting, running), granted)
+
+
+@dado.data_driven(['interval', 'changed', 'ceiling', 'expected'], {
+    'idle': [0.25, False, 8, 0.5],
+    'idle_at_ceiling': [8, False, 8, 8],
+    'idle_past_ceiling': [4, False, 6, 6],
+    'changed': [8, True, 8, 0.25],
+    'ceiling_below_min': [0.25, False, 0, 0.25],
+})
+def test_next_poll_interval(interval, changed, ceiling, expected):
+    """Test that a path's poll interval backs off while it's idle, up to the ceiling, and snaps back when it changes."""
+    utaw.assertEqual(watcher.next_poll_interval(interval, changed=changed, ceiling=ceiling), expected)
+
+
+def test_watch_tracked_paths():
+    """Test that tracked paths are matched as absolute paths, and that hidden ones, and their directories, are watched."""
+    with tempfile.TemporaryDirectory() as root:
+        config = {
+            'root': root, 'config_path': f'{root}/.pocketwalk.toml', 'tools': ['lint'], 'poll_max': 1, 'exclude': [],
+            'no_gitignore': False, 'lint_targets': ['a.py'], 'lint_triggers': ['.pylintrc', '.github/lint.yml'],
+        }
+        watching = watcher.Watcher()
+        reactor.run(watching.watch(config))
+        tracked, directories = watching._tracked, watching._directories
+    utaw.assertEqual(tracked, {f'{root}/.pocketwalk.toml', f'{root}/a.py', f'{root}/.pylintrc', f'{root}/.github/lint.yml'})
+    utaw.assertEqual(directories, {root, f'{root}/.github'})
+
+
+def test_watch_ignored_directories():
+    """Test that excluded and .gitignored directories aren't watched, but for those of tracked paths."""
+    with tempfile.TemporaryDirectory() as root:
+        for this_dir in ('src/app', 'node_modules/pkg', 'build/lib', 'venv/lib'):
+            os.makedirs(os.path.join(root, this_dir))
+        pathlib.Path(root, '.gitignore').write_text('node_modules/\nvenv/\n', encoding='utf-8')
+        config = {
+            'root': root, 'config_path': f'{root}/.pocketwalk.toml', 'tools': ['lint'], 'poll_max': 1, 'exclude': ['/build'],
+            'no_gitignore': False, 'lint_targets': ['src/app/a.py'], 'lint_triggers': ['venv/lib/lint.cfg'],
+        }
+        watching = watcher.Watcher()
+        reactor.run(watching.watch(config))
+        directories = watching._directories
+    utaw.assertEqual(directories, {root, f'{root}/src', f'{root}/src/app', f'{root}/venv/lib'})
+
+
+@dado.data_driven(['values', 'percent', 'expected'], {
+    'none': [[], 50, None],
+    'one': [[3.0], 90, 3.0],
+    'median_of_odd': [[5, 1, 3], 50, 3],
+    'median_of_even': [[4, 1, 3, 2], 50, 2],
+    'p90': [list(range(1, 11)), 90, 9],
+    'max': [list(range(1, 11)), 100, 10],
+    'min': [list(range(1, 11)), 0, 1],
+})
+def test_get_percentile(values, percent, expected):
+    """Test that percentiles of run times are taken by nearest rank."""
+    utaw.assertEqual(history.get_percentile(values, percent), expected)
+
+
+@dado.data_driven(['chunks', 'kept', 'failure', 'filtered'], {
+    'partial_lines_held': [[b'a\nb', b'c\n'], b'a\nbc\n', None, 0],
+    'filtered_across_chunks': [[b'ok\nnoi', b'se here\r\nok\n'], b'ok\nok\n', None, 1],
+    'filtered_unterminated': [[b'ok\nnoise'], b'ok\n', None, 1],
+    'anchored_per_line': [[b'x noise\nnoise x\n'], b'x noise\n', None, 1],
+    'fail_on': [[b'ok\nE   boom\nmore\n'], b'ok\nE   boom\nmore\n', 'E   boom', 0],
+    'fail_on_filtered_line': [[b'noise E   boom\n'], b'', None, 1],
+})
+def test_output_rules(chunks, kept, failure, filtered):
+    """Test that output rules filter noisy lines, and spot failing lines, across chunk boundaries."""
+    rules = output_rules.OutputRules(fail_on=['^E +boom'], filter_out=['^noise'] if filtered else [])
+    output = b''.join(rules.feed(c) for c in chunks) + rules.flush()
+    utaw.assertEqual(output, kept)
+    utaw.assertEqual(rules.failure, failure)
+    utaw.assertEqual(rules.filtered, filtered)
+
+
+@dado.data_driven(['lines', 'path', 'is_dir', 'ignored'], {
+    'unanchored_name': [['*.pyc'], 'a/b/c.pyc', False, True],
+    'anchored': [['/build'], 'a/build', True, False],
+    'anchored_at_root': [['/build'], 'build', True, True],
+    'directories_only': [['venv/'], 'venv', False, False],
+    'directories_only_dir': [['venv/'], 'src/venv', True, True],
+    'negated': [['gen_*.py', '!gen_keep.py'], 'gen_keep.py', False, False],
+    'double_star': [['docs/**/*.txt'], 'docs/a/b/c.txt', False, True],
+    'comment': [['#x'], '#x', False, False],
+    'always_ignored': [[], '.pocketwalk.cache', True, True],
+})
+def test_ignore_rules(lines, path, is_dir, ignored):
+    """Test that .gitignore patterns are matched as git matches them, the last matching pattern winning."""
+    with tempfile.TemporaryDirectory() as root:
+        pathlib.Path(root, '.gitignore').write_text('\n'.join(lines), encoding='utf-8')
+        ignore_rules = globbing.IgnoreRules(root)
+        rules = ignore_rules.get_rules(pathlib.Path(root), parent_rules=None)
+        utaw.assertEqual(ignore_rules.is_ignored(path, is_dir=is_dir, rules=rules), ignored)
+
+
+@dado.data_driven(['chunks'], {
+    'whole': [[b'{"a": 1}\n{"b": 2, "size": 3}\nx\ny']],
+    'split_header': [[b'{"a"', b': 1}\n{"b": 2, "size": 3}\nx\ny']],
+    'split_payload': [[b'{"a": 1}\n{"b": 2, "size": 3}\nx', b'\ny']],
+    'bytewise': [[bytes([b]) for b in b'{"a": 1}\n{"b": 2, "size": 3}\nx\ny']],
+})
+def test_message_reader(chunks):
+    """Test that messages, and their payloads, are read whole, however the stream's split up."""
+    reader = remote.MessageReader()
+    messages = [m for c in chunks for m in reader.feed(c)]
+    utaw.assertEqual(messages, [({'a': 1}, b''), ({'b': 2, 'size': 3}, b'x\ny')])
+
+
+@dado.data_driven(['targets', 'count', 'shards'], {
+    'no_targets': [[], 4, [[]]],
+    'fewer_targets': [['a', 'b'], 4, [['a'], ['b']]],
+    'dealt_in_turn': [['a', 'b', 'c', 'd', 'e'], 2, [['a', 'c', 'e'], ['b', 'd']]],
+    'one_shard': [['a', 'b'], 1, [['a', 'b']]],
+})
+def test_split_shards(targets, count, shards):
+    """Test that targets are dealt out between shards, and that there's always a shard to run."""
+    utaw.assertEqual(split_shards(targets, count=count), shards)
+
+
+def test_remote_executor():
+    """Test that shards run on a worker, against the files shipped to it, streaming their output back."""
+    with tempfile.TemporaryDirectory() as directory:
+        root = pathlib.Path(directory, 'project')
+        (root / 'src').mkdir(parents=True)
+        file_hashes = {}
+        for name, content in (('a', b'alpha\n'), ('b', b'beta\n')):
+            (root / 'src' / name).write_bytes(content)
+            file_hashes[f'src/{name}'] = hashlib.sha1(content).hexdigest()
+        socket_path = str(pathlib.Path(directory, 'worker.sock'))
+        serving = worker.Worker(store_path=pathlib.Path(directory, 'worker'), jobs=2, store_bytes=1024 * 1024)
+        threading.Thread(target=serving.serve, args=(f'unix:{socket_path}',), daemon=True).start()
+        while not pathlib.Path(socket_path).exists():
+            pass
+        executor = remote.RemoteExecutor()
+        executor.configure({'tools': ['cat'], 'cat_remote': True, 'workers': [f'unix:{socket_path}'], 'root': str(root)})
+        output = {0: b'', 1: b''}
+
+        def on_output(index, data):
+            output[index] += data
+            return True
+
+        results = reactor.run(executor.run(
+            'cat', root=root, shards=[['cat', 'src/a'], ['cat', 'src/b', 'src/c']], file_hashes=file_hashes, limits={},
+            on_output=on_output,
+        ))
+        executor.close()
+    utaw.assertEqual(output[0], b'alpha\n')
+    utaw.assertTrue(output[1].startswith(b'beta\n'))
+    utaw.assertEqual([r['return code'] for r in results], [0, 1])
+
+
+@dado.data_driven(['args', 'formatted'], {
+    'short': [['flake8', 'a.py'], 'flake8 a.py'],
+    'quoted': [['flake8', 'a b.py'], "flake8 'a b.py'"],
+    'long': [['pytest'] + [f'{i}.py' for i in range(20)], 'pytest ' + ' '.join(f'{i}.py' for i in range(9)) + ' ... (+11 more)'],
+})
+def test_format_args(args, formatted):
+    """Test that only the first few args of a run are formatted."""
+    utaw.assertEqual(format_args(args), formatted)
+
+
+def test_events():
+    """Test that events are only queued for projects with a reporter enabled, and sent in order, noting any dropped."""
+    with tempfile.TemporaryDirectory() as directory:
+        log_path = pathlib.Path(directory, 'events.log')
+        queue = events.Events(reporters=[reporters.LogReporter()], max_queued=2)
+        queue.configure({'root': '/logged', 'report_log': str(log_path)})
+        queue.configure({'root': '/unlogged', 'report_log': None})
+        # held, so the events queue up behind the send
+        with queue._condition:  # pylint: disable=protected-access
+            for this_event in range(3):
+                queue.emit('/logged', {'event': 'tool started', 'run': this_event})
+            queue.emit('/unlogged', {'event': 'tool started', 'run': 3})
+        queue.flush()
+        logged = [json.loads(line) for line in log_path.read_text(encoding='utf-8').splitlines()]
+    utaw.assertEqual([(e['event'], e.get('run'), e.get('count')) for e in logged], [('events dropped', None, 1), ('tool started', 1, None), ('tool started', 2, None)])
+    utaw.assertEqual({e['root'] for e in logged}, {'/logged'})
+
+
+_PASSED = {'running': False, 'return code': 0, 'failure reason': None}
+_FAILED = {'running': False, 'return code': 1, 'failure reason': None}
+_RUNNING = {'running': True, 'return code': None, 'failure reason': None}
+
+
+@dado.data_driven(['steps', 'states', 'running', 'failed', 'passed', 'transitions'], {
+    'nothing_run': [[], {}, False, False, False, 0],
+    'running': [[('set_running', 'a')], {'a': _RUNNING}, True, False, False, 1],
+    'passed': [[('set_running', 'a'), ('set_result', 'a', 0), ('set_stopped', 'a')], {'a': _PASSED}, False, False, False, 2],
+    'all_passed': [[('set_result', 'a', 0), ('set_result', 'b', 0)], {'a': _PASSED, 'b': _PASSED}, False, False, True, 2],
+    'failed': [[('set_result', 'a', 1), ('set_result', 'b', 0)], {'a': _FAILED, 'b': _PASSED}, False, True, False, 2],
+    'rerun_after_failing': [[('set_result', 'a', 1), ('set_running', 'a')], {'a': _RUNNING}, True, False, False, 2],
+    'stopped_without_result': [[('set_running', 'a'), ('set_stopped', 'a')], {}, False, False, False, 2],
+    'stopped_keeps_result': [[('set_running', 'a'), ('set_result', 'a', 0), ('set_stopped', 'b')], {'a': _RUNNING}, True, False, False, 1],
+    'unchanged_result': [[('set_result', 'a', 1), ('set_result', 'a', 1)], {'a': _FAILED}, False, True, False, 1],
+})  # pylint: disable=too-many-arguments
+def test_state_store(steps, states, running, failed, passed, transitions):
+    """Test that the aggregates follow each change, and that subscribers are only notified of real transitions."""
+    store = state_store.StateStore()
+    store.configure(['a', 'b'])
+    notified = []
+    store.subscribe(lambda *transition: notified.append(transition))
+    for method, tool, *return_code in steps:
+        if return_code:
+            getattr(store, method)(tool, return_code=return_code[0])
+        else:
+            getattr(store, method)(tool)
+    utaw.assertEqual(store.get_tool_states(), states)
+    utaw.assertEqual((store.any_running(), store.any_failed(), store.all_passed()), (running, failed, passed))
+    utaw.assertEqual(len(notified), transitions)
+
+
+@dado.data_driven(['pending', 'tool_state', 'ready', 'blocked'], {
+    'no_preconditions': [{'b': []}, {}, ['b'], []],
+    'passed': [{'b': ['a']}, {'a': _PASSED}, ['b'], []],
+    'running': [{'b': ['a']}, {'a': _RUNNING}, [], []],
+    'failed': [{'b': ['a']}, {'a': _FAILED, 'c': _RUNNING}, [], ['b']],
+    'never_ran': [{'b': ['a']}, {'c': _RUNNING}, [], ['b']],
+    'waiting_on_pending': [{'b': ['p'], 'p': ['a']}, {'a': _RUNNING}, [], []],
+    'cycle': [{'b': ['p'], 'p': ['b']}, {'a': _PASSED}, [], ['b', 'p']],
+})
+def test_split_batch(pending, tool_state, ready, blocked):
+    """Test that batch tools are ready once their preconditions pass, and blocked once any can't."""
+    split_ready, split_blocked = split_batch({t: {'preconditions': p} for t, p in pending.items()}, tool_state=tool_state)
+    utaw.assertEqual(sorted(split_ready), ready)
+    utaw.assertEqual(sorted(split_blocked), blocked)
+
+
+@dado.data_driven(['roots', 'labels'], {
+    'distinct_names': [['/x/api', '/x/web'], ['api', 'web']],
+    'same_names': [['/a/app', '/b/app', '/c/lib'], ['a/app', 'b/app', 'lib']],
+    'same_parents': [['/a/x/app', '/b/x/app'], ['a/x/app', 'b/x/app']],
+    'nested': [['/app', '/a/app'], ['/app', 'a/app']],
+    'filesystem_root': [['/'], ['/']],
+})
+def test_project_labels(roots, labels):
+    """Test that workspace projects are labelled by as much of their roots as it takes to tell them apart."""
+    utaw.assertEqual(list(get_project_labels(roots).values()), labels)
+
+
+def test_junit_report():
+    """Test that failed and skipped tools are reported as such, as valid XML, whatever the output holds."""
+    results = reports.get_results(
+        ['flake8', 'pylint', 'pytest'],
+        tool_state={'flake8': _PASSED, 'pylint': dict(_FAILED, **{'failure reason': 'timed out'})},
+        durations={'flake8': 1.23456},
+        tails={'pylint': '\x1b[31mE501\x1b[0m\n'},
+    )
+    suite = ElementTree.fromstring(reports.format_junit(results, name='project'))
+    utaw.assertEqual((suite.get('tests'), suite.get('failures'), suite.get('skipped')), ('3', '1', '1'))
+    utaw.assertEqual(suite.find("testcase[@name='flake8']").get('time'), '1.235')
+    utaw.assertEqual(suite.find("testcase[@name='pylint']/failure").get('message'), 'RC 1 (timed out)')
+    utaw.assertEqual(suite.find("testcase[@name='pylint']/failure").text, '[31mE501[0m\n')
+    utaw.assertIsNotNone(suite.find("testcase[@name='pytest']/skipped"))
+
+
+@dado.data_driven(['output', 'parsed'], {
+    'empty': [b'', []],
+    'modified_and_untracked': [b' M a.py\0?? new dir/\0', [(' M', 'a.py'), ('??', 'new dir/')]],
+    'renamed': [b'R  new.py\0old.py\0D  gone.py\0', [('R ', 'new.py'), ('D ', 'gone.py')]],
+})
+def test_parse_status(output, parsed):
+    """Test that NUL-separated git status is parsed whatever the paths hold, skipping renames' original paths."""
+    utaw.assertEqual(vcs.parse_status(output), parsed)
+
+
+def test_tagged_contexts():
+    """Test that tagging contexts with their affected files leaves the contexts themselves unmodified."""
+    def make_context(target_files):
+        fields = {
+            'target files': target_files, 'trigger files': {}, 'config': [], 'preconditions': [], 'limits': {},
+            'affected by': 'content', 'coverage': {}, 'output rules': {},
+        }
+        return context_manager.Context(fields, trees={
+            k: merkle.MerkleTree.from_hashes(fields[k], root='/r') for k in ('target files', 'trigger files')
+        })
+
+    last = make_context({'/r/a.py': '1', '/r/b.py': '2'})
+    current = make_context({'/r/a.py': '1', '/r/b.py': '3'})
+    changed = context_manager.ContextManager(root='/r').get_tools_changed_since_last_save(
+        {'last_saved': {'t': last}, 'current_state': {'t': current}},
+    )
+    utaw.assertEqual(changed['t'].affected_files, ['/r/b.py'])
+    utaw.assertEqual(changed['t'], current)
+    utaw.assertEqual(current.affected_files, ())
+
+
+def test_file_maps_follow_file_sets():
+    """Test that a tool's file maps are updated as its files come and go, and what no tool has any more is freed."""
+    with tempfile.TemporaryDirectory() as root:
+        root = pathlib.Path(root)
+        for this_name in ('a.py', 'b.py', 'c.py'):
+            (root / this_name).write_text(this_name)
+            # old enough for their hashes to be kept
+            os.utime(root / this_name, (1, 1))
+        manager = context_manager.ContextManager(root=root)
+
+        def get_contexts(tools, targets):
+            config = {'tools': tools}
+            for this_tool in tools:
+                config.update({
+                    f'{this_tool}_targets': [str(root / t) for t in targets], f'{this_tool}_triggers': [],
+                    f'{this_tool}_args': [], f'{this_tool}_preconditions': [], f'{this_tool}_limits': {},
+                    f'{this_tool}_affected_by': 'content', f'{this_tool}_coverage': {}, f'{this_tool}_output_rules': {},
+                })
+            return manager._get_contexts_for(config)
+
+        first = get_contexts(['flake8', 'pylint'], ['a.py', 'b.py'])
+        utaw.assertIs(first['flake8']['target files'], first['pylint']['target files'])
+        second = get_contexts(['flake8'], ['a.py', 'c.py'])
+        utaw.assertEqual(
+            second['flake8'].trees['target files'].hash,
+            merkle.MerkleTree.from_hashes(second['flake8']['target files'], root=root).hash,
+        )
+        utaw.assertEqual({s[1] for s in manager._file_maps}, {'flake8'})
+        utaw.assertEqual(set(manager._hashes), {str(root / 'a.py'), str(root / 'c.py')})
+        get_contexts([], [])
+        utaw.assertEqual((manager._file_maps, manager._hashes), ({}, {}))
+
+
+def test_digest_ignores_affected_files():
+    """Test that the result digest is independent of which files were affected, and of where the project is."""
+    context = {'target files': {'/a/a.py': 'abc'}, 'trigger files': {}, 'config': ['/a/a.py'], 'preconditions': [], 'limits': {}}
+    affected = dict(context, **{'affected files': ['/a/a.py']})
+    changed = dict(context, **{'target files': {'/a/a.py': 'def'}})
+    cloned = dict(context, **{'target files': {'/b/a.py': 'abc'}, 'config': ['/b/a.py']})
+    digest = digests.get_digest('flake8', context, root='/a')
+    utaw.assertEqual(digest, digests.get_digest('flake8', affected, root='/a'))
+    utaw.assertEqual(digest, digests.get_digest('flake8', cloned, root='/b'))
+    utaw.assertNotEqual(digest, digests.get_digest('flake8', changed, root='/a'))
+    utaw.assertNotEqual(digest, digests.get_digest('pylint', context, root='/a'))
+
+
+@dado.data_driven(['config', 'checked', 'targets'], {
+    'never_checked': [['{affected_targets}'], {}, ['a.py', 'b.py', 'c.py']],
+    'checked_and_passed': [['{affected_targets}'], {'1': 0, '2': 0, '3': 0}, []],
+    'checked_and_failed': [['{affected_targets}'], {'1': 0, '2': 1, '3': 0}, ['b.py']],
+    'partly_checked': [['{affected_targets}'], {'1': 0}, ['b.py', 'c.py']],
+    'no_targets_used': [['.'], {}, []],
+})
+def test_get_targets(config, checked, targets):
+    """Test that only content never checked under the current config, or which failed, is targeted."""
+    context = {'config': config, 'target files': {'a.py': '1', 'b.py': '2', 'c.py': '3'}}
+    utaw.assertEqual(ToolRunner._get_targets(context=context, checked=checked), targets)
+
+
+@dado.data_driven(['source', 'module', 'is_package', 'imports'], {
+    'absolute': [b'import a.b, c', 'x', False, ['a.b', 'c']],
+    'from': [b'from a import b', 'x', False, ['a', 'a.b']],
+    'relative_in_module': [b'from .b import c', 'a.x', False, ['a.b', 'a.b.c']],
+    'relative_in_package': [b'from . import b', 'a', True, ['a', 'a.b']],
+    'parent_relative': [b'from ..b import c', 'a.x.y', False, ['a.b', 'a.b.c']],
+    'past_the_top': [b'from ... import b', 'a', False, []],
+    'star': [b'from a import *', 'x', False, ['a']],
+    'syntax_error': [b'import (', 'x', False, []],
+})
+def test_parse_imports(source, module, is_package, imports):
+    """Test parsing the modules imported by a source file."""
+    utaw.assertEqual(import_graph.parse_imports(source, module=module, is_package=is_package), imports)
+
+
+def test_import_closure():
+    """Test finding everything a file transitively imports, including the packages of imported modules."""
+    graph = import_graph.get_dependencies({
+        'test_a.py': ['pkg.helpers', 'pkg.helpers.X'],
+        'test_b.py': ['pkg.other', 'os'],
+        'pkg/__init__.py': [],
+        'pkg/helpers.py': ['pkg.core'],
+        'pkg/core.py': ['pkg.helpers'],
+        'pkg/other.py': [],
+    })
+    utaw.assertEqual(import_graph.get_closure(graph, 'test_a.py'), {'pkg/__init__.py', 'pkg/helpers.py', 'pkg/core.py'})
+    utaw.assertEqual(import_graph.get_closure(graph, 'test_b.py'), {'pkg/__init__.py', 'pkg/other.py'})
+    utaw.assertEqual(import_graph.get_closure(graph, 'pkg/other.py'), set())
+
+
+def test_fold_in_imports():
+    """Test that only the modules a target imports stop being triggers - those the graph can't resolve still trigger."""
+    with tempfile.TemporaryDirectory() as directory:
+        root = pathlib.Path(directory)
+        files = {
+            'test_a.py': 'import pkg.helpers\nimport app.core\n',
+            'pkg/__init__.py': '',
+            'pkg/helpers.py': '',
+            'src/app/__init__.py': '',
+            'src/app/core.py': '',
+            'conftest.py': '',
+            'setup.cfg': '',
+        }
+        for name, content in files.items():
+            (root / name).parent.mkdir(parents=True, exist_ok=True)
+            (root / name).write_text(content)
+        hashes = {str(root / n): hashlib.sha1(c.encode('utf-8')).hexdigest() for n, c in files.items()}
+        target_files = {p: h for p, h in hashes.items() if p.endswith('test_a.py')}
+        trigger_files = {p: h for p, h in hashes.items() if p not in target_files}
+        _folded, triggers = context_manager.ContextManager(root=root)._fold_in_imports(
+            target_files=target_files, trigger_files=trigger_files,
+        )
+    utaw.assertEqual(
+        sorted(str(pathlib.Path(p).relative_to(root)) for p in triggers),
+        ['conftest.py', 'setup.cfg', 'src/app/__init__.py', 'src/app/core.py'],
+    )
+
+
+def test_decode_numbits():
+    """Test decoding coverage.py's bitmaps of line numbers."""
+    utaw.assertEqual(coverage_map.decode_numbits(bytes([0b10, 0, 0b10000001])), [1, 16, 23])
+
+
+@dado.data_driven(['new_lines', 'changed'], {
+    'unchanged': [[b'a', b'b', b'c'], set()],
+    'replaced': [[b'a', b'x', b'c'], {2}],
+    'deleted': [[b'a', b'c'], {2}],
+    'inserted': [[b'a', b'b', b'x', b'c'], {2, 3}],
+    'appended': [[b'a', b'b', b'c', b'x'], {3, 4}],
+})
+def test_changed_lines(new_lines, changed):
+    """Test finding the old lines touched by a change, including the lines around insertions."""
+    utaw.assertEqual(coverage_map.get_changed_lines([b'a', b'b', b'c'], new_lines), changed)
+
+
+def test_prune_test_ids():
+    """Test dropping test IDs for removed files, and for files being run whole."""
+    with tempfile.TemporaryDirectory() as root:
+        for name in ('test_a.py', 'test_b.py'):
+            open(f'{root}/{name}', 'w', encoding='utf-8').close()
+        utaw.assertEqual(
+            coverage_map.prune_test_ids(
+                {'test_a.py::test_x', 'test_b.py', 'test_b.py::test_y', 'test_c.py::test_z'},
+                root=root,
+            ),
+            ['test_a.py::test_x', 'test_b.py'],
+        )
+
+
+@dado.data_driven(['full_run_failed', 'selected'], {
+    'full_run_passed': [False, []],
+    'full_run_failed': [True, None],
+})
+def test_select_after_full_run(full_run_failed, selected):
+    """Test that only a full run can follow a failed one, since which of its tests failed isn't known."""
+    with tempfile.TemporaryDirectory() as root:
+        pathlib.Path(root, 'a.py').write_text('a = 1\n', encoding='utf-8')
+        state = {'lines': {}, 'sources': {'a.py': 'abc'}, 'runs since full': 0, 'failing': [], 'full run failed': full_run_failed}
+        map_path = pathlib.Path(root, 'map')
+        map_path.write_bytes(zlib.compress(json.dumps(state).encode('utf-8')))
+        selection = coverage_map.CoverageMap(map_path, sources_path=pathlib.Path(root, 'sources')).select_tests(
+            source_hashes={f'{root}/a.py': 'abc'}, target_files={}, root=pathlib.Path(root), full_run_every=10,
+        )
+    utaw.assertEqual(selection, selected)
+
+
+def test_record_without_coverage_data():
+    """Test that recording a run which left no coverage data says so, and leaves the map alone."""
+    with tempfile.TemporaryDirectory() as root:
+        map_path = pathlib.Path(root, 'map')
+        recorded = coverage_map.CoverageMap(map_path, sources_path=pathlib.Path(root, 'sources')).record(
+            pathlib.Path(root, '.coverage'), source_hashes={}, root=pathlib.Path(root), full_run=True, selected=[], return_code=0,
+        )
+        utaw.assertFalse(recorded)
+        utaw.assertFalse(map_path.exists())
+
+
+@dado.data_driven(['data', 'partial', 'lines', 'new_partial'], {
+    'whole_lines': [b'a\nb\n', b'', b'> a\n> b\n', b''],
+    'partial_line': [b'a\nb', b'', b'> a\n', b'b'],
+    'continued_line': [b'b\nc', b'a', b'> ab\n', b'c'],
+    'no_newline': [b'b', b'a', b'', b'ab'],
+})
+def test_format_lines(data, partial, lines, new_partial):
+    """Test formatting output as whole, prefixed lines, holding back partial lines."""
+    utaw.assertEqual(renderer.format_lines(data, partial=partial, prefix=b'> '), (lines, new_partial))
+
+
+def test_status():
+    """Test the status line of the running tools."""
+    utaw.assertEqual(renderer.get_status({}, now=10), b'')
+    utaw.assertEqual(renderer.get_status({'b': 7.5, 'a': 1}, now=10), b'[pocketwalk] running: a 9s, b 2s')
+
+
+def test_unstarted_renderer():
+    """Test that a renderer which hasn't been started writes messages, and saved output, straight to stdout."""
+    with tempfile.TemporaryDirectory() as root:
+        output_path = pathlib.Path(root, 'lint.output')
+        output_store.save_output(output_path, b'saved\n')
+        stdout = io.TextIOWrapper(io.BytesIO())
+        with patch('sys.stdout', stdout):
+            rendering = renderer.Renderer()
+            rendering.message(b'message\n')
+            rendering.saved_output(output_path)
+    utaw.assertEqual(stdout.buffer.getvalue(), b'message\nsaved\n')
+
+
+def test_save_result():
+    """Test that results with a failure reason aren't cached, and that the cache is kept under its max size."""
+    with tempfile.TemporaryDirectory() as root:
+        root = pathlib.Path(root)
+        cache = result_cache.ResultCache(backends=[], root=root)
+        (root / 'output').write_bytes(b'x' * 600 * 1024)
+        config = {'cache_size': 1}
+
+        def save(tool, failure_reason=None):
+            result = {'output': root / 'output', 'return codes': {str(root / 'a.py'): 0, '*': 1}, 'failure reason': failure_reason}
+            asyncio.run(cache.save_result(tool, context={'config': tool}, result=result, config=config))
+            return asyncio.run(cache.get_cached_results({tool: {'config': tool}}, config=config))
+
+        utaw.assertEqual(save('killed', failure_reason="timed out"), {})
+        # another process saving the same result first is no different
+        with patch.object(pathlib.Path, 'rename', side_effect=FileExistsError):
+            utaw.assertEqual(save('raced'), {})
+        utaw.assertEqual(save('first')['first']['return codes'], {str(root / 'a.py'): 0, '*': 1})
+        # the second result takes the cache over its max size, evicting the first
+        utaw.assertIn('second', save('second'))
+        utaw.assertEqual(len(list((root / '.pocketwalk.cache' / 'results').iterdir())), 1)
+
+
+@dado.data_driven(['limits', 'script', 'return_code'], {
+    'unlimited': [{}, "import os; print(os.sched_getaffinity(0))", 0],
+    'nice': [{'nice': 5}, "import os, sys; sys.exit(os.getpriority(os.PRIO_PROCESS, 0))", 5],
+    'affinity': [{'cpu affinity': [0]}, "import os, sys; sys.exit(os.sched_getaffinity(0) != {0})", 0],
+    'memory': [{'max memory': 200}, "bytearray(400 * 1024 * 1024)", 1],
+    'cpu_time': [{'max cpu time': 3}, "import resource, sys; sys.exit(resource.getrlimit(resource.RLIMIT_CPU) != (3, 4))", 0],
+    'bad_affinity': [{'cpu affinity': [100000]}, "print('ran without its limits')", 1],
+})
+def test_spawn(limits, script, return_code):
+    """Test that tools are spawned with their limits already in place, or not run at all, if they can't be applied."""
+    with tempfile.TemporaryDirectory() as root:
+        process = processes.spawn([sys.executable, '-c', script], limits=limits, cwd=root, stdout=subprocess.PIPE)
+        output = process.stdout.read()
+        process.stdout.close()
+        utaw.assertIsNotNone(processes.reap(process, block=True))
+        utaw.assertEqual(process.returncode, return_code)
+        utaw.assertNotIn(b'without its limits', output)
+
+
+def test_payload_round_trip():
+    """Test that shared cache payloads unpack to the sections they were packed from."""
+    sections = [b'return codes', b'', b'\x00output\n' * 100]
+    utaw.assertEqual(result_cache.unpack_payload(result_cache.pack_payload(sections)), sections)
+    for this_end in (2, 10):
+        with utaw.assertRaises(ValueError):
+            result_cache.unpack_payload(result_cache.pack_payload(sections)[:this_end])
+
+
+@dado.data_driven(['text', 'return_codes'], {
+    'relative': ['[\'return codes\']\n"a.py" = 0\n"b/c.py" = 1\n', {'/r/a.py': 0, '/r/b/c.py': 1}],
+    'absolute': ['[\'return codes\']\n"/s/a.py" = 0\n', {'/s/a.py': 0}],
+    'untargeted': ['[\'return codes\']\n"*" = 2\n', {'*': 2}],
+    'missing': ['tool = "t"\n', None],
+    'malformed': ['[\'return codes\'\n', None],
+    'not_codes': ['[\'return codes\']\n"a.py" = "x"\n', None],
+})
+def test_parse_result(text, return_codes):
+    """Test that cached results' paths are made absolute, and malformed results are rejected."""
+    if return_codes is None:
+        with utaw.assertRaises(ValueError):
+            result_cache.parse_result(text, root='/r')
+    else:
+        utaw.assertEqual(result_cache.parse_result(text, root='/r'), return_codes)
+
+
+class StandInCacheHandler(http.server.BaseHTTPRequestHandler):
+    """A stand-in for a shared cache server, storing payloads in memory."""
+
+    payloads = {}  # type: dict
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Serve a payload."""
+        if self.path not in self.payloads:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(self.payloads[self.path])
+
+    def do_PUT(self) -> None:  # pylint: disable=invalid-name
+        """Store a payload."""
+        self.payloads[self.path] = self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(201)
+        self.end_headers()
+
+    def log_message(self, *_args: typing.Any) -> None:
+        """Don't log requests."""
+
+
+def test_http_backend():
+    """Test publishing to and fetching from a shared cache over HTTP."""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInCacheHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        backend = cache_backends.HTTPBackend()
+        config = {'cache_url': f'http://127.0.0.1:{server.server_address[1]}/results/'}
+        utaw.assertTrue(backend.enabled(config))
+        utaw.assertIsNone(backend.fetch('abc123', config=config))
+        backend.publish('abc123', b'payload', config=config)
+        utaw.assertEqual(backend.fetch('abc123', config=config), b'payload')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_directory_backend():
+    """Test publishing to and fetching from a shared cache directory."""
+    with tempfile.TemporaryDirectory() as cache_dir:
+        backend = cache_backends.DirectoryBackend()
+        config = {'cache_dir': cache_dir}
+        utaw.assertTrue(backend.enabled(config))
+        utaw.assertFalse(backend.enabled({'cache_dir': None}))
+        utaw.assertIsNone(backend.fetch('abc123', config=config))
+        backend.publish('abc123', b'payload', config=config)
+        utaw.assertEqual(backend.fetch('abc123', config=config), b'payload')
+
+
 def is_coro(maybe_coro: typing.Any) -> bool:
     """Return whether or not the thing is a coro."""
     try: